@@ -5,9 +5,24 @@ Merges multiple PDF files into a single PDF document
 
 from fastapi import Request
 from fastapi.responses import FileResponse
-from PyPDF2 import PdfMerger, PdfReader
+from PyPDF2 import PdfReader, PdfWriter
+import asyncio
 import tempfile
 import os
+import sys
+
+# Make the shared backend helpers importable
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if TOOLS_DIR not in sys.path:
+    sys.path.insert(0, TOOLS_DIR)
+
+from shared.executor import run_blocking
+from shared.uploads import iter_form, max_upload_size, UploadTooLarge
+from shared.pdf_stitch import dedupe_objects
+
+TOOL_NAME = 'pdf-merger'
+MAX_UPLOAD_SIZE = max_upload_size(TOOL_NAME, 200)
+MAX_TOTAL_UPLOAD_SIZE = max_upload_size(TOOL_NAME + '-total', 1024)
 
 
 async def execute(request: Request):
@@ -16,84 +31,65 @@ async def execute(request: Request):
     
     Expected form data:
     - files: Multiple PDF files
-    - order: Order indices for each file (matching file order)
+    - order: Order indices for each file (the n-th order belongs to the n-th
+      file, wherever the fields are in the form)
+    - dedup: Optional, "true" to store identical fonts, images and other
+      resources shared by the inputs only once
+    
+    Each file is parsed as soon as its upload completes, while the rest of the
+    request is still arriving, and appended to the output once its position is known.
     """
+    temp_files = []
+    output_path = None
+    dedup = False
+    merge = StreamingMerge()
+    
     try:
-        # Get form data
-        form = await request.form()
-        
-        # Get all uploaded files and orders
-        files = []
-        orders = []
-        
-        # Iterate through form data
-        for key, value in form.multi_items():
-            if key == 'files':
-                files.append(value)
-            elif key == 'order':
-                orders.append(value)
-        
-        if not files:
-            return {"error": "No PDF files provided"}, 400
-        
-        if len(files) < 2:
-            return {"error": "At least 2 PDF files are required for merging"}, 400
-        
-        # Create list of file data with order
-        file_data = []
-        for i, file in enumerate(files):
-            order = int(orders[i]) if i < len(orders) else i
-            file_data.append({
-                'file': file,
-                'order': order,
-                'filename': file.filename or f'file_{i}.pdf'
-            })
-        
-        # Sort by order
-        file_data.sort(key=lambda x: x['order'])
-        
-        # Create temporary files for each uploaded PDF
-        temp_files = []
-        merger = PdfMerger()
+        try:
+            # Uploaded files are streamed to temporary files and handed over one by one
+            async for key, value in iter_form(request, MAX_UPLOAD_SIZE, MAX_TOTAL_UPLOAD_SIZE):
+                if key == 'files' and not isinstance(value, str):
+                    temp_files.append(value.path)
+                    merge.add_file(value.path, value.filename or f'file_{len(merge.inputs)}.pdf')
+                elif key == 'files':
+                    continue
+                elif key == 'order':
+                    merge.set_order(value)
+                elif key == 'dedup':
+                    dedup = value.lower() in ('1', 'true', 'yes', 'on')
+        except UploadTooLarge as e:
+            await merge.close()
+            cleanup_files(*temp_files)
+            return {"error": str(e)}, 413
+        except ValueError as e:
+            # Invalid order value
+            await merge.close()
+            cleanup_files(*temp_files)
+            return {"error": str(e)}, 400
         
         try:
-            # Process each file
-            for data in file_data:
-                file = data['file']
-                
-                # Read file content
-                content = await file.read()
-                
-                # Save to temporary file
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-                    tmp.write(content)
-                    temp_path = tmp.name
-                    temp_files.append(temp_path)
-                
-                # Validate PDF
-                try:
-                    reader = PdfReader(temp_path)
-                    if len(reader.pages) == 0:
-                        return {"error": f"PDF file '{data['filename']}' has no pages"}, 400
-                    
-                    # Add to merger
-                    merger.append(temp_path)
-                    print(f"Added: {data['filename']} ({len(reader.pages)} pages)")
-                    
-                except Exception as e:
-                    return {"error": f"Error reading PDF '{data['filename']}': {str(e)}"}, 400
+            if not merge.inputs:
+                await merge.close()
+                cleanup_files(*temp_files)
+                return {"error": "No PDF files provided"}, 400
+            
+            if len(merge.inputs) < 2:
+                await merge.close()
+                cleanup_files(*temp_files)
+                return {"error": "At least 2 PDF files are required for merging"}, 400
             
             # Create output file
             with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_output:
                 output_path = tmp_output.name
             
-            # Write merged PDF
-            with open(output_path, 'wb') as output_file:
-                merger.write(output_file)
-            
-            merger.close()
+            # Append whatever is left and write the merged PDF
+            try:
+                total_pages = await merge.finish(output_path, dedup)
+            except ValueError as e:
+                cleanup_files(output_path, *temp_files)
+                return {"error": str(e)}, 400
             
-            print(f"Successfully merged {len(file_data)} PDFs")
+            print(f"Successfully merged {len(merge.inputs)} PDFs ({total_pages} pages)")
             
             # Return the merged PDF
             return FileResponse(
@@ -102,20 +98,165 @@ async def execute(request: Request):
                 media_type='application/pdf',
                 background=lambda: cleanup_files(output_path, *temp_files)
             )
-            
+        
         except Exception as e:
             # Cleanup on error
-            merger.close()
-            cleanup_files(None, *temp_files)
+            cleanup_files(output_path, *temp_files)
             raise e
-            
+    
     except Exception as e:
+        await merge.close()
+        cleanup_files(*temp_files)
         print(f"Error merging PDFs: {e}")
         import traceback
         traceback.print_exc()
         return {"error": str(e)}, 500
 
 
+class StreamingMerge:
+    """
+    Merges PDFs while they are being uploaded. Each input is parsed once, in
+    the executor, as soon as its upload completes; that parse is used both to
+    validate it and to append its pages.
+    
+    The n-th order index belongs to the n-th file, whichever of the two
+    arrives first. Pages are appended eagerly while the order indices come
+    in ascending order (what the web UI sends). Inputs that arrive out of order are
+    appended at the end, and if an earlier eager append turns out to be out
+    of place the output is rebuilt from the already parsed inputs.
+    """
+    
+    def __init__(self):
+        self.inputs = []       # [{'filename', 'order', 'parsed'}] in upload order
+        self.orders = []       # Order indices in the order they arrived
+        self.writer = PdfWriter()
+        self.appended = []     # Indices of inputs appended to writer, in order
+        self._queue = asyncio.Queue()
+        self._queued_order = None
+        self._in_order = True
+        self._appender = None
+    
+    def add_file(self, path: str, filename: str):
+        """Start parsing an uploaded file in the executor"""
+        parsed = asyncio.ensure_future(run_blocking(TOOL_NAME, open_pdf, path, filename, kind='thread'))
+        self.inputs.append({'filename': filename, 'order': None, 'parsed': parsed})
+        self._match_orders()
+    
+    def set_order(self, value: str):
+        """Add the next order index (matched to a file by position); raises ValueError if it isn't an integer"""
+        try:
+            self.orders.append(int(value))
+        except ValueError:
+            raise ValueError(f"Invalid order value: {value!r}")
+        self._match_orders()
+    
+    def _match_orders(self):
+        """Give each file its order index once both have arrived, queueing in-order files for appending"""
+        for index in range(len(self.inputs)):
+            data = self.inputs[index]
+            if data['order'] is not None:
+                continue
+            if index >= len(self.orders):
+                return
+            data['order'] = self.orders[index]
+            
+            if self._in_order and (self._queued_order is None or data['order'] >= self._queued_order):
+                if self._appender is None:
+                    self._appender = asyncio.ensure_future(self._append_queued())
+                self._queued_order = data['order']
+                self._queue.put_nowait(index)
+            else:
+                self._in_order = False
+    
+    async def _append_queued(self):
+        while True:
+            index = await self._queue.get()
+            if index is None:
+                return
+            await self._append(index)
+    
+    async def _append(self, index: int):
+        reader, handle, page_count = await self.inputs[index]['parsed']
+        await run_blocking(TOOL_NAME, self.writer.append, reader, kind='thread')
+        self.appended.append(index)
+        print(f"Added: {self.inputs[index]['filename']} ({page_count} pages)")
+    
+    async def finish(self, output_path: str, dedup: bool = False) -> int:
+        """
+        Append the remaining inputs in order and write the merged PDF,
+        optionally deduplicating shared resources first.
+        Returns total page count; raises ValueError for unreadable or empty PDFs
+        """
+        try:
+            for index, data in enumerate(self.inputs):
+                if data['order'] is None:
+                    data['order'] = index
+            merge_order = sorted(range(len(self.inputs)), key=lambda index: self.inputs[index]['order'])
+            
+            if self._appender is not None:
+                self._queue.put_nowait(None)
+                await self._appender
+            
+            if merge_order[:len(self.appended)] != self.appended:
+                # An out-of-order input belongs before ones already appended
+                self.writer = PdfWriter()
+                self.appended = []
+            
+            for index in merge_order[len(self.appended):]:
+                await self._append(index)
+            
+            if dedup:
+                removed = await run_blocking(TOOL_NAME, dedupe_objects, self.writer, kind='thread')
+                print(f"Deduplicated {removed} objects")
+            
+            # Write merged PDF
+            with open(output_path, 'wb') as output_file:
+                await run_blocking(TOOL_NAME, self.writer.write, output_file, kind='thread')
+            
+            total_pages = 0
+            for data in self.inputs:
+                total_pages += (await data['parsed'])[2]
+            return total_pages
+        finally:
+            await self.close()
+    
+    async def close(self):
+        """Stop pending work and close the input files"""
+        if self._appender is not None and not self._appender.done():
+            self._appender.cancel()
+        for data in self.inputs:
+            parsed = data['parsed']
+            try:
+                _, handle, _ = await parsed
+            except BaseException:
+                continue
+            handle.close()
+
+
+def open_pdf(path: str, filename: str):
+    """
+    Parse a PDF once for validating and merging (runs in the executor).
+    Returns (reader, file handle, page count); the reader reads from the open
+    file rather than a copy in memory, so the handle must stay open until the
+    merged PDF is written. Raises ValueError for unreadable or empty PDFs.
+    """
+    handle = open(path, 'rb')
+    try:
+        try:
+            reader = PdfReader(handle)
+            page_count = len(reader.pages)
+        except Exception as e:
+            raise ValueError(f"Error reading PDF '{filename}': {str(e)}")
+        
+        if page_count == 0:
+            raise ValueError(f"PDF file '{filename}' has no pages")
+    except Exception:
+        handle.close()
+        raise
+    
+    return reader, handle, page_count
+
+
 def cleanup_files(*file_paths):
     """Clean up temporary files"""
     for path in file_paths:
@@ -0,0 +1,98 @@
+"""
+Tests for the streaming merge: page order and resource dedup (run with pytest)
+"""
+
+import asyncio
+import importlib.util
+import os
+
+import pytest
+
+pikepdf = pytest.importorskip('pikepdf')
+
+# The tool directory isn't a package, so load main.py by path
+spec = importlib.util.spec_from_file_location(
+    'pdf_merger_main', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+)
+main = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(main)
+
+LOGO = bytes(range(256)) * 16
+
+# The shared executor's semaphores belong to the first event loop that uses them
+LOOP = asyncio.new_event_loop()
+
+
+def make_pdf(path, width: int, pages: int = 1):
+    """PDF whose pages are width points wide (to tell the inputs apart), each drawing the same image"""
+    pdf = pikepdf.new()
+    for _ in range(pages):
+        image = pikepdf.Stream(pdf, LOGO)
+        image.Type = pikepdf.Name.XObject
+        image.Subtype = pikepdf.Name.Image
+        image.Width, image.Height = 64, 64
+        image.ColorSpace = pikepdf.Name.DeviceGray
+        image.BitsPerComponent = 8
+        page = pikepdf.Dictionary(
+            Type=pikepdf.Name.Page,
+            MediaBox=[0, 0, width, 200],
+            Resources=pikepdf.Dictionary(XObject=pikepdf.Dictionary(Im0=image)),
+            Contents=pikepdf.Stream(pdf, b'q 64 0 0 64 10 10 cm /Im0 Do Q'),
+        )
+        pdf.pages.append(pikepdf.Page(page))
+    pdf.save(path)
+    return str(path)
+
+
+def merge(tmp_path, inputs: list, orders: list, dedup: bool = False):
+    """
+    Merge (path, filename) inputs with order indices arriving after all
+    files; returns (page widths, whether the output was rebuilt)
+    """
+    output_path = str(tmp_path / 'merged.pdf')
+
+    async def run():
+        merge = main.StreamingMerge()
+        for path, filename in inputs:
+            merge.add_file(path, filename)
+        for order in orders:
+            merge.set_order(str(order))
+            # Let the eager appends run between order fields, as during an upload
+            await asyncio.sleep(0.05)
+        eager_writer = merge.writer
+        await merge.finish(output_path, dedup=dedup)
+        return merge.writer is not eager_writer
+
+    rebuilt = LOOP.run_until_complete(run())
+    with pikepdf.open(output_path) as pdf:
+        widths = [int(page.MediaBox[2]) for page in pdf.pages]
+    return widths, rebuilt
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    return [(make_pdf(tmp_path / f'{index}.pdf', 100 + index), f'{index}.pdf') for index in range(3)]
+
+
+def test_merge_in_order(tmp_path, inputs):
+    widths, rebuilt = merge(tmp_path, inputs, [0, 1, 2])
+    assert widths == [100, 101, 102]
+    assert not rebuilt
+
+
+def test_merge_rebuilds_out_of_order(tmp_path, inputs):
+    # The third file belongs before the second, which was already appended
+    widths, rebuilt = merge(tmp_path, inputs, [0, 2, 1])
+    assert widths == [100, 102, 101]
+    assert rebuilt
+
+
+def test_merge_dedup_keeps_one_copy(tmp_path):
+    inputs = [(make_pdf(tmp_path / f'{index}.pdf', 100 + index, pages=2), f'{index}.pdf') for index in range(3)]
+    widths, _ = merge(tmp_path, inputs, [2, 1, 0], dedup=True)
+    assert widths == [102, 102, 101, 101, 100, 100]
+    with pikepdf.open(str(tmp_path / 'merged.pdf')) as pdf:
+        images = {page.Resources.XObject.Im0.objgen for page in pdf.pages}
+        contents = {page.Contents.objgen for page in pdf.pages}
+        assert len(images) == 1 and len(contents) == 1
+        assert pdf.pages[0].Resources.XObject.Im0.read_bytes() == LOGO
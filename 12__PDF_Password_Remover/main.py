@@ -8,6 +8,18 @@ from fastapi.responses import FileResponse, JSONResponse
 from PyPDF2 import PdfReader, PdfWriter
 import tempfile
 import os
+import sys
+
+# Make the shared backend helpers importable
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if TOOLS_DIR not in sys.path:
+    sys.path.insert(0, TOOLS_DIR)
+
+from shared.executor import run_blocking
+from shared.uploads import read_form, max_upload_size, UploadTooLarge
+
+TOOL_NAME = 'pdf-password-remover'
+MAX_UPLOAD_SIZE = max_upload_size(TOOL_NAME, 200)
 
 
 async def execute(request: Request):
@@ -21,12 +33,20 @@ async def execute(request: Request):
     try:
         print("[PDF Password Remover] Processing request")
         
-        # Get form data
-        form = await request.form()
+        # Get form data (uploaded file is streamed to a temporary file)
+        try:
+            form = await read_form(request, MAX_UPLOAD_SIZE)
+        except UploadTooLarge as e:
+            return JSONResponse(
+                {"error": str(e)}, 
+                status_code=413
+            )
+        
         pdf_file = form.get('file')
         password = form.get('password', '')
         
-        if not pdf_file:
+        if not pdf_file or isinstance(pdf_file, str):
+            form.cleanup()
             print("[PDF Password Remover] Error: No file provided")
             return JSONResponse(
                 {"error": "No PDF file provided"}, 
@@ -35,62 +55,31 @@ async def execute(request: Request):
         
         if not password:
             print("[PDF Password Remover] Error: No password provided")
+            form.cleanup()
             return JSONResponse(
                 {"error": "No password provided"}, 
                 status_code=400
             )
         
-        # Read the uploaded PDF
-        pdf_content = await pdf_file.read()
-        print(f"[PDF Password Remover] File received: {pdf_file.filename} ({len(pdf_content)} bytes)")
+        print(f"[PDF Password Remover] File received: {pdf_file.filename} ({pdf_file.size} bytes)")
         
-        # Save to temporary input file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_input:
-            tmp_input.write(pdf_content)
-            input_path = tmp_input.name
+        input_path = pdf_file.path
         
         try:
-            # Try to read PDF
-            reader = PdfReader(input_path)
-            
-            # Check if PDF is encrypted
-            if not reader.is_encrypted:
-                cleanup_files(input_path)
-                print("[PDF Password Remover] PDF is not password-protected")
-                return JSONResponse(
-                    {"error": "This PDF is not password-protected"}, 
-                    status_code=400
-                )
-            
-            # Try to decrypt with provided password
-            decrypt_result = reader.decrypt(password)
-            
-            if decrypt_result == 0:
-                # Password is incorrect
-                cleanup_files(input_path)
-                print("[PDF Password Remover] Incorrect password")
-                return JSONResponse(
-                    {"error": "Incorrect password. Please try again."}, 
-                    status_code=400
-                )
-            
-            # Password is correct, now create unlocked version
-            writer = PdfWriter()
-            
-            # Copy all pages to writer
-            for page in reader.pages:
-                writer.add_page(page)
-            
-            # Copy metadata if available
-            if reader.metadata:
-                writer.add_metadata(reader.metadata)
-            
             # Save to temporary output file
             with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_output:
                 output_path = tmp_output.name
             
-            with open(output_path, 'wb') as output_file:
-                writer.write(output_file)
+            # Decrypt in the shared executor (PyPDF2 work is blocking)
+            try:
+                await run_blocking(TOOL_NAME, unlock_pdf, input_path, output_path, password)
+            except ValueError as e:
+                cleanup_files(input_path, output_path)
+                print(f"[PDF Password Remover] {str(e)}")
+                return JSONResponse(
+                    {"error": str(e)}, 
+                    status_code=400
+                )
             
             print(f"[PDF Password Remover] Success: Removed password from {pdf_file.filename}")
             
@@ -110,7 +99,7 @@ async def execute(request: Request):
             
         except Exception as e:
             # Cleanup on error
-            cleanup_files(input_path, None)
+            cleanup_files(input_path, output_path if 'output_path' in locals() else None)
             print(f"[PDF Password Remover] Error: {str(e)}")
             raise e
             
@@ -124,6 +113,40 @@ async def execute(request: Request):
         )
 
 
+def unlock_pdf(input_path: str, output_path: str, password: str):
+    """
+    Write a decrypted copy of the PDF (runs in the executor)
+    Raises ValueError if the PDF is not encrypted or the password is wrong
+    """
+    # Try to read PDF
+    reader = PdfReader(input_path)
+    
+    # Check if PDF is encrypted
+    if not reader.is_encrypted:
+        raise ValueError("This PDF is not password-protected")
+    
+    # Try to decrypt with provided password
+    decrypt_result = reader.decrypt(password)
+    
+    if decrypt_result == 0:
+        # Password is incorrect
+        raise ValueError("Incorrect password. Please try again.")
+    
+    # Password is correct, now create unlocked version
+    writer = PdfWriter()
+    
+    # Copy all pages to writer
+    for page in reader.pages:
+        writer.add_page(page)
+    
+    # Copy metadata if available
+    if reader.metadata:
+        writer.add_metadata(reader.metadata)
+    
+    with open(output_path, 'wb') as output_file:
+        writer.write(output_file)
+
+
 def cleanup_files(*file_paths):
     """Clean up temporary files"""
     for path in file_paths:
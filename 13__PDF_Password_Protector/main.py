@@ -8,6 +8,18 @@ from fastapi.responses import FileResponse, JSONResponse
 from PyPDF2 import PdfReader, PdfWriter
 import tempfile
 import os
+import sys
+
+# Make the shared backend helpers importable
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if TOOLS_DIR not in sys.path:
+    sys.path.insert(0, TOOLS_DIR)
+
+from shared.executor import run_blocking
+from shared.uploads import read_form, max_upload_size, UploadTooLarge
+
+TOOL_NAME = 'pdf-password-protector'
+MAX_UPLOAD_SIZE = max_upload_size(TOOL_NAME, 200)
 
 
 async def execute(request: Request):
@@ -21,12 +33,20 @@ async def execute(request: Request):
     try:
         print("[PDF Password Protector] Processing request")
         
-        # Get form data
-        form = await request.form()
+        # Get form data (uploaded file is streamed to a temporary file)
+        try:
+            form = await read_form(request, MAX_UPLOAD_SIZE)
+        except UploadTooLarge as e:
+            return JSONResponse(
+                {"error": str(e)}, 
+                status_code=413
+            )
+        
         pdf_file = form.get('file')
         password = form.get('password', '')
         
-        if not pdf_file:
+        if not pdf_file or isinstance(pdf_file, str):
+            form.cleanup()
             print("[PDF Password Protector] Error: No file provided")
             return JSONResponse(
                 {"error": "No PDF file provided"}, 
@@ -35,6 +55,7 @@ async def execute(request: Request):
         
         if not password:
             print("[PDF Password Protector] Error: No password provided")
+            form.cleanup()
             return JSONResponse(
                 {"error": "No password provided"}, 
                 status_code=400
@@ -42,53 +63,31 @@ async def execute(request: Request):
         
         if len(password) < 4:
             print("[PDF Password Protector] Error: Password too short")
+            form.cleanup()
             return JSONResponse(
                 {"error": "Password must be at least 4 characters long"}, 
                 status_code=400
             )
         
-        # Read the uploaded PDF
-        pdf_content = await pdf_file.read()
-        print(f"[PDF Password Protector] File received: {pdf_file.filename} ({len(pdf_content)} bytes)")
+        print(f"[PDF Password Protector] File received: {pdf_file.filename} ({pdf_file.size} bytes)")
         
-        # Save to temporary input file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_input:
-            tmp_input.write(pdf_content)
-            input_path = tmp_input.name
+        input_path = pdf_file.path
         
         try:
-            # Read PDF
-            reader = PdfReader(input_path)
-            
-            # Check if PDF is already encrypted
-            if reader.is_encrypted:
-                cleanup_files(input_path)
-                print("[PDF Password Protector] PDF is already password-protected")
-                return JSONResponse(
-                    {"error": "This PDF is already password-protected. Please remove the existing password first."}, 
-                    status_code=400
-                )
-            
-            # Create writer and add all pages
-            writer = PdfWriter()
-            
-            # Copy all pages to writer
-            for page in reader.pages:
-                writer.add_page(page)
-            
-            # Copy metadata if available
-            if reader.metadata:
-                writer.add_metadata(reader.metadata)
-            
-            # Encrypt the PDF with password
-            writer.encrypt(password)
-            
             # Save to temporary output file
             with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_output:
                 output_path = tmp_output.name
             
-            with open(output_path, 'wb') as output_file:
-                writer.write(output_file)
+            # Encrypt in the shared executor (PyPDF2 work is blocking)
+            try:
+                await run_blocking(TOOL_NAME, protect_pdf, input_path, output_path, password)
+            except ValueError as e:
+                cleanup_files(input_path, output_path)
+                print(f"[PDF Password Protector] {str(e)}")
+                return JSONResponse(
+                    {"error": str(e)}, 
+                    status_code=400
+                )
             
             print(f"[PDF Password Protector] Success: Added password protection to {pdf_file.filename}")
             
@@ -108,7 +107,7 @@ async def execute(request: Request):
             
         except Exception as e:
             # Cleanup on error
-            cleanup_files(input_path, None)
+            cleanup_files(input_path, output_path if 'output_path' in locals() else None)
             print(f"[PDF Password Protector] Error: {str(e)}")
             raise e
             
@@ -122,6 +121,36 @@ async def execute(request: Request):
         )
 
 
+def protect_pdf(input_path: str, output_path: str, password: str):
+    """
+    Write a password-protected copy of the PDF (runs in the executor)
+    Raises ValueError if the PDF is already encrypted
+    """
+    # Read PDF
+    reader = PdfReader(input_path)
+    
+    # Check if PDF is already encrypted
+    if reader.is_encrypted:
+        raise ValueError("This PDF is already password-protected. Please remove the existing password first.")
+    
+    # Create writer and add all pages
+    writer = PdfWriter()
+    
+    # Copy all pages to writer
+    for page in reader.pages:
+        writer.add_page(page)
+    
+    # Copy metadata if available
+    if reader.metadata:
+        writer.add_metadata(reader.metadata)
+    
+    # Encrypt the PDF with password
+    writer.encrypt(password)
+    
+    with open(output_path, 'wb') as output_file:
+        writer.write(output_file)
+
+
 def cleanup_files(*file_paths):
     """Clean up temporary files"""
     for path in file_paths:
@@ -1,9 +1,115 @@
 from fastapi import Request
 from fastapi.responses import FileResponse, JSONResponse
+from starlette.background import BackgroundTask
+from urllib.parse import quote
+from fractions import Fraction
+from collections import Counter
+from functools import reduce
+from math import gcd
+import asyncio
 import tempfile
+import json
 import os
-import subprocess
-import shutil
+import re
+import sys
+import time
+
+# Make the shared backend helpers importable
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if TOOLS_DIR not in sys.path:
+    sys.path.insert(0, TOOLS_DIR)
+
+from shared.process_runner import run_process, stream_process, process_limit, ProcessTimeout
+from shared.uploads import read_form, stream_form, save_upload, max_upload_size, UploadTooLarge, UploadStreamingResponse
+from shared.result_cache import get_cached, store_result
+from shared.jobs import ToolError, JOB_TIMEOUT, submit_job, wants_async, job_accepted, handle_job_request
+
+TOOL_NAME = 'video-to-audio'
+MAX_UPLOAD_SIZE = max_upload_size(TOOL_NAME, 2048)
+
+# Timeout for requests that wait for the result (background jobs use JOB_TIMEOUT)
+REQUEST_TIMEOUT = 300  # 5 minutes
+
+VALID_FORMATS = ['mp3', 'wav', 'aac', 'ogg', 'flac', 'm4a']
+
+# FFmpeg audio encoder per output format
+AUDIO_CODECS = {
+    'mp3': 'libmp3lame',
+    'aac': 'aac',
+    'm4a': 'aac',
+    'ogg': 'libvorbis',
+    'flac': 'flac',
+    'wav': 'pcm_s16le',
+}
+
+# Source codecs each output container can take as-is (remux with -c:a copy)
+COPY_CODECS = {
+    'mp3': {'mp3'},
+    'aac': {'aac'},
+    'm4a': {'aac', 'alac'},
+    'ogg': {'vorbis', 'opus'},
+    'flac': {'flac'},
+    'wav': {'pcm_s16le'},
+}
+
+# Approximate bitrate (bits/s) of each lossy quality setting, used to decide
+# whether copying the source audio is at least as small as re-encoding it
+TARGET_BITRATES = {
+    'mp3': {'high': 320000, 'medium': 192000, 'low': 128000},
+    'aac': {'high': 256000, 'medium': 128000, 'low': 96000},
+    'm4a': {'high': 256000, 'medium': 128000, 'low': 96000},
+    'ogg': {'high': 256000, 'medium': 160000, 'low': 112000},
+}
+
+PROBE_TIMEOUT = 30
+
+# Muxer options for writing each format to a pipe (no seeking back to fix up headers)
+PIPE_OUTPUT_FORMATS = {
+    'mp3': ['-f', 'mp3'],
+    'aac': ['-f', 'adts'],
+    'm4a': ['-f', 'ipod', '-movflags', '+empty_moov+default_base_moof', '-frag_duration', '1000000'],
+    'ogg': ['-f', 'ogg'],
+    'flac': ['-f', 'flac'],
+    'wav': ['-f', 'wav'],
+}
+
+# Containers FFmpeg can read from a pipe; others (MP4/MOV keep their index at
+# the end, AVI seeks to it) are streamed to a temporary file first
+PIPE_INPUT_EXTENSIONS = {'.mkv', '.webm', '.ts', '.mts', '.m2ts', '.flv', '.mpg', '.mpeg', '.vob'}
+
+# Segment-parallel encoding (parallel=true, see encode_segments()); the
+# segment cuts need FFmpeg 6.0 or newer, older versions encode in one pass
+MIN_SEGMENT_SECONDS = 120
+SEGMENT_OVERLAP_SECONDS = 1.0  # Audio encoded past each join on both sides, then dropped
+SEGMENT_ALIGN_LAPS = 2  # Grid periods of earlier starts tried when realigning segments
+# Realigning re-encodes the segments it moves, about as long again as the
+# first pass; with fewer segments than this, one pass is quicker
+MIN_REALIGN_SEGMENTS = 3
+
+# Frame size (samples) of each lossy encoder; segment starts are aligned to it
+# so the segments' packets line up (2048 is Vorbis' long block)
+SEGMENT_FRAME_SIZES = {'mp3': 1152, 'ogg': 2048}
+
+# Container for encoded segments: one that keeps the encoder delay and
+# padding through a stream copy, so the joined file is trimmed like a
+# single-pass encode
+SEGMENT_MUXERS = {'mp3': 'mp3', 'ogg': 'ogg'}
+
+# FFmpeg's AAC encoder carries its rate control from packet to packet, so
+# segments encoded from different starts never produce identical packets to
+# join at (see find_join()); AAC is always encoded in one pass
+ONE_PASS_FORMATS = {'aac', 'm4a'}
+
+# MP3 frames can start their audio data up to 511 bytes back, in the frames
+# before them (the bit reservoir), so an MP3 join needs that much identical
+# data before it; each frame's header and side information (up to 38 bytes)
+# don't count
+MP3_RESERVOIR_BYTES = 511
+MP3_FRAME_OVERHEAD = 38
+
+# Sample rates LAME encodes without resampling (other rates would move the
+# segment boundaries)
+MP3_SAMPLE_RATES = {8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000}
 
 async def execute(request: Request):
     """
@@ -13,156 +119,871 @@ async def execute(request: Request):
     - file: Video file (MP4, AVI, MOV, MKV, WebM, etc.)
     - format: Output audio format (mp3, wav, aac, ogg, flac)
     - quality: Audio quality/bitrate (optional)
+    - parallel: Optional, "true" to encode segments of the timeline in
+      separate FFmpeg processes and join them (see encode_segments());
+      off by default
+    - mode: Optional, "async" to run as a background job and return a job id
+    
+    Job requests (query parameters):
+    - job_id: Job to query, with action=status (default), events or download
+    
+    Streaming (query parameter mode=stream): the audio is sent while FFmpeg is
+    still encoding; see stream_audio()
     """
-    temp_input = None
-    temp_output = None
+    # Status / events / download for background jobs
+    job_response = await handle_job_request(request, TOOL_NAME)
+    if job_response is not None:
+        return job_response
+    
+    if request.query_params.get('mode') == 'stream':
+        return await stream_audio(request)
+    
+    input_path = None
     
     try:
         print(f"[Video to Audio] Processing request")
         
-        # Get form data
-        form = await request.form()
+        # Get form data (uploaded video is streamed to a temporary file)
+        try:
+            form = await read_form(request, MAX_UPLOAD_SIZE)
+        except UploadTooLarge as e:
+            return JSONResponse(
+                {"error": str(e)},
+                status_code=413
+            )
+        
         video_file = form.get('file')
         output_format = form.get('format', 'mp3').lower()
         quality = form.get('quality', 'high')
+        parallel = (form.get('parallel') or '').lower() in ('1', 'true', 'yes', 'on')
         
-        if not video_file:
+        if not video_file or isinstance(video_file, str):
+            form.cleanup()
             return JSONResponse(
                 {"error": "No video file provided"},
                 status_code=400
             )
         
         # Validate output format
-        valid_formats = ['mp3', 'wav', 'aac', 'ogg', 'flac', 'm4a']
-        if output_format not in valid_formats:
+        if output_format not in VALID_FORMATS:
+            form.cleanup()
             return JSONResponse(
-                {"error": f"Invalid format. Supported: {', '.join(valid_formats)}"},
+                {"error": f"Invalid format. Supported: {', '.join(VALID_FORMATS)}"},
                 status_code=400
             )
         
-        # Read video file
-        video_content = await video_file.read()
-        print(f"[Video to Audio] Received video: {video_file.filename}, size: {len(video_content)} bytes")
-        
-        # Create temporary files
-        temp_input = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(video_file.filename)[1])
-        temp_input.write(video_content)
-        temp_input.close()
-        
-        temp_output = tempfile.NamedTemporaryFile(delete=False, suffix=f'.{output_format}')
-        temp_output.close()
-        
-        # Determine FFmpeg audio quality settings
-        audio_params = []
-        if output_format == 'mp3':
-            if quality == 'high':
-                audio_params = ['-b:a', '320k']
-            elif quality == 'medium':
-                audio_params = ['-b:a', '192k']
-            else:  # low
-                audio_params = ['-b:a', '128k']
-        elif output_format == 'aac' or output_format == 'm4a':
-            if quality == 'high':
-                audio_params = ['-b:a', '256k']
-            elif quality == 'medium':
-                audio_params = ['-b:a', '128k']
-            else:  # low
-                audio_params = ['-b:a', '96k']
-        elif output_format == 'ogg':
-            if quality == 'high':
-                audio_params = ['-q:a', '8']
-            elif quality == 'medium':
-                audio_params = ['-q:a', '5']
-            else:  # low
-                audio_params = ['-q:a', '3']
-        # WAV and FLAC use default settings (lossless)
-        
-        # Build FFmpeg command
+        input_path = video_file.path
+        print(f"[Video to Audio] Received video: {video_file.filename}, size: {video_file.size} bytes")
+        
+        # Generate output filename
+        base_name = os.path.splitext(video_file.filename)[0]
+        output_filename = f"{base_name}.{output_format}"
+        
+        # Background job: respond now, client polls for progress and the result
+        if wants_async(request, form):
+            async def work(job):
+                output_path, _ = await extract_audio(
+                    video_file, output_format, quality,
+                    timeout=JOB_TIMEOUT,
+                    parallel=parallel,
+                    on_progress=job.set_progress
+                )
+                return output_path, output_filename, f'audio/{output_format}'
+            
+            job = submit_job(TOOL_NAME, work, cleanup_paths=[input_path])
+            print(f"[Video to Audio] Submitted background job {job.id}")
+            return job_accepted(request, job)
+        
+        try:
+            output_path, cache_hit = await extract_audio(video_file, output_format, quality, timeout=REQUEST_TIMEOUT, parallel=parallel)
+        except ToolError as e:
+            return JSONResponse(
+                {"error": e.message},
+                status_code=e.status_code
+            )
+        finally:
+            cleanup_files(input_path)
+        
+        # Return the audio file
+        return FileResponse(
+            output_path,
+            media_type=f'audio/{output_format}',
+            filename=output_filename,
+            headers={'X-Cache': 'HIT'} if cache_hit else None,
+            background=lambda: cleanup_files(output_path)
+        )
+    
+    except Exception as e:
+        print(f"[Video to Audio] Error: {e}")
+        import traceback
+        traceback.print_exc()
+        cleanup_files(input_path)
+        return JSONResponse(
+            {"error": f"Error: {str(e)}"},
+            status_code=500
+        )
+
+async def stream_audio(request: Request):
+    """
+    Extract audio and stream it to the client while FFmpeg is encoding.
+    
+    The upload is piped into FFmpeg's stdin as it arrives when the container
+    can be read from a pipe (MKV, WebM, MPEG-TS, ...); other containers are
+    written to a temporary file first. The output is read from FFmpeg's stdout
+    straight into the response, so nothing is written to disk for it.
+    
+    format and quality can be sent as query parameters, or as form fields
+    placed before the file. Results are not cached in this mode.
+    """
+    input_path = None
+    process = None
+    
+    try:
+        print(f"[Video to Audio] Processing streaming request")
+        
+        try:
+            fields, upload = await stream_form(request, MAX_UPLOAD_SIZE)
+        except UploadTooLarge as e:
+            return JSONResponse(
+                {"error": str(e)},
+                status_code=413
+            )
+        
+        if upload is None:
+            return JSONResponse(
+                {"error": "No video file provided"},
+                status_code=400
+            )
+        
+        output_format = (fields.get('format') or request.query_params.get('format') or 'mp3').lower()
+        quality = fields.get('quality') or request.query_params.get('quality') or 'high'
+        
+        # Validate output format
+        if output_format not in VALID_FORMATS:
+            return JSONResponse(
+                {"error": f"Invalid format. Supported: {', '.join(VALID_FORMATS)}"},
+                status_code=400
+            )
+        
+        audio_args = ['-acodec', AUDIO_CODECS[output_format], *get_audio_params(output_format, quality)]
+        
+        if os.path.splitext(upload.filename)[1].lower() in PIPE_INPUT_EXTENSIONS:
+            input_arg = 'pipe:0'
+            stdin_chunks = upload
+            print(f"[Video to Audio] Piping {upload.filename} into FFmpeg")
+        else:
+            try:
+                saved = await save_upload(upload, MAX_UPLOAD_SIZE, upload.field)
+            except UploadTooLarge as e:
+                return JSONResponse(
+                    {"error": str(e)},
+                    status_code=413
+                )
+            input_arg = input_path = saved.path
+            stdin_chunks = None
+            print(f"[Video to Audio] Received video: {saved.filename}, size: {saved.size} bytes")
+            
+            # The file is seekable, so the stream-copy fast path still applies
+            if can_copy_audio(await probe_audio(input_path), output_format, quality):
+                audio_args = ['-c:a', 'copy']
+        
         ffmpeg_cmd = [
             'ffmpeg',
-            '-i', temp_input.name,
+            '-i', input_arg,
             '-vn',  # No video
-            '-acodec', 'libmp3lame' if output_format == 'mp3' else 
-                       'aac' if output_format in ['aac', 'm4a'] else
-                       'libvorbis' if output_format == 'ogg' else
-                       'flac' if output_format == 'flac' else
-                       'pcm_s16le',  # WAV
-            *audio_params,
-            '-y',  # Overwrite output file
-            temp_output.name
+            *audio_args,
+            *PIPE_OUTPUT_FORMATS[output_format],
+            'pipe:1'
         ]
         
         print(f"[Video to Audio] Running FFmpeg: {' '.join(ffmpeg_cmd)}")
         
-        # Run FFmpeg with proper process control
-        process = None
+        process = await stream_process(ffmpeg_cmd, timeout=REQUEST_TIMEOUT, stdin_chunks=stdin_chunks, on_stderr=progress_logger())
+        
+        # Wait for the first output so early failures still get a proper error response
         try:
-            process = subprocess.Popen(
-                ffmpeg_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            
-            # Wait for completion with timeout
-            stdout, stderr = process.communicate(timeout=300)  # 5 minute timeout
-            returncode = process.returncode
-            
-        except subprocess.TimeoutExpired:
-            # CRITICAL: Kill the process to prevent zombies
-            print(f"[Video to Audio] FFmpeg timeout, killing process...")
-            if process:
-                try:
-                    process.kill()
-                    process.wait(timeout=5)  # Wait for kill to complete
-                except:
-                    pass
-            cleanup_files(temp_input.name if temp_input else None, temp_output.name if temp_output else None)
+            first_chunk = await process.read()
+            if not first_chunk:
+                returncode = await process.wait()
+        except ProcessTimeout:
+            print(f"[Video to Audio] FFmpeg timeout, process killed")
+            await close_stream(process, input_path)
             return JSONResponse(
                 {"error": "Processing timeout. Video file may be too large."},
                 status_code=500
             )
-        
-        if returncode != 0:
-            error_msg = stderr.decode('utf-8')
-            print(f"[Video to Audio] FFmpeg error: {error_msg}")
-            cleanup_files(temp_input.name if temp_input else None, temp_output.name if temp_output else None)
+        except UploadTooLarge as e:
+            await close_stream(process, input_path)
             return JSONResponse(
-                {"error": f"Audio extraction failed: {error_msg[:200]}"},
-                status_code=500
+                {"error": str(e)},
+                status_code=413
             )
         
-        # Check if output file exists and has content
-        if not os.path.exists(temp_output.name) or os.path.getsize(temp_output.name) == 0:
+        if not first_chunk:
+            error_msg = process.stderr.decode('utf-8', errors='replace')
+            print(f"[Video to Audio] FFmpeg error: {error_msg}")
+            await close_stream(process, input_path)
             return JSONResponse(
-                {"error": "Audio extraction failed: Output file is empty"},
+                {"error": f"Audio extraction failed: {error_msg[:200] if returncode != 0 else 'Output file is empty'}"},
                 status_code=500
             )
         
-        output_size = os.path.getsize(temp_output.name)
-        print(f"[Video to Audio] Success: Extracted audio to {output_format}, size: {output_size} bytes")
+        async def audio_chunks():
+            chunk = first_chunk
+            try:
+                while chunk:
+                    yield chunk
+                    chunk = await process.read()
+                returncode = await process.wait()
+                if returncode != 0:
+                    print(f"[Video to Audio] FFmpeg failed mid-stream: {process.stderr.decode('utf-8', errors='replace')[-500:]}")
+                else:
+                    print(f"[Video to Audio] Success: Streamed {output_format} audio")
+            except (ProcessTimeout, UploadTooLarge) as e:
+                # Headers are already sent, so the client just gets a truncated file
+                print(f"[Video to Audio] Streaming stopped: {e}")
+            finally:
+                await close_stream(process, input_path)
         
         # Generate output filename
-        base_name = os.path.splitext(video_file.filename)[0]
+        base_name = os.path.splitext(upload.filename)[0]
         output_filename = f"{base_name}.{output_format}"
         
-        # Return the audio file
-        return FileResponse(
-            temp_output.name,
+        return UploadStreamingResponse(
+            audio_chunks(),
+            upload=upload,
             media_type=f'audio/{output_format}',
-            filename=output_filename,
-            background=lambda: cleanup_files(temp_input.name, temp_output.name)
+            headers={
+                'Content-Disposition': content_disposition(output_filename),
+                'X-Accel-Buffering': 'no'
+            },
+            # Also runs if the client disconnects before streaming starts
+            background=BackgroundTask(close_stream, process, input_path)
         )
-        
+    
     except Exception as e:
         print(f"[Video to Audio] Error: {e}")
         import traceback
         traceback.print_exc()
-        cleanup_files(temp_input.name if temp_input else None, temp_output.name if temp_output else None)
+        if process is not None:
+            await close_stream(process, input_path)
+        else:
+            cleanup_files(input_path)
         return JSONResponse(
             {"error": f"Error: {str(e)}"},
             status_code=500
         )
 
+async def close_stream(process, input_path):
+    """Stop FFmpeg (if still running) and remove the spooled input"""
+    await process.close()
+    cleanup_files(input_path)
+
+def content_disposition(filename: str) -> str:
+    """Attachment header for a download, like FileResponse builds it"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+def get_audio_params(output_format: str, quality: str) -> list:
+    """Determine FFmpeg audio quality settings"""
+    if output_format == 'mp3':
+        if quality == 'high':
+            return ['-b:a', '320k']
+        elif quality == 'medium':
+            return ['-b:a', '192k']
+        else:  # low
+            return ['-b:a', '128k']
+    elif output_format == 'aac' or output_format == 'm4a':
+        if quality == 'high':
+            return ['-b:a', '256k']
+        elif quality == 'medium':
+            return ['-b:a', '128k']
+        else:  # low
+            return ['-b:a', '96k']
+    elif output_format == 'ogg':
+        if quality == 'high':
+            return ['-q:a', '8']
+        elif quality == 'medium':
+            return ['-q:a', '5']
+        else:  # low
+            return ['-q:a', '3']
+    # WAV and FLAC use default settings (lossless)
+    return []
+
+async def extract_audio(video_file, output_format: str, quality: str, timeout: float, parallel: bool = False, on_progress=None):
+    """
+    Extract the audio track of an uploaded video (or serve it from the result cache)
+    
+    With parallel, long enough audio is encoded in segments (see
+    plan_segments()); if that fails, it is encoded in one pass.
+    
+    Returns (output_path, cache_hit); the caller owns output_path.
+    Raises ToolError for failures that should be reported to the user.
+    """
+    audio_params = get_audio_params(output_format, quality)
+    
+    # Same video + same format/quality always gives the same audio
+    cache_params = {'format': output_format, 'audio_params': audio_params}
+    cached_path = await get_cached(TOOL_NAME, video_file.sha256, cache_params, suffix=f'.{output_format}')
+    if cached_path:
+        print(f"[Video to Audio] Cache hit, skipping FFmpeg")
+        return cached_path, True
+    
+    # Create temporary output file
+    temp_output = tempfile.NamedTemporaryFile(delete=False, suffix=f'.{output_format}')
+    temp_output.close()
+    output_path = temp_output.name
+    
+    try:
+        # Fast path: remux the source audio when the container accepts it as-is
+        source_audio = await probe_audio(video_file.path)
+        result = None
+        if can_copy_audio(source_audio, output_format, quality):
+            print(f"[Video to Audio] Source audio is {source_audio['codec_name']}, copying without re-encoding")
+            result = await run_ffmpeg(video_file.path, output_path, ['-c:a', 'copy'], timeout, on_progress)
+            if result.returncode != 0:
+                print(f"[Video to Audio] Stream copy failed, re-encoding instead")
+                result = None
+        
+        audio_args = ['-acodec', AUDIO_CODECS[output_format], *audio_params]
+        segments = plan_segments(source_audio, output_format) if parallel and result is None else None
+        if segments:
+            print(f"[Video to Audio] Encoding {len(segments)} segments in parallel...")
+            started = time.monotonic()
+            result = await encode_segments(video_file.path, output_path, output_format, audio_args,
+                                           source_audio, segments, timeout, on_progress)
+            if result is None:
+                print(f"[Video to Audio] Segments could not be joined, encoding in one pass instead")
+                timeout -= time.monotonic() - started
+        
+        if result is None:
+            result = await run_ffmpeg(video_file.path, output_path, audio_args, timeout, on_progress)
+    except ProcessTimeout:
+        print(f"[Video to Audio] FFmpeg timeout, process killed")
+        cleanup_files(output_path)
+        raise ToolError("Processing timeout. Video file may be too large.")
+    except BaseException:
+        cleanup_files(output_path)
+        raise
+    
+    if result.returncode != 0:
+        error_msg = result.stderr.decode('utf-8', errors='replace')
+        print(f"[Video to Audio] FFmpeg error: {error_msg}")
+        cleanup_files(output_path)
+        raise ToolError(f"Audio extraction failed: {error_msg[:200]}")
+    
+    # Check if output file exists and has content
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        cleanup_files(output_path)
+        raise ToolError("Audio extraction failed: Output file is empty")
+    
+    output_size = os.path.getsize(output_path)
+    print(f"[Video to Audio] Success: Extracted audio to {output_format}, size: {output_size} bytes")
+    
+    await store_result(TOOL_NAME, video_file.sha256, cache_params, output_path)
+    
+    return output_path, False
+
+async def probe_audio(input_path: str):
+    """
+    Describe the first audio stream of a file with ffprobe
+    
+    Returns a dict with codec_name, bit_rate, sample_rate, channels,
+    sample_fmt, time_base, duration (seconds, from the container if the
+    stream has none)
+    and start_offset (seconds the stream starts after the container), or
+    None if there is no audio stream or ffprobe is unavailable.
+    """
+    probe_cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name,bit_rate,sample_rate,channels,sample_fmt,time_base,start_time,duration:format=start_time,duration',
+        '-of', 'json',
+        input_path
+    ]
+    
+    try:
+        result = await run_process(probe_cmd, timeout=PROBE_TIMEOUT, text=True)
+    except (FileNotFoundError, ProcessTimeout) as e:
+        print(f"[Video to Audio] ffprobe unavailable ({e.__class__.__name__}), skipping probe")
+        return None
+    
+    if result.returncode != 0:
+        return None
+    
+    try:
+        probe = json.loads(result.stdout)
+    except ValueError:
+        return None
+    streams = probe.get('streams') or []
+    if not streams:
+        return None
+    
+    stream = streams[0]
+    container = probe.get('format') or {}
+    if stream.get('duration') in (None, 'N/A'):
+        stream['duration'] = container.get('duration')
+    try:
+        stream['start_offset'] = max(0.0, float(stream['start_time']) - float(container['start_time']))
+    except (KeyError, TypeError, ValueError):
+        stream['start_offset'] = 0.0
+    return stream
+
+def can_copy_audio(source_audio, output_format: str, quality: str) -> bool:
+    """
+    True if the source audio can be remuxed into output_format unchanged:
+    the container must accept the codec, and for lossy targets the source
+    bitrate must not exceed the requested quality (so copying never gives
+    a bigger file than the user asked for)
+    """
+    if not source_audio or source_audio.get('codec_name') not in COPY_CODECS[output_format]:
+        return False
+    
+    bitrates = TARGET_BITRATES.get(output_format)
+    if bitrates is None:
+        # Lossless target (FLAC/WAV): same codec means identical audio
+        return True
+    target_bitrate = bitrates.get(quality, bitrates['low'])
+    
+    try:
+        source_bitrate = int(source_audio.get('bit_rate'))
+    except (TypeError, ValueError):
+        # Unknown bitrate (e.g. some Matroska files): only copy for best quality
+        return quality == 'high'
+    
+    # Allow a little headroom for VBR sources
+    return source_bitrate <= target_bitrate * 1.1
+
+async def run_ffmpeg(input_path: str, output_path: str, audio_args: list, timeout: float, on_progress=None):
+    """Run FFmpeg to write the audio of input_path with the given codec arguments"""
+    ffmpeg_cmd = [
+        'ffmpeg',
+        '-i', input_path,
+        '-vn',  # No video
+        *audio_args,
+        '-y',  # Overwrite output file
+        output_path
+    ]
+    
+    print(f"[Video to Audio] Running FFmpeg: {' '.join(ffmpeg_cmd)}")
+    
+    # Run FFmpeg without blocking the event loop
+    return await run_process(ffmpeg_cmd, timeout=timeout, on_stderr=progress_logger(on_progress))
+
+def plan_segments(source_audio, output_format: str) -> list:
+    """
+    Segments [(start, end), ...] of the audio timeline, in samples, to encode
+    in parallel (one per FFmpeg slot, end None for the last one), or None to
+    encode in one pass (also when the duration or sample rate is unknown)
+    """
+    if not source_audio or output_format in ONE_PASS_FORMATS:
+        return None
+    
+    slots = process_limit('ffmpeg')
+    if slots < 2:
+        return None
+    
+    try:
+        sample_rate = int(source_audio['sample_rate'])
+        duration = float(source_audio['duration'])
+        time_base = Fraction(source_audio['time_base'])
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        return None
+    # Segments start where seeking puts them, which is only sample-accurate
+    # when timestamps are (not with Matroska's milliseconds)
+    if time_base > Fraction(1, sample_rate):
+        return None
+    if output_format == 'mp3' and sample_rate not in MP3_SAMPLE_RATES:
+        return None
+    
+    count = min(slots, int(duration // MIN_SEGMENT_SECONDS))
+    if count < 2:
+        return None
+    
+    # Even split, each start rounded to a whole encoder frame
+    frame = SEGMENT_FRAME_SIZES.get(output_format, 1)
+    total = int(duration * sample_rate)
+    starts = [round(total * index / count / frame) * frame for index in range(count)]
+    return list(zip(starts, starts[1:] + [None]))
+
+def segment_command(input_path: str, start: int, end, source_audio: dict, output_args: list) -> list:
+    """FFmpeg command for samples [start, end) of the first audio stream (end None: to the end of the file)"""
+    sample_rate = int(source_audio['sample_rate'])
+    ffmpeg_cmd = ['ffmpeg', '-y']
+    if start > 0:
+        # Input seeking decodes from just before the position and drops what precedes it
+        ffmpeg_cmd += ['-ss', f"{source_audio.get('start_offset', 0.0) + start / sample_rate:.6f}"]
+    if end is not None:
+        ffmpeg_cmd += ['-t', f'{(end - start) / sample_rate:.6f}']
+    return ffmpeg_cmd + ['-i', input_path, '-vn', '-map', '0:a:0', *output_args]
+
+async def encode_segments(input_path: str, output_path: str, output_format: str, audio_args: list,
+                          source_audio: dict, segments: list, timeout: float, on_progress=None):
+    """
+    Encode segments of the audio timeline in concurrent FFmpeg processes and
+    join them into output_path, without gaps or encoder priming at the joins.
+    
+    Returns a successful result once the output is written, or None if an
+    FFmpeg run fails (e.g. an FFmpeg older than 6.0 can't cut the segments)
+    or two lossy segments produce no identical packets to join at; the
+    caller then encodes in one pass. Raises ProcessTimeout if the whole run takes longer
+    than timeout.
+    """
+    deadline = time.monotonic() + timeout
+    temp_paths = []
+    try:
+        if output_format in SEGMENT_MUXERS:
+            result = await join_encoded_segments(input_path, output_path, output_format, audio_args,
+                                                 source_audio, segments, deadline, temp_paths, on_progress)
+        else:
+            result = await join_pcm_segments(input_path, output_path, output_format, audio_args,
+                                             source_audio, segments, deadline, temp_paths, on_progress)
+        if result is not None and result.returncode != 0:
+            error_msg = result.stderr.decode('utf-8', errors='replace')
+            print(f"[Video to Audio] FFmpeg error in parallel mode: {error_msg[-500:]}")
+            return None
+        return result
+    finally:
+        cleanup_files(*temp_paths)
+
+async def join_encoded_segments(input_path: str, output_path: str, output_format: str, audio_args: list,
+                                source_audio: dict, segments: list, deadline: float, temp_paths: list, on_progress=None):
+    """
+    Lossy formats: each segment is encoded with SEGMENT_OVERLAP_SECONDS of
+    extra audio on both sides, so around each join the encoder (and the
+    source decoder, after seeking) has warmed up and still sees the audio
+    that follows. Encoders tend to settle into the same packets for the same
+    input, so the join is put where both segments produced an identical pair
+    of packets: around it the decoder gets exactly the packets it would get
+    from either segment. Segments that never produce such a pair are moved
+    onto the previous segment's packet grid once (see align_segments()); if
+    that doesn't help either, the caller encodes in a single pass. The
+    segments are then cut at the joins by stream copy and concatenated.
+    """
+    sample_rate = int(source_audio['sample_rate'])
+    frame = SEGMENT_FRAME_SIZES[output_format]
+    overlap = int(SEGMENT_OVERLAP_SECONDS * sample_rate)
+    muxer = SEGMENT_MUXERS[output_format]
+    reservoir = MP3_RESERVOIR_BYTES if output_format == 'mp3' else None
+    firsts = [max(0, (start - overlap) // frame * frame) for start, _ in segments]
+    segment_paths = [None] * len(segments)
+    packets_paths = [None] * len(segments)
+    packets = [None] * len(segments)
+    
+    async def encode(indexes: list, on_done=None):
+        # The tee muxer also lists the packets it wrote, for finding the joins
+        commands = []
+        for index in indexes:
+            end = segments[index][1]
+            last = end + overlap if end is not None else None
+            segment_paths[index] = new_temp_path(temp_paths, f'.{muxer}')
+            packets_paths[index] = new_temp_path(temp_paths, '.txt')
+            commands.append(segment_command(input_path, firsts[index], last, source_audio, [
+                *audio_args, '-f', 'tee', f'[f={muxer}]{segment_paths[index]}|[f=framecrc]{packets_paths[index]}'
+            ]))
+        failed = await run_concurrently(commands, deadline, on_done)
+        if not failed:
+            for index in indexes:
+                packets[index] = read_packets(packets_paths[index], firsts[index], sample_rate)
+        return failed
+    
+    def segment_done(done: int):
+        print(f"[Video to Audio] Encoded segment {done}/{len(segments)}")
+        if on_progress:
+            # Leave the last few percent for joining
+            on_progress(done / len(segments) * 90)
+    
+    started = time.monotonic()
+    failed = await encode(range(len(segments)), segment_done)
+    if failed:
+        return failed
+    if not all(packets):
+        return None
+    first_pass = time.monotonic() - started
+    
+    def find_joins() -> list:
+        return [find_join(packets[index - 1], packets[index], segments[index][0], overlap, reservoir)
+                for index in range(1, len(segments))]
+    
+    joins = find_joins()
+    misaligned = [index for index, join in enumerate(joins, 1) if join is None]
+    if misaligned:
+        # One attempt only: each one costs about another first pass
+        if len(segments) < MIN_REALIGN_SEGMENTS:
+            return None
+        print(f"[Video to Audio] Realigning {len(misaligned)} segments with the packets before them...")
+        started = time.monotonic()
+        starts = await align_segments(input_path, source_audio, audio_args, segments, firsts, packets, misaligned,
+                                      deadline, temp_paths, reservoir)
+        if starts is None:
+            return None
+        for index, first in starts.items():
+            firsts[index] = first
+        failed = await encode(misaligned)
+        if failed:
+            return failed
+        if not all(packets):
+            return None
+        print(f"[Video to Audio] Realigned in {time.monotonic() - started:.1f}s (first pass {first_pass:.1f}s)")
+        joins = find_joins()
+        if None in joins:
+            return None
+    print(f"[Video to Audio] Joining segments at samples {joins}")
+    
+    # Keep each segment's packets between its joins (timestamps relative to its first packet)
+    bounds = [None, *joins, None]
+    trimmed_paths = []
+    commands = []
+    for index, segment_path in enumerate(segment_paths):
+        first_pts = packets[index][0][0]
+        conditions = []
+        if bounds[index] is not None:
+            conditions.append(f'lt((pts-startpts)*tb\\,{(bounds[index] - first_pts - 0.5) / sample_rate:.7f})')
+        if bounds[index + 1] is not None:
+            conditions.append(f'gte((pts-startpts)*tb\\,{(bounds[index + 1] - first_pts - 0.5) / sample_rate:.7f})')
+        trimmed_path = new_temp_path(temp_paths, f'.{muxer}')
+        trimmed_paths.append(trimmed_path)
+        commands.append(['ffmpeg', '-y', '-i', segment_path, '-c', 'copy',
+                         '-bsf:a', 'noise=drop=' + '+'.join(conditions), '-f', muxer, trimmed_path])
+    
+    failed = await run_concurrently(commands, deadline)
+    if failed:
+        return failed
+    
+    # The concat demuxer starts the output at 0; shifting it back to the first
+    # (negative) timestamp lets the muxer record the encoder delay again
+    start_time = packets[0][0][0] / sample_rate
+    return await concat_segments(trimmed_paths, output_path, ['-c', 'copy', '-output_ts_offset', f'{start_time:.6f}'],
+                                 deadline, temp_paths)
+
+async def join_pcm_segments(input_path: str, output_path: str, output_format: str, audio_args: list,
+                            source_audio: dict, segments: list, deadline: float, temp_paths: list, on_progress=None):
+    """
+    WAV and FLAC: segments are decoded to PCM cut at exact samples (after a
+    run-up for the source decoder) and concatenated. FLAC is encoded in the
+    final pass, since FLAC frame headers number frames from the start of
+    the stream; decoding, the slow part for lossless output, is parallel.
+    """
+    sample_rate = int(source_audio['sample_rate'])
+    overlap = int(SEGMENT_OVERLAP_SECONDS * sample_rate)
+    # Same sample size the encoder would get: FLAC keeps 24 bits of float or 32-bit sources
+    if output_format == 'wav' or source_audio.get('sample_fmt') in ('u8', 'u8p', 's16', 's16p'):
+        pcm_codec = 'pcm_s16le'
+    else:
+        pcm_codec = 'pcm_s24le'
+    
+    segment_paths = []
+    commands = []
+    for start, end in segments:
+        first = max(0, start - overlap)
+        segment_path = new_temp_path(temp_paths, '.nut')
+        segment_paths.append(segment_path)
+        trim = ['-af', f'atrim=start_sample={start - first}'] if start > first else []
+        commands.append(segment_command(input_path, first, end, source_audio, [
+            *trim, '-acodec', pcm_codec, '-f', 'nut', segment_path
+        ]))
+    
+    def segment_done(done: int):
+        print(f"[Video to Audio] Decoded segment {done}/{len(segments)}")
+        if on_progress:
+            on_progress(done / len(segments) * (90 if output_format == 'wav' else 50))
+    
+    failed = await run_concurrently(commands, deadline, segment_done)
+    if failed:
+        return failed
+    
+    output_args = ['-c', 'copy'] if output_format == 'wav' else audio_args
+    return await concat_segments(segment_paths, output_path, output_args, deadline, temp_paths)
+
+def read_packets(packets_path: str, first: int, sample_rate: int) -> list:
+    """(pts, duration, size, checksum) of each packet in a framecrc listing, in samples from the start of the audio"""
+    time_base = Fraction(1, sample_rate)
+    packets = []
+    with open(packets_path) as listing:
+        for line in listing:
+            if line.startswith('#tb'):
+                time_base = Fraction(line.split(':', 1)[1].strip())
+            elif line.strip() and not line.startswith('#'):
+                # stream, dts, pts, duration, size, checksum[, side data]
+                fields = [field.strip() for field in line.split(',')]
+                pts = round(int(fields[2]) * time_base * sample_rate)
+                duration = round(int(fields[3]) * time_base * sample_rate)
+                packets.append((first + pts, duration, int(fields[4]), fields[5]))
+    return packets
+
+def find_join(previous: list, current: list, boundary: int, overlap: int, reservoir: int = None):
+    """
+    Sample from which the current segment takes over from the previous one:
+    the first packet boundary from boundary on where the packets on both
+    sides are identical in the two segments. A boundary the segments merely
+    share isn't enough: the decoder overlaps each packet with the one before
+    it (MDCT), so mismatched packets leave aliasing at the join. Only
+    boundaries within half the overlap count, where the previous segment
+    still encoded what follows them. None if there is no such boundary.
+    
+    With reservoir (MP3), packets also borrow data from the ones before
+    them, so enough identical packets must hold reservoir bytes of data
+    before the join.
+    """
+    candidates = [index for index in range(1, len(current))
+                  if boundary <= current[index][0] <= boundary + overlap // 2
+                  and current[index][0] == current[index - 1][0] + current[index - 1][1]]
+    previous_packets = set(previous)
+    for index in candidates:
+        if current[index - 1] in previous_packets and current[index] in previous_packets:
+            if reservoir is None or identical_data(previous_packets, current[:index]) >= reservoir:
+                return current[index][0]
+    return None
+
+def identical_data(previous_packets: set, packets: list) -> int:
+    """Bytes of MP3 audio data in the run of packets at the end of packets that are also in previous_packets"""
+    total = 0
+    for packet in reversed(packets):
+        if packet not in previous_packets:
+            break
+        total += max(0, packet[2] - MP3_FRAME_OVERHEAD)
+    return total
+
+async def align_segments(input_path: str, source_audio: dict, audio_args: list, segments: list, firsts: list,
+                         packets: list, indexes: list, deadline: float, temp_paths: list, reservoir: int = None):
+    """
+    New starts for the segments at indexes, which have no join with the
+    previous segment (see find_join(); firsts: current starts).
+    
+    Encoders with variable block sizes (Vorbis) open every stream with as
+    many short blocks as the audio at the start calls for, and switch to
+    short blocks at transients; both move the grid of long blocks, so two
+    segments can run out of step and never share a packet boundary. This
+    encodes just the head of each segment from a range of earlier starts,
+    one packet step apart, and picks the closest start that gives a join. Returns {index: start}, or None if a segment
+    has no such start.
+    """
+    sample_rate = int(source_audio['sample_rate'])
+    overlap = int(SEGMENT_OVERLAP_SECONDS * sample_rate)
+    grids = {}
+    for index in indexes:
+        # Packets of the usual (long block) size are the ones on the grid; the
+        # last packet of a stream is cut to its end and doesn't count
+        durations = [duration for _, duration, _, _ in packets[index][:-1]]
+        grids[index] = (Counter(durations).most_common(1)[0][0], reduce(gcd, durations))
+    
+    starts = {}
+    for lap in range(SEGMENT_ALIGN_LAPS):
+        # One grid period of earlier starts at a time: where the opening short
+        # blocks change, a single period can skip the offset that's needed
+        candidates = []
+        commands = []
+        for index in indexes:
+            if index in starts:
+                continue
+            period, step = grids[index]
+            boundary = segments[index][0]
+            for shift in range(max(lap * period, step), (lap + 1) * period, step):
+                start = max(0, firsts[index] - shift)
+                packets_path = new_temp_path(temp_paths, '.txt')
+                candidates.append((index, start, packets_path))
+                # Just past the last boundary find_join() takes, clear of the end of the stream
+                commands.append(segment_command(input_path, start, boundary + overlap // 2 + 4 * period, source_audio, [
+                    *audio_args, '-f', 'framecrc', packets_path
+                ]))
+        
+        failed = await run_concurrently(commands, deadline)
+        if failed:
+            return None
+        
+        for index, start, packets_path in candidates:
+            if index not in starts:
+                head = read_packets(packets_path, start, sample_rate)
+                if find_join(packets[index - 1], head, segments[index][0], overlap, reservoir) is not None:
+                    starts[index] = start
+        if len(starts) == len(indexes):
+            return starts
+    return None
+
+async def run_concurrently(commands: list, deadline: float, on_done=None):
+    """
+    Run FFmpeg commands concurrently (as many at once as the FFmpeg process
+    limit allows). Returns the first failed result, or None once all have
+    succeeded; on failure the others are stopped. Raises ProcessTimeout if
+    they are not done by deadline.
+    """
+    timeout = deadline - time.monotonic()
+    if timeout <= 0:
+        raise ProcessTimeout("ffmpeg timed out")
+    tasks = [asyncio.ensure_future(run_process(ffmpeg_cmd, timeout=timeout)) for ffmpeg_cmd in commands]
+    done = 0
+    try:
+        try:
+            for task in asyncio.as_completed(tasks, timeout=timeout):
+                result = await task
+                if result.returncode != 0:
+                    return result
+                done += 1
+                if on_done:
+                    on_done(done)
+        except asyncio.TimeoutError:
+            raise ProcessTimeout(f"ffmpeg timed out after {timeout:.0f} seconds")
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def concat_segments(segment_paths: list, output_path: str, output_args: list, deadline: float, temp_paths: list):
+    """Join segment files in order with FFmpeg's concat demuxer"""
+    list_path = new_temp_path(temp_paths, '.txt')
+    with open(list_path, 'w') as listing:
+        for path in segment_paths:
+            escaped = path.replace("'", "'\\''")
+            listing.write(f"file '{escaped}'\n")
+    
+    timeout = deadline - time.monotonic()
+    if timeout <= 0:
+        raise ProcessTimeout("ffmpeg timed out")
+    ffmpeg_cmd = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_path, *output_args, output_path]
+    print(f"[Video to Audio] Running FFmpeg: {' '.join(ffmpeg_cmd)}")
+    return await run_process(ffmpeg_cmd, timeout=timeout)
+
+def new_temp_path(temp_paths: list, suffix: str) -> str:
+    """Create an empty temporary file and add it to temp_paths (for cleanup)"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        temp_paths.append(temp_file.name)
+    return temp_file.name
+
+def parse_timestamp(value: str) -> float:
+    """Convert an FFmpeg HH:MM:SS.ss timestamp to seconds"""
+    hours, minutes, seconds = value.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def progress_logger(on_progress=None, interval: float = 5.0):
+    """
+    Build an FFmpeg stderr callback that logs the encoded position every few seconds
+    and reports percent done to on_progress once the input duration is known
+    """
+    state = {'duration': None, 'last_logged': 0.0}
+
+    def on_stderr(line: str):
+        if state['duration'] is None:
+            duration = re.search(r'Duration: (\d+:\d+:\d+(?:\.\d+)?)', line)
+            if duration:
+                state['duration'] = parse_timestamp(duration.group(1))
+        
+        match = re.search(r'time=(\d+:\d+:\d+(?:\.\d+)?)', line)
+        if not match:
+            return
+        
+        if on_progress and state['duration']:
+            on_progress(parse_timestamp(match.group(1)) / state['duration'] * 100)
+        
+        if time.monotonic() - state['last_logged'] >= interval:
+            state['last_logged'] = time.monotonic()
+            print(f"[Video to Audio] Progress: {match.group(1)}")
+    
+    return on_stderr
+
 def cleanup_files(*file_paths):
     """Clean up temporary files"""
     for path in file_paths:
@@ -0,0 +1,145 @@
+"""
+Tests for the segment joining in parallel mode (run with pytest)
+"""
+
+import importlib.util
+import os
+
+import pytest
+
+# The tool directory isn't a package, so load main.py by path
+spec = importlib.util.spec_from_file_location(
+    'video_to_audio_main', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+)
+main = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(main)
+
+FRAME = 1024
+OVERLAP = 44100
+
+
+def packets(start: int, count: int, size: int = 400, tag: str = 'a', duration: int = FRAME) -> list:
+    """Synthetic (pts, duration, size, checksum) packets, checksums made from tag and pts"""
+    return [(pts, duration, size, f'{tag}{pts}') for pts in range(start, start + count * duration, duration)]
+
+
+def test_find_join_prefers_identical_packets():
+    # Identical packets only from 10 frames past the boundary on
+    boundary = 100 * FRAME
+    previous = packets(0, 200)
+    current = packets(90 * FRAME, 20, tag='b') + packets(110 * FRAME, 60)
+    assert main.find_join(previous, current, boundary, OVERLAP) == 111 * FRAME
+
+
+def test_find_join_needs_identical_packets():
+    # A boundary both segments share isn't enough without identical packets around it
+    boundary = 100 * FRAME
+    previous = packets(0, 200)
+    current = packets(90 * FRAME, 80, tag='b')
+    assert main.find_join(previous, current, boundary, OVERLAP) is None
+
+
+def test_find_join_needs_a_shared_boundary():
+    # Packet grids a few samples apart never meet
+    boundary = 100 * FRAME
+    previous = packets(0, 200)
+    current = packets(90 * FRAME + 7, 80, tag='b')
+    assert main.find_join(previous, current, boundary, OVERLAP) is None
+
+
+def test_find_join_stays_within_half_the_overlap():
+    # Identical packets from a given point on; past overlap / 2 the previous
+    # segment no longer saw the audio that follows
+    boundary = 100 * FRAME
+    previous = packets(0, 200)
+    
+    def current(identical_from: int) -> list:
+        return [(pts, duration, size, checksum if pts >= identical_from else 'x')
+                for pts, duration, size, checksum in packets(90 * FRAME, 110)]
+    
+    inside = boundary + (OVERLAP // 2 // FRAME - 3) * FRAME
+    assert main.find_join(previous, current(inside), boundary, OVERLAP, 511) == inside + 2 * FRAME
+    outside = boundary + (OVERLAP // 2 // FRAME - 1) * FRAME
+    assert main.find_join(previous, current(outside), boundary, OVERLAP, 511) is None
+
+
+def test_find_join_skips_gaps_between_packets():
+    # A boundary only counts where the packet before it ends there
+    boundary = 100 * FRAME
+    previous = packets(0, 200)
+    current = packets(90 * FRAME, 10, tag='b')[:-1] + packets(100 * FRAME, 60)
+    assert main.find_join(previous, current, boundary, OVERLAP) == 101 * FRAME
+
+
+def test_find_join_with_reservoir_needs_identical_data():
+    boundary = 100 * FRAME
+    previous = packets(0, 200)
+    # Identical from 100 frames on: two 400-byte frames hold 724 bytes of data
+    current = packets(90 * FRAME, 10, tag='b') + packets(100 * FRAME, 60)
+    assert main.find_join(previous, current, boundary, OVERLAP, 511) == 102 * FRAME
+    # Nothing identical: a shared boundary isn't enough
+    current = packets(90 * FRAME, 80, tag='b')
+    assert main.find_join(previous, current, boundary, OVERLAP, 511) is None
+
+
+def test_find_join_with_reservoir_counts_small_frames():
+    boundary = 100 * FRAME
+    previous = packets(0, 200, size=138)
+    current = packets(90 * FRAME, 10, size=138, tag='b') + packets(100 * FRAME, 60, size=138)
+    # 100 bytes of data per frame: the sixth identical frame completes 511 bytes
+    assert main.find_join(previous, current, boundary, OVERLAP, 511) == 106 * FRAME
+
+
+def test_read_packets(tmp_path):
+    listing = tmp_path / 'packets.txt'
+    listing.write_text(
+        '#software: Lavf60.16.100\n'
+        '#tb 0: 1/44100\n'
+        '#media_type 0: audio\n'
+        '0,      -1105,      -1105,     1152,      418, 0x91b31bc5\n'
+        '0,         47,         47,     1152,      417, 0x1e0f94b0, S=1, 10\n'
+    )
+    assert main.read_packets(str(listing), 88200, 44100) == [
+        (88200 - 1105, 1152, 418, '0x91b31bc5'),
+        (88200 + 47, 1152, 417, '0x1e0f94b0'),
+    ]
+
+
+def test_read_packets_converts_time_base(tmp_path):
+    listing = tmp_path / 'packets.txt'
+    listing.write_text('#tb 0: 1/1000\n0, 0, 0, 21, 300, 0xaaaa\n0, 21, 21, 21, 300, 0xbbbb\n')
+    assert main.read_packets(str(listing), 0, 48000) == [(0, 1008, 300, '0xaaaa'), (1008, 1008, 300, '0xbbbb')]
+
+
+@pytest.fixture
+def four_ffmpeg_slots(monkeypatch):
+    monkeypatch.setenv('TOOLS_MAX_PROCESSES_FFMPEG', '4')
+
+
+def source(duration: float, sample_rate: int = 44100, time_base: str = None) -> dict:
+    return {'sample_rate': str(sample_rate), 'duration': str(duration), 'time_base': time_base or f'1/{sample_rate}'}
+
+
+def test_plan_segments_aligns_starts_to_frames(four_ffmpeg_slots):
+    segments = main.plan_segments(source(600), 'ogg')
+    assert len(segments) == 4
+    assert segments[0][0] == 0 and segments[-1][1] is None
+    assert all(start % 2048 == 0 for start, _ in segments)
+    assert all(end == start for (_, end), (start, _) in zip(segments, segments[1:]))
+
+
+def test_plan_segments_keeps_segments_long(four_ffmpeg_slots):
+    assert len(main.plan_segments(source(300), 'mp3')) == 2
+    assert main.plan_segments(source(200), 'mp3') is None
+
+
+def test_plan_segments_one_pass_cases(four_ffmpeg_slots, monkeypatch):
+    # AAC, inexact seeking (Matroska timestamps), resampling MP3 sources, unknown duration
+    assert main.plan_segments(source(600), 'aac') is None
+    assert main.plan_segments(source(600), 'm4a') is None
+    assert main.plan_segments(source(600, 48000, '1/1000'), 'ogg') is None
+    assert main.plan_segments(source(600, 96000), 'mp3') is None
+    assert main.plan_segments({'sample_rate': '44100'}, 'ogg') is None
+    assert main.plan_segments(None, 'ogg') is None
+    monkeypatch.setenv('TOOLS_MAX_PROCESSES_FFMPEG', '1')
+    assert main.plan_segments(source(600), 'ogg') is None
@@ -1,157 +1,176 @@
 """
 PDF Compressor Backend
-Compresses PDF files using Ghostscript for optimal compression
+Compresses PDF files, with Ghostscript where a structural analysis shows it can help
 """
 
 from fastapi import Request
 from fastapi.responses import FileResponse, JSONResponse
+import asyncio
+import shutil
 import tempfile
 import os
-import subprocess
+import sys
+
+# Make the shared backend helpers importable
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if TOOLS_DIR not in sys.path:
+    sys.path.insert(0, TOOLS_DIR)
+
+from shared.executor import run_in_process
+from shared.process_runner import ProcessResult, ProcessTimeout
+from shared.ghostscript_pool import run_gs, ghostscript_slots
+from shared.pdf_optimize import analyze_pdf, repack_pdf
+from shared.pdf_stitch import stitch_pdfs
+from shared.uploads import read_form, max_upload_size, UploadTooLarge
+from shared.result_cache import get_cached, store_result
+from shared.jobs import ToolError, JOB_TIMEOUT, submit_job, wants_async, job_accepted, handle_job_request
+
+TOOL_NAME = 'pdf-compressor'
+MAX_UPLOAD_SIZE = max_upload_size(TOOL_NAME, 200)
+
+# Timeout for requests that wait for the result (background jobs use JOB_TIMEOUT)
+REQUEST_TIMEOUT = 60
+
+# Quality settings for Ghostscript
+# Using PDFSETTINGS for different compression levels
+QUALITY_SETTINGS = {
+    'low': '/screen',      # Lowest quality, smallest size (72 dpi)
+    'medium': '/ebook',    # Medium quality (150 dpi)
+    'high': '/printer'     # High quality (300 dpi)
+}
+
+# Image resolutions (color/gray, mono) each setting downsamples to; Ghostscript
+# only downsamples images above 1.5x the target
+IMAGE_RESOLUTIONS = {
+    '/screen': (72, 300),
+    '/ebook': (150, 300),
+    '/printer': (300, 1200)
+}
+DOWNSAMPLE_THRESHOLD = 1.5
+
+# Smallest expected saving worth running Ghostscript / the lossless repack for
+MIN_SAVING_BYTES = 32 * 1024
+
+# Target size mode: (image dpi, JPEG QFactor) levels tried to fit a size limit,
+# best quality first. QFactor 0.15 is roughly JPEG quality 95, 0.76 quality 50
+TARGET_SIZE_LEVELS = [
+    (300, 0.15),
+    (300, 0.4),
+    (200, 0.4),
+    (150, 0.4),
+    (150, 0.76),
+    (120, 0.76),
+    (96, 0.76),
+    (72, 0.76),
+    (72, 1.3),
+    (50, 1.3)
+]
+MAX_TARGET_SIZE_MB = 1024
+
+# Parallel mode: the document is compressed in page chunks, one Ghostscript
+# job each (as many at once as the Ghostscript backend allows), and stitched back together
+PARALLEL_MIN_PAGES = 32  # "auto" only goes parallel from this many pages
+MIN_CHUNK_PAGES = 8
 
 
 async def execute(request: Request):
     """
-    Compress a PDF file using Ghostscript
+    Compress a PDF file (with Ghostscript when it has something to gain)
     
     Expected form data:
     - file: PDF file to compress
     - quality: Compression quality (low, medium, high)
+    - target_size_mb: Optional, compress to at most this size instead of a
+      quality preset, keeping as much image quality as fits
+    - parallel: Optional, "auto" (default, parallel for documents of 32+ pages),
+      "true" or "false"; parallel mode compresses page chunks in separate
+      Ghostscript processes and stitches them back into one PDF
+    - mode: Optional, "async" to run as a background job and return a job id
+    
+    Job requests (query parameters):
+    - job_id: Job to query, with action=status (default), events or download
     """
+    # Status / events / download for background jobs
+    job_response = await handle_job_request(request, TOOL_NAME)
+    if job_response is not None:
+        return job_response
+    
     try:
         print("[PDF Compressor] Processing compression request")
         
-        # Get form data
-        form = await request.form()
+        # Get form data (uploaded file is streamed to a temporary file)
+        try:
+            form = await read_form(request, MAX_UPLOAD_SIZE)
+        except UploadTooLarge as e:
+            return JSONResponse(
+                {"error": str(e)},
+                status_code=413
+            )
+        
         uploaded_file = form.get('file')
         quality = form.get('quality', 'medium')
+        parallel = (form.get('parallel') or 'auto').lower()
         
-        if not uploaded_file:
+        if not uploaded_file or isinstance(uploaded_file, str):
+            form.cleanup()
             print("[PDF Compressor] Error: No file provided")
             return JSONResponse(
                 {"error": "No PDF file provided"},
                 status_code=400
             )
         
-        # Read uploaded file
-        content = await uploaded_file.read()
-        
-        # Save to temporary input file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_input:
-            tmp_input.write(content)
-            input_path = tmp_input.name
-        
         try:
-            # Quality settings for Ghostscript
-            # Using PDFSETTINGS for different compression levels
-            quality_settings = {
-                'low': '/screen',      # Lowest quality, smallest size (72 dpi)
-                'medium': '/ebook',    # Medium quality (150 dpi)
-                'high': '/printer'     # High quality (300 dpi)
-            }
-            
-            pdf_setting = quality_settings.get(quality, '/ebook')
-            print(f"[PDF Compressor] Using quality: {quality} (Ghostscript setting: {pdf_setting})")
-            
-            # Create output file path
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_output:
-                output_path = tmp_output.name
-            
-            # Ghostscript compression command
-            # Using optimal settings for compression while preserving content
-            gs_command = [
-                'gs',
-                '-sDEVICE=pdfwrite',
-                '-dCompatibilityLevel=1.4',
-                f'-dPDFSETTINGS={pdf_setting}',
-                '-dNOPAUSE',
-                '-dQUIET',
-                '-dBATCH',
-                '-dDetectDuplicateImages=true',
-                '-dCompressFonts=true',
-                '-dCompressPages=true',
-                '-dDownsampleColorImages=true',
-                '-dDownsampleGrayImages=true',
-                '-dDownsampleMonoImages=true',
-                f'-sOutputFile={output_path}',
-                input_path
-            ]
-            
-            print(f"[PDF Compressor] Running Ghostscript compression...")
-            
-            # Run Ghostscript with proper process control
-            process = None
-            try:
-                process = subprocess.Popen(
-                    gs_command,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True
-                )
-                
-                # Wait for completion with timeout
-                stdout, stderr = process.communicate(timeout=60)
-                returncode = process.returncode
-                
-            except subprocess.TimeoutExpired:
-                # CRITICAL: Kill the process to prevent zombies
-                print(f"[PDF Compressor] Ghostscript timeout, killing process...")
-                if process:
-                    try:
-                        process.kill()
-                        process.wait(timeout=5)  # Wait for kill to complete
-                    except:
-                        pass
-                cleanup_files(input_path, output_path)
-                return JSONResponse(
-                    {"error": "Compression timed out. File may be too large."},
-                    status_code=500
-                )
-            
-            if returncode != 0:
-                print(f"[PDF Compressor] Ghostscript error: {stderr}")
-                cleanup_files(input_path, output_path)
-                return JSONResponse(
-                    {"error": "Failed to compress PDF. Please try again."},
-                    status_code=500
-                )
-            
-            # Check if output file was created and has content
-            if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
-                cleanup_files(input_path, output_path)
-                return JSONResponse(
-                    {"error": "Compression failed. Output file is empty."},
-                    status_code=500
-                )
-            
-            # Get file sizes
-            input_size = os.path.getsize(input_path)
-            output_size = os.path.getsize(output_path)
-            compression_ratio = ((input_size - output_size) / input_size * 100) if input_size > 0 else 0
-            
-            print(f"[PDF Compressor] Success: Compressed from {input_size} to {output_size} bytes ({compression_ratio:.1f}% reduction)")
-            
-            # Clean up input file
-            cleanup_files(input_path)
-            
-            # Return the compressed PDF
-            return FileResponse(
-                path=output_path,
-                filename='compressed.pdf',
-                media_type='application/pdf',
-                background=lambda: cleanup_files(output_path)
+            target_size = parse_target_size(form.get('target_size_mb'))
+        except ValueError as e:
+            form.cleanup()
+            return JSONResponse(
+                {"error": str(e)},
+                status_code=400
             )
+        
+        input_path = uploaded_file.path
+        
+        # Background job: respond now, client polls for the result
+        if wants_async(request, form):
+            async def work(job):
+                if target_size:
+                    output_path, _ = await compress_to_target(uploaded_file, target_size, timeout=JOB_TIMEOUT, on_progress=job.set_progress)
+                else:
+                    output_path, _ = await compress_pdf(
+                        uploaded_file, quality,
+                        timeout=JOB_TIMEOUT,
+                        parallel=parallel,
+                        on_progress=job.set_progress
+                    )
+                return output_path, 'compressed.pdf', 'application/pdf'
             
-        except FileNotFoundError:
-            cleanup_files(input_path)
+            job = submit_job(TOOL_NAME, work, cleanup_paths=[input_path])
+            print(f"[PDF Compressor] Submitted background job {job.id}")
+            return job_accepted(request, job)
+        
+        try:
+            if target_size:
+                output_path, cache_hit = await compress_to_target(uploaded_file, target_size, timeout=REQUEST_TIMEOUT)
+            else:
+                output_path, cache_hit = await compress_pdf(uploaded_file, quality, timeout=REQUEST_TIMEOUT, parallel=parallel)
+        except ToolError as e:
             return JSONResponse(
-                {"error": "Ghostscript not installed on server. Please contact administrator."},
-                status_code=500
+                {"error": e.message},
+                status_code=e.status_code
             )
-        except Exception as e:
-            cleanup_files(input_path, output_path if 'output_path' in locals() else None)
-            raise e
-            
+        finally:
+            # Clean up input file
+            cleanup_files(input_path)
+        
+        # Return the compressed PDF
+        return FileResponse(
+            path=output_path,
+            filename='compressed.pdf',
+            media_type='application/pdf',
+            headers={'X-Cache': 'HIT'} if cache_hit else None,
+            background=lambda: cleanup_files(output_path)
+        )
+    
     except Exception as e:
         print(f"[PDF Compressor] Error: {e}")
         import traceback
@@ -162,6 +181,387 @@ async def execute(request: Request):
         )
 
 
+async def compress_pdf(uploaded_file, quality: str, timeout: float, parallel: str = 'auto', on_progress=None):
+    """
+    Compress an uploaded PDF (or serve it from the result cache)
+    
+    A structural analysis picks the strategy: "skip" (nothing to gain),
+    "lossless" (repack without Ghostscript) or "full" (Ghostscript with image
+    downsampling). The result is never larger than the input.
+    
+    Returns (output_path, cache_hit); the caller owns output_path.
+    Raises ToolError for failures that should be reported to the user.
+    """
+    input_path = uploaded_file.path
+    pdf_setting = QUALITY_SETTINGS.get(quality, '/ebook')
+    print(f"[PDF Compressor] Using quality: {quality} (Ghostscript setting: {pdf_setting})")
+    
+    try:
+        analysis = await run_in_process(TOOL_NAME, analyze_pdf, input_path)
+        strategy = choose_strategy(analysis, pdf_setting)
+        print(f"[PDF Compressor] Analysis: {analysis} -> {strategy}")
+    except Exception as e:
+        # Damaged PDFs are left to Ghostscript, which can often repair them
+        print(f"[PDF Compressor] Could not analyze PDF ({e}), using Ghostscript")
+        analysis = None
+        strategy = 'full'
+    
+    # Create output file path
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_output:
+        output_path = tmp_output.name
+    
+    if strategy == 'skip':
+        print(f"[PDF Compressor] Nothing to compress, returning the original")
+        shutil.copyfile(input_path, output_path)
+        return output_path, False
+    
+    def plan(strategy: str):
+        # Same input + same setting (+ same strategy and chunks) always gives the same output
+        chunks = plan_chunks(analysis.pages if analysis else None, parallel) if strategy == 'full' else None
+        cache_params = {'pdf_setting': pdf_setting, 'strategy': strategy}
+        if chunks:
+            cache_params['chunks'] = chunks
+        return chunks, cache_params
+    
+    chunks, cache_params = plan(strategy)
+    cached_path = await get_cached(TOOL_NAME, uploaded_file.sha256, cache_params, suffix='.pdf')
+    
+    if not cached_path and strategy == 'lossless':
+        try:
+            await run_in_process(TOOL_NAME, repack_pdf, input_path, output_path)
+        except Exception as e:
+            print(f"[PDF Compressor] Lossless repack failed ({e}), using Ghostscript")
+            # Cached (and looked up) as the Ghostscript result it now is
+            strategy = 'full'
+            chunks, cache_params = plan(strategy)
+            cached_path = await get_cached(TOOL_NAME, uploaded_file.sha256, cache_params, suffix='.pdf')
+    
+    if cached_path:
+        print(f"[PDF Compressor] Cache hit, skipping compression")
+        cleanup_files(output_path)
+        return cached_path, True
+    
+    if strategy == 'full':
+        await run_ghostscript(input_path, output_path, pdf_setting, chunks, timeout, on_progress)
+    
+    # Get file sizes
+    input_size = os.path.getsize(input_path)
+    output_size = os.path.getsize(output_path)
+    compression_ratio = ((input_size - output_size) / input_size * 100) if input_size > 0 else 0
+    
+    if output_size >= input_size:
+        # Already optimized: recompressing only made it bigger
+        print(f"[PDF Compressor] Output ({output_size} bytes) not smaller than input, returning the original")
+        shutil.copyfile(input_path, output_path)
+    else:
+        print(f"[PDF Compressor] Success: Compressed from {input_size} to {output_size} bytes ({compression_ratio:.1f}% reduction)")
+    
+    await store_result(TOOL_NAME, uploaded_file.sha256, cache_params, output_path)
+    
+    return output_path, False
+
+
+async def compress_to_target(uploaded_file, target_size: int, timeout: float, on_progress=None):
+    """
+    Best-quality compression of an uploaded PDF that fits in target_size bytes.
+    
+    Searches TARGET_SIZE_LEVELS (ordered best quality first, output size
+    shrinking along the list) for the first level that fits: each round
+    compresses up to one level per Ghostscript slot concurrently, spread over
+    the remaining range, and narrows the range around the target. Every
+    trial is kept in the result cache, so asking again with another target
+    reuses the levels already tried.
+    
+    Returns (output_path, cache_hit); the caller owns output_path.
+    Raises ToolError if even the smallest level doesn't fit.
+    """
+    input_path = uploaded_file.path
+    input_size = os.path.getsize(input_path)
+    print(f"[PDF Compressor] Target size: {target_size} bytes (input {input_size} bytes)")
+    
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_output:
+        output_path = tmp_output.name
+    
+    if input_size <= target_size:
+        print(f"[PDF Compressor] Input already fits, returning the original")
+        shutil.copyfile(input_path, output_path)
+        return output_path, False
+    
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    sizes = {}  # Level index -> output size
+    paths = {}  # Level index -> output file
+    ran_ghostscript = False
+    
+    async def run_trial(index: int):
+        nonlocal ran_ghostscript
+        level = TARGET_SIZE_LEVELS[index]
+        cache_params = {'target_level': list(level)}
+        trial_path = await get_cached(TOOL_NAME, uploaded_file.sha256, cache_params, suffix='.pdf')
+        if not trial_path:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise ToolError("Compression timed out. File may be too large.")
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_trial:
+                trial_path = tmp_trial.name
+            paths[index] = trial_path
+            ran_ghostscript = True
+            await run_ghostscript(input_path, trial_path, '/printer', None, remaining, level=level)
+            await store_result(TOOL_NAME, uploaded_file.sha256, cache_params, trial_path)
+        paths[index] = trial_path
+        sizes[index] = os.path.getsize(trial_path)
+        print(f"[PDF Compressor] Level {index} ({level[0]} dpi, QFactor {level[1]}): {sizes[index]} bytes")
+        if on_progress:
+            on_progress(len(sizes) / len(TARGET_SIZE_LEVELS) * 100)
+    
+    try:
+        low, high = 0, len(TARGET_SIZE_LEVELS) - 1
+        slots = ghostscript_slots()
+        while not (low == high and high in sizes):
+            untried = [index for index in range(low, high + 1) if index not in sizes]
+            if len(untried) <= slots:
+                batch = untried
+            else:
+                # Spread the trials evenly over the untried levels
+                batch = sorted({untried[len(untried) * (n + 1) // (slots + 1)] for n in range(slots)})
+            
+            tasks = [asyncio.ensure_future(run_trial(index)) for index in batch]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            
+            fitting = [index for index in sizes if low <= index <= high and sizes[index] <= target_size]
+            if fitting:
+                high = min(fitting)
+            too_large = [index for index in sizes if low <= index < high and sizes[index] > target_size]
+            if too_large:
+                low = max(too_large) + 1
+        
+        if sizes[high] > target_size:
+            raise ToolError(
+                f"Cannot compress this PDF below {target_size / (1024 * 1024):.2f} MB "
+                f"(smallest result: {sizes[high] / (1024 * 1024):.2f} MB)",
+                status_code=400
+            )
+        
+        dpi, qfactor = TARGET_SIZE_LEVELS[high]
+        print(f"[PDF Compressor] Success: {dpi} dpi, QFactor {qfactor} fits ({input_size} -> {sizes[high]} bytes, {len(sizes)} levels tried)")
+        os.replace(paths.pop(high), output_path)
+        return output_path, not ran_ghostscript
+    except BaseException:
+        cleanup_files(output_path)
+        raise
+    finally:
+        cleanup_files(*paths.values())
+
+
+def parse_target_size(value) -> int:
+    """target_size_mb form value -> bytes (None if not given); raises ValueError if invalid"""
+    if not value:
+        return None
+    try:
+        target_mb = float(value)
+    except ValueError:
+        raise ValueError("Invalid target size")
+    if not 0 < target_mb <= MAX_TARGET_SIZE_MB:
+        raise ValueError(f"Target size must be between 0 and {MAX_TARGET_SIZE_MB} MB")
+    return int(target_mb * 1024 * 1024)
+
+
+def choose_strategy(analysis, pdf_setting: str) -> str:
+    """
+    "full" when Ghostscript can downsample or re-encode images or subset
+    fonts, "lossless" when only unfiltered streams or unreferenced data can
+    be saved, otherwise "skip"
+    """
+    if analysis.encrypted:
+        return 'full'
+    
+    color_dpi, mono_dpi = IMAGE_RESOLUTIONS.get(pdf_setting, IMAGE_RESOLUTIONS['/ebook'])
+    if analysis.max_image_dpi > color_dpi * DOWNSAMPLE_THRESHOLD or analysis.max_mono_dpi > mono_dpi * DOWNSAMPLE_THRESHOLD:
+        return 'full'
+    if analysis.recompressible_image_bytes > MIN_SAVING_BYTES or analysis.unsubset_font_bytes > MIN_SAVING_BYTES:
+        return 'full'
+    
+    if analysis.unfiltered_bytes > MIN_SAVING_BYTES:
+        return 'lossless'
+    if analysis.unreferenced_bytes > max(MIN_SAVING_BYTES, analysis.file_size // 10):
+        return 'lossless'
+    return 'skip'
+
+
+async def run_ghostscript(input_path: str, output_path: str, pdf_setting: str, chunks: list, timeout: float, on_progress=None, level: tuple = None):
+    """
+    Compress input_path to output_path with Ghostscript, in page chunks if
+    given, or with the images of a TARGET_SIZE_LEVELS level.
+    Removes output_path and raises ToolError on failure.
+    """
+    # Run Ghostscript without blocking the event loop
+    try:
+        if chunks:
+            print(f"[PDF Compressor] Running Ghostscript on {len(chunks)} page chunks in parallel...")
+            result = await compress_chunks(input_path, output_path, pdf_setting, chunks, timeout, on_progress)
+        else:
+            print(f"[PDF Compressor] Running Ghostscript compression...")
+            result = await run_gs(gs_command(input_path, output_path, pdf_setting, level=level), timeout=timeout, text=True)
+    except ProcessTimeout:
+        print(f"[PDF Compressor] Ghostscript timeout, process killed")
+        cleanup_files(output_path)
+        raise ToolError("Compression timed out. File may be too large.")
+    except FileNotFoundError:
+        cleanup_files(output_path)
+        raise ToolError("Ghostscript not installed on server. Please contact administrator.")
+    except BaseException:
+        cleanup_files(output_path)
+        raise
+    
+    if result.returncode != 0:
+        print(f"[PDF Compressor] Ghostscript error: {result.stderr}")
+        cleanup_files(output_path)
+        raise ToolError("Failed to compress PDF. Please try again.")
+    
+    # Check if output file was created and has content
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        cleanup_files(output_path)
+        raise ToolError("Compression failed. Output file is empty.")
+
+
+def gs_command(input_path: str, output_path: str, pdf_setting: str, first_page: int = None, last_page: int = None, level: tuple = None) -> list:
+    """
+    Ghostscript command compressing input_path (or only the given pages of it) to output_path.
+    level: Optional (image dpi, JPEG QFactor) overriding the preset's image settings
+    """
+    # Using optimal settings for compression while preserving content
+    page_args = [f'-dFirstPage={first_page}', f'-dLastPage={last_page}'] if first_page else []
+    input_args = [input_path]
+    if level:
+        dpi, qfactor = level
+        # All color/gray images JPEG-encoded at the level's quality (set through distiller params)
+        jpeg_dict = f'<< /QFactor {qfactor} /Blend 1 /HSamples [2 1 1 2] /VSamples [2 1 1 2] >>'
+        page_args += [
+            f'-dColorImageResolution={dpi}',
+            f'-dGrayImageResolution={dpi}',
+            f'-dMonoImageResolution={max(dpi * 2, 300)}',
+            '-dColorImageDownsampleThreshold=1.0',
+            '-dGrayImageDownsampleThreshold=1.0',
+            '-dColorImageDownsampleType=/Bicubic',
+            '-dGrayImageDownsampleType=/Bicubic',
+            '-dAutoFilterColorImages=false',
+            '-dAutoFilterGrayImages=false',
+            '-dColorImageFilter=/DCTEncode',
+            '-dGrayImageFilter=/DCTEncode'
+        ]
+        input_args = ['-c', f'<< /ColorImageDict {jpeg_dict} /GrayImageDict {jpeg_dict} >> setdistillerparams', '-f', input_path]
+    return [
+        'gs',
+        '-sDEVICE=pdfwrite',
+        '-dCompatibilityLevel=1.4',
+        f'-dPDFSETTINGS={pdf_setting}',
+        '-dNOPAUSE',
+        '-dQUIET',
+        '-dBATCH',
+        '-dDetectDuplicateImages=true',
+        '-dCompressFonts=true',
+        '-dCompressPages=true',
+        '-dDownsampleColorImages=true',
+        '-dDownsampleGrayImages=true',
+        '-dDownsampleMonoImages=true',
+        *page_args,
+        f'-sOutputFile={output_path}',
+        *input_args
+    ]
+
+
+def plan_chunks(total_pages: int, parallel: str) -> list:
+    """
+    Page chunks [(first, last), ...] (1-indexed) to compress in parallel, one
+    per Ghostscript slot, or None to compress the document in one run
+    (also when the page count is unknown)
+    """
+    if parallel in ('0', 'false', 'no', 'off') or not total_pages:
+        return None
+    
+    slots = ghostscript_slots()
+    if slots < 2:
+        return None
+    
+    if parallel not in ('1', 'true', 'yes', 'on') and total_pages < PARALLEL_MIN_PAGES:
+        return None
+    
+    chunk_count = min(slots, total_pages // MIN_CHUNK_PAGES)
+    if chunk_count < 2:
+        return None
+    
+    # Spread the pages evenly: the first (total % count) chunks get one extra page
+    size, extra = divmod(total_pages, chunk_count)
+    chunks = []
+    first = 1
+    for index in range(chunk_count):
+        last = first + size - 1 + (1 if index < extra else 0)
+        chunks.append((first, last))
+        first = last + 1
+    return chunks
+
+
+async def compress_chunks(input_path: str, output_path: str, pdf_setting: str, chunks: list, timeout: float, on_progress=None) -> ProcessResult:
+    """
+    Compress page chunks in concurrent Ghostscript processes and stitch them
+    into output_path (resources the chunks share are stored once, bookmarks
+    are taken from the input).
+    
+    Returns the result of the first failed Ghostscript run, or a successful
+    result once the output is written. Raises ProcessTimeout if the whole
+    run takes longer than timeout.
+    """
+    chunk_paths = []
+    for _ in chunks:
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_chunk:
+            chunk_paths.append(tmp_chunk.name)
+    
+    done = 0
+    
+    async def compress_chunk(chunk_path: str, first_page: int, last_page: int):
+        nonlocal done
+        result = await run_gs(gs_command(input_path, chunk_path, pdf_setting, first_page, last_page), timeout=timeout, text=True)
+        if result.returncode == 0:
+            done += 1
+            print(f"[PDF Compressor] Compressed pages {first_page}-{last_page} ({done}/{len(chunks)} chunks)")
+            if on_progress:
+                # Leave the last few percent for stitching
+                on_progress(done / len(chunks) * 95)
+        return result
+    
+    tasks = [asyncio.ensure_future(compress_chunk(path, first, last)) for path, (first, last) in zip(chunk_paths, chunks)]
+    try:
+        try:
+            for task in asyncio.as_completed(tasks, timeout=timeout):
+                result = await task
+                if result.returncode != 0:
+                    return result
+        except asyncio.TimeoutError:
+            raise ProcessTimeout(f"gs timed out after {timeout} seconds")
+        
+        for path in chunk_paths:
+            if os.path.getsize(path) == 0:
+                return ProcessResult(1, '', "Ghostscript wrote an empty chunk")
+        
+        try:
+            total_pages, removed = await run_in_process(TOOL_NAME, stitch_pdfs, chunk_paths, output_path, input_path)
+        except Exception as e:
+            return ProcessResult(1, '', f"Failed to stitch chunks: {e}")
+        print(f"[PDF Compressor] Stitched {len(chunks)} chunks ({total_pages} pages, {removed} duplicate objects removed)")
+        return ProcessResult(0, '', '')
+    finally:
+        # A chunk failed or timed out - stop the others
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        cleanup_files(*chunk_paths)
+
+
 def cleanup_files(*file_paths):
     """Clean up temporary files"""
     for path in file_paths:
@@ -171,4 +571,3 @@ def cleanup_files(*file_paths):
                 print(f"[PDF Compressor] Cleaned up: {path}")
             except Exception as e:
                 print(f"[PDF Compressor] Error cleaning up file {path}: {e}")
-
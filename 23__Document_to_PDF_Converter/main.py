@@ -2,7 +2,26 @@ from fastapi import Request
 from fastapi.responses import FileResponse, JSONResponse
 import tempfile
 import os
-import subprocess
+import sys
+
+# Make the shared backend helpers importable
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if TOOLS_DIR not in sys.path:
+    sys.path.insert(0, TOOLS_DIR)
+
+from shared.process_runner import ProcessTimeout
+from shared.libreoffice_pool import convert_to_pdf, ConversionError
+from shared.uploads import read_form, max_upload_size, UploadTooLarge
+from shared.result_cache import get_cached, store_result
+from shared.jobs import ToolError, JOB_TIMEOUT, submit_job, wants_async, job_accepted, handle_job_request
+
+TOOL_NAME = 'document-to-pdf'
+MAX_UPLOAD_SIZE = max_upload_size(TOOL_NAME, 100)
+
+# Timeout for requests that wait for the result (background jobs use JOB_TIMEOUT)
+REQUEST_TIMEOUT = 60
+
+VALID_EXTENSIONS = ['.doc', '.docx', '.ppt', '.pptx', '.xls', '.xlsx']
 
 async def execute(request: Request):
     """
@@ -10,18 +29,34 @@ async def execute(request: Request):
     
     Expected form data:
     - file: Document file to convert
+    - mode: Optional, "async" to run as a background job and return a job id
+    
+    Job requests (query parameters):
+    - job_id: Job to query, with action=status (default), events or download
     """
+    # Status / events / download for background jobs
+    job_response = await handle_job_request(request, TOOL_NAME)
+    if job_response is not None:
+        return job_response
+    
     input_file = None
-    output_file = None
     
     try:
         print("[Document to PDF] Processing conversion request")
         
-        # Get uploaded file
-        form = await request.form()
+        # Get uploaded file (streamed to a temporary file)
+        try:
+            form = await read_form(request, MAX_UPLOAD_SIZE)
+        except UploadTooLarge as e:
+            return JSONResponse(
+                {"error": str(e)},
+                status_code=413
+            )
+        
         file = form.get('file')
         
-        if not file:
+        if not file or isinstance(file, str):
+            form.cleanup()
             return JSONResponse(
                 {"error": "No file provided"},
                 status_code=400
@@ -32,140 +67,55 @@ async def execute(request: Request):
         file_extension = os.path.splitext(filename)[1].lower()
         
         # Validate file type
-        valid_extensions = ['.doc', '.docx', '.ppt', '.pptx', '.xls', '.xlsx']
-        if file_extension not in valid_extensions:
+        if file_extension not in VALID_EXTENSIONS:
+            form.cleanup()
             return JSONResponse(
-                {"error": f"Unsupported file type. Supported: {', '.join(valid_extensions)}"},
+                {"error": f"Unsupported file type. Supported: {', '.join(VALID_EXTENSIONS)}"},
                 status_code=400
             )
         
-        # Save uploaded file to temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_input:
-            content = await file.read()
-            temp_input.write(content)
-            input_file = temp_input.name
+        input_file = file.path
+        print(f"[Document to PDF] Input file saved: {filename} ({file.size} bytes)")
         
-        print(f"[Document to PDF] Input file saved: {filename} ({len(content)} bytes)")
-        
-        # Create output file path
-        output_file = tempfile.mktemp(suffix='.pdf')
-        
-        # Convert using LibreOffice (headless mode)
-        # LibreOffice must be installed on the server
-        print(f"[Document to PDF] Starting conversion with LibreOffice")
+        # Generate output filename
+        output_filename = os.path.splitext(filename)[0] + '.pdf'
         
-        try:
-            # Try different LibreOffice commands (varies by system)
-            libreoffice_commands = [
-                'libreoffice',
-                'soffice',
-                '/usr/bin/libreoffice',
-                '/usr/bin/soffice'
-            ]
+        # Background job: respond now, client polls for the result
+        if wants_async(request, form):
+            async def work(job):
+                output_file, _ = await convert_document(file, timeout=JOB_TIMEOUT)
+                return output_file, output_filename, 'application/pdf'
             
-            conversion_successful = False
-            for cmd in libreoffice_commands:
-                process = None
-                try:
-                    # Run LibreOffice in headless mode to convert to PDF
-                    # Using Popen for better process control
-                    process = subprocess.Popen(
-                        [
-                            cmd,
-                            '--headless',
-                            '--convert-to', 'pdf',
-                            '--outdir', os.path.dirname(output_file),
-                            input_file
-                        ],
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        text=True
-                    )
-                    
-                    # Wait for completion with timeout
-                    stdout, stderr = process.communicate(timeout=60)
-                    result = type('obj', (object,), {
-                        'returncode': process.returncode,
-                        'stdout': stdout,
-                        'stderr': stderr
-                    })
-                    
-                    if result.returncode == 0:
-                        conversion_successful = True
-                        # LibreOffice creates the output file with the same name but .pdf extension
-                        expected_output = os.path.join(
-                            os.path.dirname(output_file),
-                            os.path.splitext(os.path.basename(input_file))[0] + '.pdf'
-                        )
-                        if os.path.exists(expected_output):
-                            # Rename to our desired output file
-                            os.rename(expected_output, output_file)
-                        break
-                except subprocess.TimeoutExpired:
-                    # CRITICAL: Kill the process to prevent zombies
-                    if process:
-                        try:
-                            process.kill()
-                            process.wait(timeout=5)  # Wait for kill to complete
-                            print(f"[Document to PDF] Killed timed-out {cmd} process")
-                        except:
-                            pass
-                    continue
-                except FileNotFoundError:
-                    continue
-                except Exception as e:
-                    print(f"[Document to PDF] Error with {cmd}: {e}")
-                    # Kill process if still running
-                    if process and process.poll() is None:
-                        try:
-                            process.kill()
-                            process.wait(timeout=5)
-                        except:
-                            pass
-                    continue
-            
-            if not conversion_successful:
-                return JSONResponse(
-                    {"error": "LibreOffice conversion failed. Please ensure LibreOffice is installed on the server."},
-                    status_code=500
-                )
+            job = submit_job(TOOL_NAME, work, cleanup_paths=[input_file])
+            print(f"[Document to PDF] Submitted background job {job.id}")
+            return job_accepted(request, job)
         
-        except subprocess.TimeoutExpired:
-            # This should not be reached due to inner handling, but just in case
-            print("[Document to PDF] Global timeout handler reached")
-            return JSONResponse(
-                {"error": "Conversion timeout. File may be too large or complex."},
-                status_code=500
-            )
-        
-        # Verify output file was created
-        if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+        try:
+            output_file, cache_hit = await convert_document(file, timeout=REQUEST_TIMEOUT)
+        except ToolError as e:
             return JSONResponse(
-                {"error": "PDF generation failed. Output file is empty or missing."},
-                status_code=500
+                {"error": e.message},
+                status_code=e.status_code
             )
-        
-        output_size = os.path.getsize(output_file)
-        print(f"[Document to PDF] Conversion successful: {filename} -> PDF ({output_size} bytes)")
-        
-        # Generate output filename
-        output_filename = os.path.splitext(filename)[0] + '.pdf'
+        finally:
+            cleanup_files(input_file)
         
         # Return the PDF file
         return FileResponse(
             output_file,
             media_type='application/pdf',
             filename=output_filename,
-            background=lambda: cleanup_files(input_file, output_file)
+            headers={'X-Cache': 'HIT'} if cache_hit else None,
+            background=lambda: cleanup_files(output_file)
         )
-        
+    
     except Exception as e:
         print(f"[Document to PDF] Error: {e}")
         import traceback
         traceback.print_exc()
         
         # Clean up files on error
-        cleanup_files(input_file, output_file)
+        cleanup_files(input_file)
         
         return JSONResponse(
             {"error": f"Conversion error: {str(e)}"},
@@ -173,6 +123,59 @@ async def execute(request: Request):
         )
 
 
+async def convert_document(file, timeout: float):
+    """
+    Convert an uploaded document to PDF (or serve it from the result cache)
+    
+    Returns (output_file, cache_hit); the caller owns output_file.
+    Raises ToolError for failures that should be reported to the user.
+    """
+    file_extension = os.path.splitext(file.filename)[1].lower()
+    
+    # Same document bytes + same type always convert to the same PDF
+    cache_params = {'extension': file_extension}
+    cached_path = await get_cached(TOOL_NAME, file.sha256, cache_params, suffix='.pdf')
+    if cached_path:
+        print(f"[Document to PDF] Cache hit, skipping LibreOffice")
+        return cached_path, True
+    
+    # Create output file path
+    output_file = tempfile.mktemp(suffix='.pdf')
+    
+    # Convert using the LibreOffice worker pool (headless mode)
+    # LibreOffice must be installed on the server
+    print(f"[Document to PDF] Starting conversion with LibreOffice")
+    
+    try:
+        await convert_to_pdf(file.path, output_file, timeout=timeout)
+    except FileNotFoundError:
+        cleanup_files(output_file)
+        raise ToolError("LibreOffice conversion failed. Please ensure LibreOffice is installed on the server.")
+    except ConversionError as e:
+        print(f"[Document to PDF] {e}")
+        cleanup_files(output_file)
+        raise ToolError("LibreOffice conversion failed. Please ensure LibreOffice is installed on the server.")
+    except ProcessTimeout:
+        print("[Document to PDF] Conversion timed out")
+        cleanup_files(output_file)
+        raise ToolError("Conversion timeout. File may be too large or complex.")
+    except BaseException:
+        cleanup_files(output_file)
+        raise
+    
+    # Verify output file was created
+    if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+        cleanup_files(output_file)
+        raise ToolError("PDF generation failed. Output file is empty or missing.")
+    
+    output_size = os.path.getsize(output_file)
+    print(f"[Document to PDF] Conversion successful: {file.filename} -> PDF ({output_size} bytes)")
+    
+    await store_result(TOOL_NAME, file.sha256, cache_params, output_file)
+    
+    return output_file, False
+
+
 def cleanup_files(*file_paths):
     """Clean up temporary files"""
     for path in file_paths:
@@ -1,9 +1,28 @@
 from fastapi import Request
 from fastapi.responses import FileResponse, JSONResponse
 import tempfile
+import asyncio
 import os
-from PIL import Image
-import img2pdf
+import sys
+
+# Make the shared backend helpers importable
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if TOOLS_DIR not in sys.path:
+    sys.path.insert(0, TOOLS_DIR)
+
+from shared.executor import run_in_process, EXECUTOR_WORKERS
+from shared.uploads import read_form, max_upload_size, UploadTooLarge
+from shared.image_pdf import PageLayout, PAGE_SIZES, FIT_MODES, prepare_image, write_image_pdf
+
+TOOL_NAME = 'image-arranger-to-pdf'
+MAX_UPLOAD_SIZE = max_upload_size(TOOL_NAME, 50)
+MAX_TOTAL_UPLOAD_SIZE = max_upload_size(TOOL_NAME + '-total', 1024)
+
+# Page layout options
+DEFAULT_TARGET_DPI = 150  # Used for A4/Letter pages when no dpi is given
+MIN_TARGET_DPI = 72
+MAX_TARGET_DPI = 600
+MAX_MARGIN_MM = 100
 
 async def execute(request: Request):
     """
@@ -12,6 +31,11 @@ async def execute(request: Request):
     
     Expected form data:
     - images: Multiple image files (JPG, PNG, GIF, WebP, BMP)
+    - page_size: Optional, "original" (default, page = image size), "a4" or "letter"
+    - fit: Optional, "fit" (default, whole image visible) or "fill" (page covered, edges cropped)
+    - margin: Optional, page margin in mm (default 0)
+    - dpi: Optional, target resolution; larger images are downsampled
+      (default 150 for A4/Letter, original resolution otherwise)
     """
     temp_files = []
     output_file = None
@@ -19,95 +43,84 @@ async def execute(request: Request):
     try:
         print("[Image Arranger to PDF] Processing conversion request")
         
-        # Get uploaded files
-        form = await request.form()
-        images = form.getlist('images')
+        # Get uploaded files (streamed to temporary files)
+        try:
+            form = await read_form(request, MAX_UPLOAD_SIZE, MAX_TOTAL_UPLOAD_SIZE)
+        except UploadTooLarge as e:
+            return JSONResponse(
+                {"error": str(e)},
+                status_code=413
+            )
+        
+        temp_files.extend(upload.path for upload in form.files)
+        images = [image for image in form.getlist('images') if not isinstance(image, str)]
         
         if not images or len(images) == 0:
+            cleanup_files(*temp_files)
             return JSONResponse(
                 {"error": "No images provided"},
                 status_code=400
             )
         
         if len(images) > 200:
+            cleanup_files(*temp_files)
             return JSONResponse(
                 {"error": "Maximum 200 images allowed per PDF"},
                 status_code=400
             )
         
-        print(f"[Image Arranger to PDF] Processing {len(images)} images")
+        try:
+            layout = parse_layout(form)
+        except ValueError as e:
+            cleanup_files(*temp_files)
+            return JSONResponse(
+                {"error": str(e)},
+                status_code=400
+            )
         
-        # List to store processed image bytes
-        image_list = []
+        print(f"[Image Arranger to PDF] Processing {len(images)} images")
         
-        for idx, image_file in enumerate(images):
+        for image_file in images:
             # Validate file type
             if not image_file.content_type or not image_file.content_type.startswith('image/'):
+                cleanup_files(*temp_files)
                 return JSONResponse(
                     {"error": f"File {image_file.filename} is not a valid image"},
                     status_code=400
                 )
-            
-            # Read image content
-            image_content = await image_file.read()
-            
-            # Save to temporary file for processing
-            temp_input = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(image_file.filename)[1])
-            temp_input.write(image_content)
-            temp_input.close()
-            temp_files.append(temp_input.name)
-            
-            # Open image with PIL to validate and optionally convert
-            try:
-                img = Image.open(temp_input.name)
-                
-                # Convert RGBA to RGB (for PNG with transparency)
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    # Create white background
-                    rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    rgb_img.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                    img = rgb_img
-                elif img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Save converted image to new temporary file
-                temp_converted = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-                img.save(temp_converted.name, format='JPEG', quality=95)
-                temp_converted.close()
-                temp_files.append(temp_converted.name)
-                
-                # Read converted image bytes for PDF
-                with open(temp_converted.name, 'rb') as f:
-                    image_list.append(f.read())
-                
-                print(f"[Image Arranger to PDF] Processed image {idx + 1}/{len(images)}: {image_file.filename}")
-                
-            except Exception as e:
-                print(f"[Image Arranger to PDF] Error processing image {image_file.filename}: {e}")
-                return JSONResponse(
-                    {"error": f"Failed to process image {image_file.filename}: {str(e)}"},
-                    status_code=400
-                )
         
-        # Convert images to PDF using img2pdf
+        # Create output file path
+        output_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
+        output_file.close()
+        
+        # Files for the images that have to be re-encoded
+        converted_paths = []
+        for _ in images:
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as converted:
+                converted_paths.append(converted.name)
+        temp_files.extend(converted_paths)
+        
+        # Normalize images in parallel and convert them with img2pdf
         print(f"[Image Arranger to PDF] Creating PDF with {len(images)} pages")
         
         try:
-            pdf_bytes = img2pdf.convert(image_list)
+            pages = prepare_images([(image.path, converted_path, image.filename)
+                                    for image, converted_path in zip(images, converted_paths)], layout)
+            await write_image_pdf(pages, output_file.name)
+        except ValueError as e:
+            cleanup_files(output_file.name, *temp_files)
+            return JSONResponse(
+                {"error": str(e)},
+                status_code=400
+            )
         except Exception as e:
             print(f"[Image Arranger to PDF] Error converting images to PDF: {e}")
+            cleanup_files(output_file.name, *temp_files)
             return JSONResponse(
                 {"error": f"Failed to create PDF: {str(e)}"},
                 status_code=500
             )
         
-        # Save PDF to temporary file
-        output_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-        output_file.write(pdf_bytes)
-        output_file.close()
-        
         output_size = os.path.getsize(output_file.name)
         print(f"[Image Arranger to PDF] Successfully created PDF with {len(images)} pages ({output_size} bytes)")
         
@@ -121,7 +134,7 @@ async def execute(request: Request):
             filename=output_filename,
             background=lambda: cleanup_files(output_file.name, *temp_files)
         )
-        
+    
     except Exception as e:
         print(f"[Image Arranger to PDF] Error: {e}")
         import traceback
@@ -136,6 +149,70 @@ async def execute(request: Request):
         )
 
 
+def parse_layout(form):
+    """PageLayout from the form fields, or None to keep each image's own size"""
+    page_size = (form.get('page_size') or 'original').lower()
+    fit = (form.get('fit') or 'fit').lower()
+    try:
+        margin = float(form.get('margin') or 0)
+        dpi = float(form.get('dpi')) if form.get('dpi') else None
+    except ValueError:
+        raise ValueError("Invalid margin or dpi value")
+    
+    if page_size != 'original' and page_size not in PAGE_SIZES:
+        raise ValueError(f"Invalid page size. Supported: original, {', '.join(PAGE_SIZES)}")
+    if fit not in FIT_MODES:
+        raise ValueError(f"Invalid fit mode. Supported: {', '.join(FIT_MODES)}")
+    if not 0 <= margin <= MAX_MARGIN_MM:
+        raise ValueError(f"Margin must be between 0 and {MAX_MARGIN_MM} mm")
+    if dpi is not None and not MIN_TARGET_DPI <= dpi <= MAX_TARGET_DPI:
+        raise ValueError(f"DPI must be between {MIN_TARGET_DPI} and {MAX_TARGET_DPI}")
+    
+    if page_size == 'original':
+        if not margin and dpi is None:
+            return None
+        return PageLayout(None, fit, margin * 72 / 25.4, dpi)
+    return PageLayout(page_size, fit, margin * 72 / 25.4, dpi or DEFAULT_TARGET_DPI)
+
+
+async def prepare_images(images: list, layout: PageLayout = None):
+    """
+    Inspect/normalize (and with a layout, downsample) the images (path,
+    converted_path, filename) in the process pool and yield the pages in
+    order, keeping at most one image per worker in flight. This limits the
+    images being decoded at once, not the memory img2pdf needs later.
+    Raises ValueError naming the image that could not be processed.
+    """
+    pending = []
+    remaining = iter(enumerate(images))
+    
+    def start_next():
+        for idx, (path, converted_path, _) in remaining:
+            work = run_in_process(TOOL_NAME, prepare_image, path, converted_path, layout)
+            pending.append((idx, asyncio.ensure_future(work)))
+            return
+    
+    try:
+        for _ in range(max(1, EXECUTOR_WORKERS)):
+            start_next()
+        
+        while pending:
+            idx, task = pending.pop(0)
+            try:
+                page = await task
+            except Exception as e:
+                filename = images[idx][2]
+                print(f"[Image Arranger to PDF] Error processing image {filename}: {e}")
+                raise ValueError(f"Failed to process image {filename}: {str(e)}")
+            print(f"[Image Arranger to PDF] Processed image {idx + 1}/{len(images)}: {images[idx][2]}")
+            start_next()
+            yield page
+    finally:
+        # A page failed - don't convert the rest
+        for _, task in pending:
+            task.cancel()
+
+
 def cleanup_files(*file_paths):
     """Clean up temporary files"""
     for path in file_paths:
@@ -8,6 +8,19 @@ from fastapi.responses import FileResponse
 from PyPDF2 import PdfReader, PdfWriter
 import tempfile
 import os
+import sys
+
+# Make the shared backend helpers importable
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if TOOLS_DIR not in sys.path:
+    sys.path.insert(0, TOOLS_DIR)
+
+from shared.executor import run_blocking
+from shared.uploads import read_form, max_upload_size, UploadTooLarge
+from shared.page_ranges import PageSelection
+
+TOOL_NAME = 'pdf-page-remover'
+MAX_UPLOAD_SIZE = max_upload_size(TOOL_NAME, 200)
 
 
 async def execute(request: Request):
@@ -16,63 +29,40 @@ async def execute(request: Request):
     
     Expected form data:
     - file: PDF file
-    - pages: Comma-separated page numbers (e.g., "1, 3, 5-7")
+    - pages: Comma-separated page numbers (e.g., "1, 3, 5-7"); also open-ended
+      ranges ("10-"), negative indices ("-1" = last page), steps ("1-20/2"),
+      "odd" and "even"
     """
     try:
-        # Get form data
-        form = await request.form()
+        # Get form data (uploaded file is streamed to a temporary file)
+        try:
+            form = await read_form(request, MAX_UPLOAD_SIZE)
+        except UploadTooLarge as e:
+            return {"error": str(e)}, 413
+        
         pdf_file = form.get('file')
         pages_to_remove = form.get('pages', '')
         
-        if not pdf_file:
+        if not pdf_file or isinstance(pdf_file, str):
+            form.cleanup()
             return {"error": "No PDF file provided"}, 400
         
-        if not pages_to_remove:
+        if not pages_to_remove or not pages_to_remove.strip(' ,'):
+            form.cleanup()
             return {"error": "No page numbers provided"}, 400
         
-        # Parse page numbers
-        pages_set = parse_page_numbers(pages_to_remove)
-        if not pages_set:
-            return {"error": "Invalid page numbers format"}, 400
-        
-        # Read the uploaded PDF
-        pdf_content = await pdf_file.read()
-        
-        # Save to temporary input file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_input:
-            tmp_input.write(pdf_content)
-            input_path = tmp_input.name
+        input_path = pdf_file.path
         
         try:
-            # Read PDF
-            reader = PdfReader(input_path)
-            total_pages = len(reader.pages)
-            
-            # Validate page numbers
-            max_page = max(pages_set) if pages_set else 0
-            if max_page > total_pages:
-                return {
-                    "error": f"Page {max_page} doesn't exist. PDF has only {total_pages} pages."
-                }, 400
-            
-            if len(pages_set) >= total_pages:
-                return {"error": "Cannot remove all pages from PDF"}, 400
-            
-            # Create writer and add pages (excluding the ones to remove)
-            writer = PdfWriter()
-            pages_kept = 0
-            
-            for page_num in range(1, total_pages + 1):
-                if page_num not in pages_set:
-                    writer.add_page(reader.pages[page_num - 1])
-                    pages_kept += 1
-            
-            # Save to temporary output file
+            # Remove pages in the shared executor (PyPDF2 work is blocking)
             with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_output:
                 output_path = tmp_output.name
             
-            with open(output_path, 'wb') as output_file:
-                writer.write(output_file)
+            try:
+                await run_blocking(TOOL_NAME, remove_pages, input_path, output_path, pages_to_remove)
+            except ValueError as e:
+                cleanup_files(input_path, output_path)
+                return {"error": str(e)}, 400
             
             # Get original filename
             original_filename = pdf_file.filename
@@ -88,48 +78,46 @@ async def execute(request: Request):
                 media_type='application/pdf',
                 background=lambda: cleanup_files(input_path, output_path)
             )
-            
+        
         except Exception as e:
             # Cleanup on error
-            cleanup_files(input_path, None)
+            cleanup_files(input_path, output_path if 'output_path' in locals() else None)
             raise e
-            
+    
     except Exception as e:
         print(f"Error processing PDF: {e}")
         return {"error": str(e)}, 500
 
 
-def parse_page_numbers(pages_str: str) -> set:
+def remove_pages(input_path: str, output_path: str, pages_to_remove: str) -> int:
     """
-    Parse page numbers from string format like "1, 3, 5-7"
-    Returns set of page numbers to remove
+    Write a copy of the PDF without the given pages (runs in the executor)
+    Returns number of pages kept; raises ValueError for invalid page numbers
     """
-    pages = set()
-    parts = pages_str.split(',')
+    reader = PdfReader(input_path)
+    total_pages = len(reader.pages)
     
-    for part in parts:
-        part = part.strip()
-        
-        if '-' in part:
-            # Handle range like "3-5"
-            try:
-                start, end = part.split('-')
-                start = int(start.strip())
-                end = int(end.strip())
-                if start >= 1 and end >= start:
-                    pages.update(range(start, end + 1))
-            except (ValueError, IndexError):
-                continue
-        else:
-            # Handle single page like "3"
-            try:
-                page = int(part.strip())
-                if page >= 1:
-                    pages.add(page)
-            except ValueError:
-                continue
+    # Parse and validate page numbers against the page count (never expanded into a list)
+    removed = PageSelection.parse(pages_to_remove, total_pages)
+    if not removed:
+        raise ValueError("Invalid page numbers format")
+    
+    kept = removed.invert()
+    if not kept:
+        raise ValueError("Cannot remove all pages from PDF")
+    
+    # Create writer and add pages (excluding the ones to remove)
+    writer = PdfWriter()
+    pages_kept = 0
+    
+    for page_num in kept:
+        writer.add_page(reader.pages[page_num - 1])
+        pages_kept += 1
+    
+    with open(output_path, 'wb') as output_file:
+        writer.write(output_file)
     
-    return pages
+    return pages_kept
 
 
 def cleanup_files(*file_paths):
@@ -4,12 +4,43 @@ Splits PDF files into multiple documents by page ranges
 """
 
 from fastapi import Request
-from fastapi.responses import FileResponse
-from PyPDF2 import PdfReader, PdfWriter
-import tempfile
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from urllib.parse import quote
+import asyncio
 import os
 import json
 import zipfile
+import sys
+
+# Make the shared backend helpers importable
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if TOOLS_DIR not in sys.path:
+    sys.path.insert(0, TOOLS_DIR)
+
+from shared.executor import run_in_process, EXECUTOR_WORKERS
+from shared.uploads import read_form, max_upload_size, UploadTooLarge
+from shared.pdf_pages import page_count, write_splits, outline_starts, size_chunks
+from shared.page_ranges import PageSelection
+from shared.zip_stream import stream_zip
+
+TOOL_NAME = 'pdf-splitter'
+MAX_UPLOAD_SIZE = max_upload_size(TOOL_NAME, 200)
+
+# ZIP entry compression: PDFs are already compressed, so STORED by default
+ZIP_COMPRESSION = {
+    'stored': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+}
+
+# Server-side split rules (instead of an explicit splits list)
+SPLIT_RULES = ('pages', 'size', 'bookmarks')
+MIN_SPLIT_SIZE_MB = 0.1
+
+# Splits are written in jobs of consecutive splits that share one parse of
+# the input, about this many per executor worker (more jobs parse the input
+# more often; fewer hold more finished splits until they are zipped)
+JOBS_PER_WORKER = 4
 
 
 async def execute(request: Request):
@@ -21,124 +52,257 @@ async def execute(request: Request):
     - splits: JSON array of split configurations
       [
         {"name": "chapter-1", "pages": [1, 2, 3]},
-        {"name": "chapter-2", "pages": [4, 5, 6]}
+        {"name": "chapter-2", "pages": "4-10, 12"},
+        {"name": "rest", "pages": "13-"}
       ]
+      pages is a list of page numbers or a page range string (open-ended
+      ranges, negative indices, steps, "odd"/"even" - see shared/page_ranges.py)
+    - split_by: Optional rule used instead of splits:
+      "pages" (every pages_per_split pages), "size" (parts of at most
+      max_size_mb MB) or "bookmarks" (one part per top-level bookmark)
+    - pages_per_split: Pages per part for split_by=pages
+    - max_size_mb: Maximum part size for split_by=size
+    - compression: Optional, "stored" (default) or "deflate" for the ZIP entries
+    
+    The ZIP is streamed while the splits are generated in parallel.
     """
     try:
-        # Get form data
-        form = await request.form()
+        # Get form data (uploaded file is streamed to a temporary file)
+        try:
+            form = await read_form(request, MAX_UPLOAD_SIZE)
+        except UploadTooLarge as e:
+            return {"error": str(e)}, 413
+        
         pdf_file = form.get('file')
         splits_json = form.get('splits', '[]')
+        split_by = (form.get('split_by') or '').lower()
+        compression = form.get('compression', 'stored').lower()
         
-        if not pdf_file:
+        if not pdf_file or isinstance(pdf_file, str):
+            form.cleanup()
             return {"error": "No PDF file provided"}, 400
         
+        if split_by and split_by not in SPLIT_RULES:
+            form.cleanup()
+            return {"error": f"Invalid split_by. Supported: {', '.join(SPLIT_RULES)}"}, 400
+        
         # Parse splits configuration
         try:
             splits = json.loads(splits_json)
         except json.JSONDecodeError:
+            form.cleanup()
             return {"error": "Invalid splits configuration"}, 400
         
-        if not splits or not isinstance(splits, list):
+        if not split_by and (not splits or not isinstance(splits, list)):
+            form.cleanup()
             return {"error": "No splits provided"}, 400
         
-        # Read the uploaded PDF
-        pdf_content = await pdf_file.read()
+        if compression not in ZIP_COMPRESSION:
+            form.cleanup()
+            return {"error": f"Invalid compression. Supported: {', '.join(ZIP_COMPRESSION)}"}, 400
         
-        # Save to temporary input file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_input:
-            tmp_input.write(pdf_content)
-            input_path = tmp_input.name
-        
-        temp_files = [input_path]
+        input_path = pdf_file.path
         
         try:
-            # Read PDF
-            reader = PdfReader(input_path)
-            total_pages = len(reader.pages)
-            
-            # Validate all splits
-            for split in splits:
-                if not isinstance(split, dict):
-                    return {"error": "Invalid split format"}, 400
-                
-                if 'pages' not in split or not isinstance(split['pages'], list):
-                    return {"error": "Each split must have a 'pages' array"}, 400
-                
-                # Validate page numbers
-                for page_num in split['pages']:
-                    if not isinstance(page_num, int) or page_num < 1 or page_num > total_pages:
-                        return {
-                            "error": f"Invalid page number {page_num}. PDF has {total_pages} pages."
-                        }, 400
-            
-            # Create split PDFs
-            split_files = []
-            
-            for i, split in enumerate(splits):
-                name = split.get('name', f'split-{i+1}')
-                pages = split['pages']
-                
-                if not pages:
-                    continue
-                
-                # Create writer for this split
-                writer = PdfWriter()
-                
-                # Add specified pages (pages are 1-indexed from frontend)
-                for page_num in sorted(pages):
-                    writer.add_page(reader.pages[page_num - 1])
-                
-                # Save to temporary file
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_split:
-                    split_path = tmp_split.name
-                
-                with open(split_path, 'wb') as output_file:
-                    writer.write(output_file)
-                
-                # Sanitize filename
-                safe_name = sanitize_filename(name)
-                split_files.append((split_path, f'{safe_name}.pdf'))
-                temp_files.append(split_path)
-            
-            if not split_files:
-                return {"error": "No valid splits created"}, 400
-            
-            # Create ZIP file with all splits
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as tmp_zip:
-                zip_path = tmp_zip.name
-            
-            temp_files.append(zip_path)
-            
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for split_path, filename in split_files:
-                    zipf.write(split_path, filename)
-            
             # Get original filename for ZIP
             original_filename = pdf_file.filename
             if original_filename:
                 zip_filename = original_filename.replace('.pdf', '-splits.zip')
             else:
                 zip_filename = 'pdf-splits.zip'
+            stem = sanitize_filename(os.path.splitext(original_filename or '')[0])
+            
+            # Validate against the page count before the response starts
+            max_bytes = None
+            try:
+                total_pages = await run_in_process(TOOL_NAME, page_count, input_path)
+                if split_by:
+                    split_files, max_bytes = await plan_rule_splits(input_path, split_by, form, total_pages, stem)
+                else:
+                    split_files = plan_splits(splits, total_pages)
+            except ValueError as e:
+                cleanup_files(input_path)
+                return {"error": str(e)}, 400
+            
+            def part_filename(pages: list) -> str:
+                return range_filename(stem, pages[0], pages[-1], total_pages)
             
-            # Return the ZIP file
-            return FileResponse(
-                path=zip_path,
-                filename=zip_filename,
+            async def zip_chunks():
+                try:
+                    splits_stream = generate_splits(input_path, split_files, max_bytes, part_filename)
+                    async for chunk in stream_zip(splits_stream, ZIP_COMPRESSION[compression]):
+                        yield chunk
+                    print(f"Streamed {len(split_files)} splits")
+                finally:
+                    cleanup_files(input_path)
+            
+            # Return the ZIP while it is being built
+            return StreamingResponse(
+                zip_chunks(),
                 media_type='application/zip',
-                background=lambda: cleanup_files(*temp_files)
+                headers={'Content-Disposition': content_disposition(zip_filename)},
+                # Also runs if the client disconnects before streaming starts
+                background=BackgroundTask(cleanup_files, input_path)
             )
-            
+        
         except Exception as e:
             # Cleanup on error
-            cleanup_files(*temp_files)
+            cleanup_files(input_path)
             raise e
-            
+    
     except Exception as e:
         print(f"Error splitting PDF: {e}")
         return {"error": str(e)}, 500
 
 
+def plan_splits(splits: list, total_pages: int) -> list:
+    """
+    Validate the splits configuration
+    Returns [(filename, PageSelection)] for the non-empty splits; raises ValueError for invalid splits
+    """
+    split_files = []
+    for i, split in enumerate(splits):
+        if not isinstance(split, dict):
+            raise ValueError("Invalid split format")
+        
+        pages = split.get('pages')
+        if isinstance(pages, list):
+            selection = PageSelection.from_pages(pages, total_pages)
+        elif isinstance(pages, str):
+            selection = PageSelection.parse(pages, total_pages)
+        else:
+            raise ValueError("Each split must have a 'pages' array or range string")
+        
+        if not selection:
+            continue
+        
+        # Pages are 1-indexed from frontend; the selection iterates them in order
+        name = split.get('name', f'split-{i+1}')
+        split_files.append((f'{sanitize_filename(name)}.pdf', selection))
+    
+    if not split_files:
+        raise ValueError("No valid splits created")
+    
+    return split_files
+
+
+async def plan_rule_splits(input_path: str, split_by: str, form, total_pages: int, stem: str):
+    """
+    Splits for a server-side rule. Returns ([(filename, PageSelection)], max_bytes),
+    max_bytes being the part size limit for split_by=size (else None).
+    Raises ValueError for missing/invalid rule parameters.
+    """
+    if split_by == 'pages':
+        try:
+            per_split = int(form.get('pages_per_split') or 0)
+        except ValueError:
+            per_split = 0
+        if per_split < 1:
+            raise ValueError("pages_per_split must be a positive number")
+        
+        return [
+            (range_filename(stem, start, min(start + per_split - 1, total_pages), total_pages),
+             PageSelection([(start, min(start + per_split - 1, total_pages), 1)], total_pages))
+            for start in range(1, total_pages + 1, per_split)
+        ], None
+    
+    if split_by == 'size':
+        try:
+            max_size_mb = float(form.get('max_size_mb') or 0)
+        except ValueError:
+            max_size_mb = 0
+        if max_size_mb < MIN_SPLIT_SIZE_MB:
+            raise ValueError(f"max_size_mb must be at least {MIN_SPLIT_SIZE_MB}")
+        
+        max_bytes = int(max_size_mb * 1024 * 1024)
+        chunks = await run_in_process(TOOL_NAME, size_chunks, input_path, max_bytes)
+        return [
+            (range_filename(stem, start, end, total_pages), PageSelection([(start, end, 1)], total_pages))
+            for start, end in chunks
+        ], max_bytes
+    
+    # Bookmarks: each top-level entry runs until the next one starts
+    starts = await run_in_process(TOOL_NAME, outline_starts, input_path)
+    if not starts:
+        raise ValueError("PDF has no bookmarks to split by")
+    
+    if starts[0][1] > 1:
+        starts.insert(0, ('front-matter', 1))
+    
+    split_files = []
+    used_names = set()
+    for i, (title, start) in enumerate(starts):
+        end = starts[i + 1][1] - 1 if i + 1 < len(starts) else total_pages
+        if end < start:
+            # Several bookmarks on one page - the last one gets it
+            continue
+        
+        name = sanitize_filename(title)
+        unique_name, counter = name, 2
+        while unique_name.lower() in used_names:
+            unique_name = f'{name}-{counter}'
+            counter += 1
+        used_names.add(unique_name.lower())
+        split_files.append((f'{unique_name}.pdf', PageSelection([(start, end, 1)], total_pages)))
+    
+    return split_files, None
+
+
+def range_filename(stem: str, start: int, end: int, total_pages: int) -> str:
+    """Part name from its page range, zero-padded so the parts sort in order"""
+    width = len(str(total_pages))
+    if start == end:
+        return f'{stem}-page-{start:0{width}d}.pdf'
+    return f'{stem}-pages-{start:0{width}d}-{end:0{width}d}.pdf'
+
+
+async def generate_splits(input_path: str, split_files: list, max_bytes: int = None, part_filename=None):
+    """
+    Build the split PDFs in parallel in the shared executor and yield
+    (filename, pdf_bytes) in order, keeping at most one job of consecutive
+    splits per worker in flight (see write_splits()).
+    With max_bytes, a split that comes out too large is divided further and
+    its parts are named by part_filename(pages).
+    """
+    workers = max(1, EXECUTOR_WORKERS)
+    per_job = max(1, -(-len(split_files) // (workers * JOBS_PER_WORKER)))
+    jobs = iter([split_files[i:i + per_job] for i in range(0, len(split_files), per_job)])
+    pending = []
+    
+    def start_next():
+        for job in jobs:
+            work = run_in_process(TOOL_NAME, write_splits, input_path, [pages for _, pages in job], max_bytes)
+            pending.append((job, asyncio.ensure_future(work)))
+            return
+    
+    try:
+        for _ in range(workers):
+            start_next()
+        
+        while pending:
+            job, task = pending.pop(0)
+            results = await task
+            start_next()
+            for (filename, _), data in zip(job, results):
+                if max_bytes:
+                    for pages, part in data:
+                        yield part_filename(pages), part
+                else:
+                    yield filename, data
+    finally:
+        # Client went away or a split failed - don't build the rest
+        for _, task in pending:
+            task.cancel()
+
+
+def content_disposition(filename: str) -> str:
+    """Attachment header for a download, like FileResponse builds it"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
 def sanitize_filename(name: str) -> str:
     """
     Sanitize filename by removing/replacing invalid characters
@@ -1,11 +1,49 @@
-from fastapi import Request, UploadFile
-from fastapi.responses import JSONResponse
+from fastapi import Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from PIL import Image, ImageEnhance
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import asyncio
 import cv2
+import json
 import numpy as np
-import io
 import os
 import sys
+import threading
+
+# Make the shared backend helpers importable
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if TOOLS_DIR not in sys.path:
+    sys.path.insert(0, TOOLS_DIR)
+
+from shared.executor import run_blocking, run_in_process, EXECUTOR_WORKERS
+from shared.uploads import read_form, max_upload_size, UploadTooLarge
+from shared import pdf_render
+
+TOOL_NAME = 'qr-code-scanner'
+MAX_UPLOAD_SIZE = max_upload_size(TOOL_NAME, 25)
+MAX_TOTAL_UPLOAD_SIZE = max_upload_size(TOOL_NAME + '-total', 500)
+
+# Batch mode: PDF render resolution (default and allowed range)
+DEFAULT_PDF_DPI = 200
+MIN_PDF_DPI = 72
+MAX_PDF_DPI = 400
+
+# Batch mode: items (images / PDF pages) decoded or waiting for a worker at once
+BATCH_WINDOW = max(2, EXECUTOR_WORKERS * 2)
+
+# Threads for trying preprocessing variants side by side (OpenCV and zbar release the GIL)
+PREPROCESS_WORKERS = int(os.environ.get('TOOLS_QR_PREPROCESS_WORKERS', 5))
+
+# Coarse-to-fine scanning: longest side of each reduced level tried before full resolution
+PYRAMID_SIDES = [1024, 2048]
+
+# Extra border around candidate regions when cropping them from the full image
+CANDIDATE_MARGIN = 0.25
+
+_preprocess_pool = None
+_preprocess_pool_lock = threading.Lock()
+_local = threading.local()
 
 # Fix for macOS zbar library path
 if sys.platform == 'darwin':
@@ -31,61 +69,49 @@ async def execute(request: Request):
             }
         ]
     }
+    
+    Batch mode (several files, a PDF, or mode=batch) looks for every code in each
+    image / PDF page and streams one JSON object per line as items finish; see
+    batch_response().
     """
+    form = None
+    streaming = False
     try:
-        form = await request.form()
-        file: UploadFile = form.get('file')
+        try:
+            form = await read_form(request, MAX_UPLOAD_SIZE, MAX_TOTAL_UPLOAD_SIZE)
+        except UploadTooLarge as e:
+            return JSONResponse(
+                {"error": str(e)}, 
+                status_code=413
+            )
         
-        if not file:
+        files = form.files
+        
+        if not files:
             return JSONResponse(
                 {"error": "No image file provided"}, 
                 status_code=400
             )
         
-        # Read image content
-        image_content = await file.read()
-        print(f"[QR Scanner] Processing: {file.filename} ({len(image_content)} bytes)")
+        mode = form.get('mode') or request.query_params.get('mode')
+        if mode == 'batch' or len(files) > 1 or any(is_pdf(f) for f in files):
+            response = await batch_response(form, files)
+            streaming = isinstance(response, StreamingResponse)
+            return response
+        
+        file = files[0]
+        print(f"[QR Scanner] Processing: {file.filename} ({file.size} bytes)")
         
-        # Validate it's an image
+        # Decode coarse-to-fine (blocking work runs in the shared executor)
         try:
-            pil_image = Image.open(io.BytesIO(image_content))
-        except Exception as e:
+            codes = await run_blocking(TOOL_NAME, scan_image, file.path)
+        except ValueError:
             return JSONResponse(
                 {"error": "Invalid image file. Please upload a valid image (JPG, PNG, etc.)"}, 
                 status_code=400
             )
         
-        # Convert PIL image to OpenCV format
-        img_array = np.array(pil_image.convert('RGB'))
-        
-        # Try multiple detection strategies
-        codes = []
-        
-        # Strategy 1: pyzbar (most reliable for standard QR codes) - if available
-        if PYZBAR_AVAILABLE:
-            codes.extend(decode_with_pyzbar(pil_image))
-            if codes:
-                print(f"[QR Scanner] Decoded using pyzbar strategy")
-        
-        # Strategy 2: OpenCV QRCodeDetector (good for some cases)
-        if not codes:
-            codes.extend(decode_with_opencv(img_array))
-            if codes:
-                print(f"[QR Scanner] Decoded using OpenCV strategy")
-        
-        # Strategy 3: Try with image preprocessing (most thorough)
-        if not codes:
-            codes.extend(decode_with_preprocessing(pil_image, img_array))
-            if codes:
-                print(f"[QR Scanner] Decoded using preprocessing strategy")
-        
-        # Remove duplicates
-        unique_codes = []
-        seen_data = set()
-        for code in codes:
-            if code['data'] not in seen_data:
-                unique_codes.append(code)
-                seen_data.add(code['data'])
+        unique_codes = unique(codes)
         
         if not unique_codes:
             print("[QR Scanner] No codes detected")
@@ -102,7 +128,7 @@ async def execute(request: Request):
             "codes": unique_codes,
             "count": len(unique_codes)
         })
-        
+    
     except Exception as e:
         print(f"Error processing QR code: {e}")
         import traceback
@@ -111,15 +137,330 @@ async def execute(request: Request):
             {"error": f"An error occurred while processing the image: {str(e)}"}, 
             status_code=500
         )
+    finally:
+        # A streamed batch cleans up its files once it is done
+        if form is not None and not streaming:
+            form.cleanup()
 
 
-def decode_with_pyzbar(pil_image):
-    """Decode using pyzbar library"""
+async def batch_response(form, files):
+    """
+    Scan many images and/or the pages of PDFs, streaming NDJSON results
+    (one line per image / page, in completion order, then a summary line):
+    
+    {"index": 0, "file": "note.pdf", "page": 1, "codes": [...], "count": 2}
+    {"index": 1, "file": "photo.jpg", "codes": [], "count": 0, "error": "..."}
+    {"done": true, "items": 2, "count": 2}
+    
+    Form data: file / files (images or PDFs), dpi (PDF render resolution, default 200)
+    """
+    try:
+        dpi = min(MAX_PDF_DPI, max(MIN_PDF_DPI, int(form.get('dpi') or DEFAULT_PDF_DPI)))
+    except ValueError:
+        return JSONResponse(
+            {"error": "Invalid dpi value"},
+            status_code=400
+        )
+    
+    if any(is_pdf(f) for f in files) and not pdf_render.PDFIUM_AVAILABLE:
+        return JSONResponse(
+            {"error": "Scanning PDFs is not available on this server (pypdfium2 is not installed)"},
+            status_code=400
+        )
+    
+    # Expand PDFs into pages up front, so a broken PDF is reported before streaming starts
+    items = []
+    for file in files:
+        if is_pdf(file):
+            try:
+                pages = await run_in_process(TOOL_NAME, pdf_render.page_count, file.path)
+            except ValueError:
+                return JSONResponse(
+                    {"error": f"Invalid PDF file: {file.filename}"},
+                    status_code=400
+                )
+            for page_index in range(pages):
+                items.append(({"file": file.filename, "page": page_index + 1}, scan_pdf_page, (file.path, page_index, dpi)))
+        else:
+            items.append(({"file": file.filename}, scan_upload, (file.path,)))
+    
+    print(f"[QR Scanner] Batch: {len(files)} file(s), {len(items)} item(s)")
+    
+    async def results():
+        total = 0
+        try:
+            async for result in scan_items(items):
+                total += result['count']
+                yield json.dumps(result) + "\n"
+            yield json.dumps({"done": True, "items": len(items), "count": total}) + "\n"
+            print(f"[QR Scanner] Batch done: {total} code(s) in {len(items)} item(s)")
+        finally:
+            form.cleanup()
+    
+    return StreamingResponse(
+        results(),
+        media_type='application/x-ndjson',
+        headers={'X-Accel-Buffering': 'no'},
+        # Also runs if the client disconnects before streaming starts
+        background=BackgroundTask(form.cleanup)
+    )
+
+
+async def scan_items(items):
+    """Scan batch items concurrently (bounded), yielding each result as soon as it is ready"""
+    window = asyncio.Semaphore(BATCH_WINDOW)
+    
+    async def run(index, meta, scan, args):
+        async with window:
+            result = {"index": index, **meta}
+            try:
+                codes = unique(await scan(*args))
+                result.update(codes=codes, count=len(codes))
+            except ValueError:
+                error = "Could not render PDF page" if 'page' in meta else "Invalid image file"
+                result.update(codes=[], count=0, error=error)
+            except Exception as e:
+                # Reported with the item, so the stream still ends with its "done" line
+                print(f"[QR Scanner] Error scanning item {index}: {e}")
+                result.update(codes=[], count=0, error="Could not scan this item")
+            return result
+    
+    tasks = [asyncio.ensure_future(run(index, *item)) for index, item in enumerate(items)]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        # Client went away - don't scan the rest
+        for task in tasks:
+            task.cancel()
+
+
+async def scan_upload(path: str):
+    return await run_blocking(TOOL_NAME, scan_image_multi, path)
+
+
+async def scan_pdf_page(path: str, page_index: int, dpi: int):
+    # pdfium is not thread-safe, so pages are rendered in the process pool
+    image = await run_in_process(TOOL_NAME, pdf_render.render_page, path, page_index, dpi, grayscale=True)
+    return await run_blocking(TOOL_NAME, scan_image_multi, image)
+
+
+def is_pdf(file) -> bool:
+    return file.filename.lower().endswith('.pdf') or file.content_type == 'application/pdf'
+
+
+def unique(codes: list) -> list:
+    """Remove duplicates (same data), keeping the first occurrence"""
+    unique_codes = []
+    seen_data = set()
+    for code in codes:
+        if code['data'] not in seen_data:
+            unique_codes.append(code)
+            seen_data.add(code['data'])
+    return unique_codes
+
+
+def load_image(source, max_side: int = None):
+    """
+    Open an image (path or PIL image), reduced so its longest side is at most
+    max_side (None = full size). JPEGs are decoded in draft mode (DCT scaling),
+    so a small level of a large photo never decodes the full frame.
+    Raises ValueError for invalid images.
+    """
+    if isinstance(source, Image.Image):
+        if max_side and max(source.size) > max_side:
+            source = source.copy()
+            source.thumbnail((max_side, max_side), Image.Resampling.BILINEAR)
+        return source
+    
+    try:
+        image = Image.open(source)
+        if max_side and max(image.size) > max_side:
+            scale = max_side / max(image.size)
+            if image.format == 'JPEG':
+                # Picks the largest 1/2, 1/4 or 1/8 scale that is still >= the requested size
+                image.draft('RGB', (int(image.width * scale), int(image.height * scale)))
+            image.load()
+            image.thumbnail((max_side, max_side), Image.Resampling.BILINEAR)
+        else:
+            image.load()
+    except Exception as e:
+        raise ValueError(f"Invalid image: {e}")
+    return image
+
+
+def pyramid_sides(size) -> list:
+    """Reduced levels worth trying for an image of this size, then None (full size)"""
+    longest = max(size)
+    return [side for side in PYRAMID_SIDES if side < longest * 0.75] + [None]
+
+
+def find_candidates(pil_image) -> list:
+    """
+    Regions that look like QR codes (OpenCV finder-pattern detection), as
+    (left, top, right, bottom) fractions of the image size
+    """
+    gray = np.array(pil_image.convert('L'))
+    height, width = gray.shape
+    candidates = []
+    try:
+        found, points = get_detector().detectMulti(gray)
+        if not found:
+            found, points = get_detector().detect(gray)
+        if found and points is not None:
+            for quad in np.asarray(points).reshape(-1, 4, 2):
+                xs, ys = quad[:, 0], quad[:, 1]
+                margin_x = (xs.max() - xs.min()) * CANDIDATE_MARGIN
+                margin_y = (ys.max() - ys.min()) * CANDIDATE_MARGIN
+                candidates.append((
+                    max(0.0, (xs.min() - margin_x) / width),
+                    max(0.0, (ys.min() - margin_y) / height),
+                    min(1.0, (xs.max() + margin_x) / width),
+                    min(1.0, (ys.max() + margin_y) / height),
+                ))
+    except Exception as e:
+        print(f"[QR Scanner] Candidate detection error: {e}")
+    return candidates
+
+
+def scan_image(path: str):
+    """
+    Decode an image coarse-to-fine: quick strategies on small pyramid levels
+    first, then on crops of candidate regions at full resolution, then the
+    full frame with every strategy.
+    The file is decoded once: a JPEG's first level comes from a draft-mode
+    decode (a fraction of the full frame, enough for most photos), and only
+    if that fails is the full frame decoded and the other levels reduced
+    from it.
+    Raises ValueError for invalid images.
+    """
+    try:
+        with Image.open(path) as header:
+            full_size = header.size
+            draft = header.format == 'JPEG'
+    except Exception as e:
+        raise ValueError(f"Invalid image: {e}")
+    
+    full_image = None
+    candidates = []
+    for level, max_side in enumerate(pyramid_sides(full_size)):
+        if level == 0 and draft and max_side is not None:
+            image = load_image(path, max_side)
+        else:
+            if full_image is None:
+                full_image = load_image(path)
+            image = load_image(full_image, max_side)
+        
+        if max_side is None:
+            # Full resolution: look closer at the regions seen at the coarser levels first
+            for left, top, right, bottom in candidates:
+                crop = image.crop((
+                    int(left * image.width), int(top * image.height),
+                    int(right * image.width), int(bottom * image.height)
+                ))
+                codes = decode_image(crop, thorough=False)
+                if codes:
+                    print(f"[QR Scanner] Decoded from candidate region at full resolution")
+                    return codes
+        
+        # Reduced levels only get the quick strategies; preprocessing is saved for full size
+        codes = decode_image(image, thorough=max_side is None)
+        if codes:
+            print(f"[QR Scanner] Decoded at {image.width}x{image.height} (full size {full_size[0]}x{full_size[1]})")
+            return codes
+        
+        if max_side is not None:
+            candidates = find_candidates(image) or candidates
+    
+    return []
+
+
+def scan_image_multi(source):
+    """
+    Find every code in an image (path or PIL image) at full resolution:
+    zbar and OpenCV multi-code detection together, then the preprocessing
+    variants if neither found anything. Raises ValueError for invalid images.
+    """
+    image = load_image(source)
+    img_array = np.array(image.convert('RGB'))
+    
+    codes = decode_with_pyzbar(image) + decode_with_opencv_multi(img_array)
+    if not codes:
+        codes = decode_with_preprocessing(image, img_array)
+    return codes
+
+
+def decode_image(pil_image, thorough: bool = True):
+    """
+    Run the detection strategies, cheapest first, and return the codes found.
+    thorough=False skips the (much slower) preprocessing variants.
+    """
+    # Convert PIL image to OpenCV format
+    img_array = np.array(pil_image.convert('RGB'))
+    codes = []
+    
+    # Strategy 1: pyzbar (most reliable for standard QR codes) - if available
+    if PYZBAR_AVAILABLE:
+        codes.extend(decode_with_pyzbar(pil_image))
+        if codes:
+            print(f"[QR Scanner] Decoded using pyzbar strategy")
+    
+    # Strategy 2: OpenCV QRCodeDetector (good for some cases)
+    if not codes:
+        codes.extend(decode_with_opencv(img_array))
+        if codes:
+            print(f"[QR Scanner] Decoded using OpenCV strategy")
+    
+    # Strategy 3: Try with image preprocessing (most thorough)
+    if not codes and thorough:
+        codes.extend(decode_with_preprocessing(pil_image, img_array))
+        if codes:
+            print(f"[QR Scanner] Decoded using preprocessing strategy")
+    
+    return codes
+
+
+def get_detector():
+    """OpenCV QRCodeDetector for the current thread (not thread-safe, but reusable)"""
+    detector = getattr(_local, 'detector', None)
+    if detector is None:
+        detector = _local.detector = cv2.QRCodeDetector()
+    return detector
+
+
+def get_multi_detector():
+    """OpenCV detector for several codes per image, for the current thread.
+    The ArUco-based detector finds multiple codes far more reliably than the classic one."""
+    detector = getattr(_local, 'multi_detector', None)
+    if detector is None:
+        if hasattr(cv2, 'QRCodeDetectorAruco'):
+            detector = cv2.QRCodeDetectorAruco()
+        else:
+            detector = cv2.QRCodeDetector()
+        _local.multi_detector = detector
+    return detector
+
+
+def get_preprocess_pool():
+    """Thread pool for preprocessing variants (separate from the shared executor,
+    which runs the calling decode_image and must not wait on itself)"""
+    global _preprocess_pool
+    with _preprocess_pool_lock:
+        if _preprocess_pool is None:
+            _preprocess_pool = ThreadPoolExecutor(
+                max_workers=max(1, PREPROCESS_WORKERS),
+                thread_name_prefix='qr-preprocess'
+            )
+        return _preprocess_pool
+
+
+def decode_with_pyzbar(image):
+    """Decode using pyzbar library (PIL image or grayscale/RGB array)"""
     codes = []
     if not PYZBAR_AVAILABLE:
         return codes
     try:
-        decoded_objects = pyzbar.decode(pil_image)
+        decoded_objects = pyzbar.decode(image)
         for obj in decoded_objects:
             codes.append({
                 "type": obj.type,
@@ -131,11 +472,10 @@ def decode_with_pyzbar(pil_image):
 
 
 def decode_with_opencv(img_array):
-    """Decode using OpenCV QRCodeDetector"""
+    """Decode using OpenCV QRCodeDetector (grayscale or RGB array)"""
     codes = []
     try:
-        detector = cv2.QRCodeDetector()
-        data, vertices_array, binary_qrcode = detector.detectAndDecode(img_array)
+        data, vertices_array, binary_qrcode = get_detector().detectAndDecode(img_array)
         if data:
             codes.append({
                 "type": "QRCODE",
@@ -146,87 +486,86 @@ def decode_with_opencv(img_array):
     return codes
 
 
-def decode_with_preprocessing(pil_image, img_array):
-    """Try decoding with various image preprocessing techniques"""
+def decode_with_opencv_multi(img_array):
+    """Decode every QR code in the image using OpenCV detectAndDecodeMulti"""
     codes = []
-    
-    # Preprocessing strategies
-    preprocessed_images = []
-    
-    # 1. Increase contrast
-    try:
-        enhancer = ImageEnhance.Contrast(pil_image)
-        preprocessed_images.append(enhancer.enhance(2.0))
-    except:
-        pass
-    
-    # 2. Convert to grayscale and apply thresholding
-    try:
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-        _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        preprocessed_images.append(Image.fromarray(thresh))
-    except:
-        pass
-    
-    # 3. Adaptive thresholding
-    try:
-        gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-        adaptive_thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                                cv2.THRESH_BINARY, 11, 2)
-        preprocessed_images.append(Image.fromarray(adaptive_thresh))
-    except:
-        pass
-    
-    # 4. Increase sharpness
-    try:
-        enhancer = ImageEnhance.Sharpness(pil_image)
-        preprocessed_images.append(enhancer.enhance(2.0))
-    except:
-        pass
-    
-    # 5. Adjust brightness
     try:
-        enhancer = ImageEnhance.Brightness(pil_image)
-        preprocessed_images.append(enhancer.enhance(1.5))
-    except:
-        pass
-    
-    # Try decoding each preprocessed image
-    for processed_img in preprocessed_images:
-        if codes:
-            break
-        
-        # Try pyzbar (if available)
-        if PYZBAR_AVAILABLE:
-            try:
-                decoded_objects = pyzbar.decode(processed_img)
-                for obj in decoded_objects:
+        found, decoded_info, points, straight_qrcodes = get_multi_detector().detectAndDecodeMulti(img_array)
+        if found:
+            for data in decoded_info:
+                if data:
                     codes.append({
-                        "type": obj.type,
-                        "data": obj.data.decode('utf-8')
+                        "type": "QRCODE",
+                        "data": data
                     })
-            except:
-                pass
-        
-        if codes:
-            break
-        
-        # Try OpenCV
-        try:
-            img_np = np.array(processed_img)
-            if len(img_np.shape) == 2:
-                img_np = cv2.cvtColor(img_np, cv2.COLOR_GRAY2RGB)
-            detector = cv2.QRCodeDetector()
-            data, vertices_array, binary_qrcode = detector.detectAndDecode(img_np)
-            if data:
-                codes.append({
-                    "type": "QRCODE",
-                    "data": data
-                })
-        except:
-            pass
-    
+    except Exception as e:
+        print(f"OpenCV decoding error: {e}")
     return codes
 
 
+def preprocessing_variants(pil_image, gray):
+    """Preprocessing strategies as (name, build) pairs; build() returns the image to decode"""
+    return [
+        # 1. Increase contrast
+        ('contrast', lambda: ImageEnhance.Contrast(pil_image).enhance(2.0)),
+        # 2. Grayscale + Otsu thresholding
+        ('otsu', lambda: cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]),
+        # 3. Adaptive thresholding
+        ('adaptive', lambda: cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                                   cv2.THRESH_BINARY, 11, 2)),
+        # 4. Increase sharpness
+        ('sharpness', lambda: ImageEnhance.Sharpness(pil_image).enhance(2.0)),
+        # 5. Adjust brightness
+        ('brightness', lambda: ImageEnhance.Brightness(pil_image).enhance(1.5)),
+    ]
+
+
+def decode_variant(build, stop):
+    """Build one preprocessed image and decode it; gives up early once another variant succeeded"""
+    if stop.is_set():
+        return []
+    try:
+        processed = build()
+    except Exception as e:
+        print(f"[QR Scanner] Preprocessing error: {e}")
+        return []
+    
+    # Try pyzbar (if available)
+    codes = decode_with_pyzbar(processed)
+    if codes or stop.is_set():
+        return codes
+    
+    # Try OpenCV (works on grayscale directly, no RGB conversion needed)
+    return decode_with_opencv(np.asarray(processed))
+
 
+def decode_with_preprocessing(pil_image, img_array):
+    """
+    Try decoding with various image preprocessing techniques.
+    The variants run concurrently and the first one that decodes wins.
+    """
+    # Shared by the thresholding variants
+    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+    
+    stop = threading.Event()
+    pool = get_preprocess_pool()
+    futures = {
+        pool.submit(decode_variant, build, stop): name
+        for name, build in preprocessing_variants(pil_image, gray)
+    }
+    
+    try:
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                codes = future.result()
+                if codes:
+                    print(f"[QR Scanner] Decoded using {futures[future]} preprocessing")
+                    return codes
+        return []
+    finally:
+        # Skip variants that have not started; running ones stop at their next check
+        stop.set()
+        for future in futures:
+            future.cancel()
@@ -0,0 +1,4 @@
+"""
+Shared backend helpers for Tool Studio tools
+Infrastructure used by several tool backends (executors, process runners, etc.)
+"""
@@ -0,0 +1,179 @@
+"""
+Shared Executor
+Runs blocking, CPU-bound tool work off the event loop through a shared
+thread/process pool with per-tool concurrency limits and queue metrics.
+
+Configuration (environment variables):
+- TOOLS_EXECUTOR: Default pool kind, 'thread' (default) or 'process'
+- TOOLS_EXECUTOR_WORKERS: Number of pool workers (default: CPU count)
+- TOOLS_MAX_CONCURRENCY: Default max concurrent jobs per tool
+- TOOLS_MAX_CONCURRENCY_<TOOL>: Per-tool override (e.g. TOOLS_MAX_CONCURRENCY_PDF_MERGER=2)
+"""
+
+import asyncio
+import functools
+import os
+import pickle
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+EXECUTOR_KIND = os.environ.get('TOOLS_EXECUTOR', 'thread').lower()
+EXECUTOR_WORKERS = int(os.environ.get('TOOLS_EXECUTOR_WORKERS', os.cpu_count() or 4))
+DEFAULT_TOOL_CONCURRENCY = int(os.environ.get('TOOLS_MAX_CONCURRENCY', EXECUTOR_WORKERS))
+
+_pools = {}
+_pools_lock = threading.Lock()
+_tools = {}
+_picklable = {}
+
+
+class _ToolState:
+    """Concurrency limit and queue metrics for a single tool"""
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.semaphore = None
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+
+    def get_semaphore(self):
+        # Created lazily so it binds to the running event loop
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.limit)
+        return self.semaphore
+
+    def snapshot(self):
+        finished = self.completed + self.failed
+        return {
+            "limit": self.limit,
+            "queued": self.queued,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "max_queue_depth": self.max_queue_depth,
+            "avg_wait_seconds": round(self.total_wait / finished, 3) if finished else 0.0,
+            "avg_run_seconds": round(self.total_run / finished, 3) if finished else 0.0,
+        }
+
+
+def _env_key(tool: str) -> str:
+    return 'TOOLS_MAX_CONCURRENCY_' + re.sub(r'[^A-Z0-9]+', '_', tool.upper()).strip('_')
+
+
+def _get_tool(tool: str) -> _ToolState:
+    state = _tools.get(tool)
+    if state is None:
+        limit = int(os.environ.get(_env_key(tool), DEFAULT_TOOL_CONCURRENCY))
+        state = _tools.setdefault(tool, _ToolState(tool, max(1, limit)))
+    return state
+
+
+def configure_tool(tool: str, max_concurrency: int):
+    """
+    Set the max number of concurrent jobs for a tool.
+    Environment overrides (TOOLS_MAX_CONCURRENCY_<TOOL>) take precedence.
+    """
+    if tool in _tools:
+        return
+    limit = int(os.environ.get(_env_key(tool), max_concurrency))
+    _tools[tool] = _ToolState(tool, max(1, limit))
+
+
+def get_pool(kind: str = None):
+    """Get (or lazily create) the shared pool of the given kind"""
+    kind = kind or EXECUTOR_KIND
+    with _pools_lock:
+        pool = _pools.get(kind)
+        if pool is None:
+            if kind == 'process':
+                pool = ProcessPoolExecutor(max_workers=EXECUTOR_WORKERS)
+            else:
+                pool = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix='tool-worker')
+            _pools[kind] = pool
+        return pool
+
+
+def _can_pickle(func) -> bool:
+    """Process pools need picklable callables; tool modules loaded by path may not be"""
+    key = (getattr(func, '__module__', None), getattr(func, '__qualname__', repr(func)))
+    if key not in _picklable:
+        try:
+            pickle.dumps(func)
+            _picklable[key] = True
+        except Exception:
+            print(f"[Executor] {key[1]} is not picklable, using thread pool instead")
+            _picklable[key] = False
+    return _picklable[key]
+
+
+async def run_blocking(tool: str, func, *args, kind: str = None, **kwargs):
+    """
+    Run a blocking function in the shared pool without blocking the event loop.
+
+    At most the tool's concurrency limit of jobs run at once; the rest wait
+    in a queue (tracked in get_metrics()).
+    """
+    kind = kind or EXECUTOR_KIND
+    if kind == 'process' and not _can_pickle(func):
+        kind = 'thread'
+
+    state = _get_tool(tool)
+    semaphore = state.get_semaphore()
+
+    queued_at = time.monotonic()
+    state.queued += 1
+    state.max_queue_depth = max(state.max_queue_depth, state.queued)
+    if semaphore.locked():
+        print(f"[Executor] {tool}: queued (depth {state.queued}, running {state.running}/{state.limit})")
+
+    try:
+        await semaphore.acquire()
+    finally:
+        state.queued -= 1
+
+    started_at = time.monotonic()
+    state.total_wait += started_at - queued_at
+    state.running += 1
+    try:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(get_pool(kind), functools.partial(func, *args, **kwargs))
+        state.completed += 1
+        return result
+    except BaseException:
+        state.failed += 1
+        raise
+    finally:
+        state.running -= 1
+        state.total_run += time.monotonic() - started_at
+        semaphore.release()
+
+
+async def run_in_process(tool: str, func, *args, **kwargs):
+    """Run a blocking function in the shared process pool (falls back to threads if not picklable)"""
+    return await run_blocking(tool, func, *args, kind='process', **kwargs)
+
+
+def get_metrics() -> dict:
+    """Queue depth and throughput metrics per tool"""
+    return {
+        "executor": EXECUTOR_KIND,
+        "workers": EXECUTOR_WORKERS,
+        "tools": {name: state.snapshot() for name, state in _tools.items()},
+    }
+
+
+def shutdown(wait: bool = True):
+    """Shut down all shared pools"""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.shutdown(wait=wait)
+        _pools.clear()
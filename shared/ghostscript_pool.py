@@ -0,0 +1,362 @@
+"""
+Ghostscript Worker Pool
+Runs Ghostscript through its shared-library API (libgs, via ctypes) in a
+pool of long-lived worker processes instead of starting a `gs` binary per
+job, so jobs don't pay for process startup and library loading.
+
+Only the process and the loaded library are warm: every job still creates
+and initializes its own interpreter instance (gsapi_init_with_args, which
+runs Ghostscript's startup files), since the output device and distiller
+settings are fixed when an instance is initialized. Small jobs gain the
+most; long jobs are dominated by the work itself either way.
+
+- Each worker loads libgs once and runs one job at a time; stdout/stderr
+  are captured through callbacks
+- A job that exceeds its timeout kills its worker (a running libgs call
+  cannot be interrupted); crashed workers are restarted on the next job
+- Workers are recycled after N jobs
+- When libgs is not selected or cannot be loaded, jobs run the `gs` binary
+  through process_runner, as before
+- Every job reports its timings: waiting for a worker, starting one and
+  running Ghostscript (see get_metrics())
+
+Configuration (environment variables):
+- TOOLS_GHOSTSCRIPT_BACKEND: 'cli' (default) or 'libgs'
+- TOOLS_LIBGS_PATH: Path of the shared library (default: found via ctypes.util)
+- TOOLS_GHOSTSCRIPT_WORKERS: Number of libgs workers (default: TOOLS_MAX_PROCESSES_GS)
+- TOOLS_GHOSTSCRIPT_MAX_JOBS: Recycle a worker after this many jobs (default: 200)
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import multiprocessing
+import os
+import time
+
+from shared.executor import run_blocking
+from shared.process_runner import run_process, process_limit, ProcessResult, ProcessTimeout, STDERR_LIMIT
+
+
+BACKEND = os.environ.get('TOOLS_GHOSTSCRIPT_BACKEND', 'cli').lower()
+LIBGS_PATH = os.environ.get('TOOLS_LIBGS_PATH') or ctypes.util.find_library('gs')
+POOL_SIZE = int(os.environ.get('TOOLS_GHOSTSCRIPT_WORKERS', process_limit('gs')))
+MAX_JOBS_PER_WORKER = int(os.environ.get('TOOLS_GHOSTSCRIPT_MAX_JOBS', 200))
+
+TOOL_NAME = 'ghostscript-pool'
+STARTUP_TIMEOUT = 10
+
+# gsapi constants (iapi.h / ierrors.h)
+GS_ARG_ENCODING_UTF8 = 1
+GS_ERROR_QUIT = -101
+
+_libgs_failed = False
+
+
+class LibgsUnavailable(RuntimeError):
+    """Raised when a worker cannot load libgs"""
+
+
+class GhostscriptResult(ProcessResult):
+    """ProcessResult of a Ghostscript job plus its timings in seconds"""
+
+    def __init__(self, returncode, stdout, stderr, timings: dict):
+        super().__init__(returncode, stdout, stderr)
+        self.timings = timings
+
+
+class _Revision(ctypes.Structure):
+    _fields_ = [
+        ('product', ctypes.c_char_p),
+        ('copyright', ctypes.c_char_p),
+        ('revision', ctypes.c_long),
+        ('revisiondate', ctypes.c_long),
+    ]
+
+
+_IO_CALLBACK = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int)
+
+
+def _load_libgs(library_path: str):
+    lib = ctypes.CDLL(library_path)
+    lib.gsapi_revision.argtypes = [ctypes.POINTER(_Revision), ctypes.c_int]
+    lib.gsapi_new_instance.argtypes = [ctypes.POINTER(ctypes.c_void_p), ctypes.c_void_p]
+    lib.gsapi_set_stdio.argtypes = [ctypes.c_void_p, _IO_CALLBACK, _IO_CALLBACK, _IO_CALLBACK]
+    lib.gsapi_set_arg_encoding.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lib.gsapi_init_with_args.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_char_p)]
+    lib.gsapi_exit.argtypes = [ctypes.c_void_p]
+    lib.gsapi_delete_instance.argtypes = [ctypes.c_void_p]
+    return lib
+
+
+def _run_libgs(lib, argv: list) -> tuple:
+    """Run one Ghostscript command line in a new instance; returns (exit code, stdout, stderr)"""
+    output = {'stdout': bytearray(), 'stderr': bytearray()}
+
+    def collector(name):
+        def write(_, data, length):
+            buffer = output[name]
+            buffer.extend(ctypes.string_at(data, length))
+            if len(buffer) > STDERR_LIMIT:
+                del buffer[:len(buffer) - STDERR_LIMIT]
+            return length
+        return _IO_CALLBACK(write)
+
+    # Keep references to the callbacks until the instance is gone
+    callbacks = (_IO_CALLBACK(lambda handle, data, length: 0), collector('stdout'), collector('stderr'))
+
+    instance = ctypes.c_void_p()
+    code = lib.gsapi_new_instance(ctypes.byref(instance), None)
+    if code < 0:
+        return code, b'', b'gsapi_new_instance failed'
+    try:
+        lib.gsapi_set_stdio(instance, *callbacks)
+        lib.gsapi_set_arg_encoding(instance, GS_ARG_ENCODING_UTF8)
+        encoded = [arg.encode('utf-8') for arg in argv]
+        code = lib.gsapi_init_with_args(instance, len(encoded), (ctypes.c_char_p * len(encoded))(*encoded))
+        exit_code = lib.gsapi_exit(instance)
+        if code in (0, GS_ERROR_QUIT):
+            code = exit_code
+    finally:
+        lib.gsapi_delete_instance(instance)
+    returncode = 0 if code in (0, GS_ERROR_QUIT) else 1
+    return returncode, bytes(output['stdout']), bytes(output['stderr'])
+
+
+def _worker_main(conn, library_path: str):
+    """Worker process: load libgs, report ready, then run jobs until told to stop"""
+    try:
+        lib = _load_libgs(library_path)
+        revision = _Revision()
+        lib.gsapi_revision(ctypes.byref(revision), ctypes.sizeof(revision))
+        conn.send(('ready', f"{revision.product.decode('utf-8', 'replace')} {revision.revision}"))
+    except Exception as e:
+        conn.send(('error', str(e)))
+        return
+
+    while True:
+        try:
+            argv = conn.recv()
+        except EOFError:
+            return
+        if argv is None:
+            return
+        started = time.perf_counter()
+        try:
+            returncode, stdout, stderr = _run_libgs(lib, argv)
+        except Exception as e:
+            returncode, stdout, stderr = 1, b'', str(e).encode('utf-8')
+        conn.send((returncode, stdout, stderr, time.perf_counter() - started))
+
+
+class GhostscriptWorker:
+    """One long-lived worker process with libgs loaded"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.jobs = 0
+
+    async def _receive(self, timeout: float):
+        """Next message from the worker without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        fd = self.conn.fileno()
+        loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+        try:
+            await asyncio.wait_for(readable, timeout=timeout)
+        finally:
+            loop.remove_reader(fd)
+        # Raises EOFError if the worker died
+        return self.conn.recv()
+
+    async def start(self):
+        """Start the worker process and wait until libgs is loaded"""
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, LIBGS_PATH), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        try:
+            status, detail = await self._receive(STARTUP_TIMEOUT)
+        except (asyncio.TimeoutError, EOFError, OSError):
+            await self.stop()
+            raise RuntimeError(f"Ghostscript worker {self.index} did not start")
+        if status != 'ready':
+            await self.stop()
+            raise LibgsUnavailable(f"Could not load {LIBGS_PATH}: {detail}")
+        print(f"[Ghostscript Pool] Worker {self.index} ready ({detail})")
+
+    async def stop(self):
+        """Kill the worker process and wait for it to exit (off the event loop)"""
+        process, conn = self.process, self.conn
+        self.process = None
+        self.conn = None
+        if conn is not None:
+            conn.close()
+        if process is not None:
+            if process.is_alive():
+                process.kill()
+            await run_blocking(TOOL_NAME, process.join, 5, kind='thread')
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    async def run(self, argv: list, timeout: float) -> tuple:
+        """Run one job; returns (returncode, stdout, stderr, seconds in libgs, seconds starting the worker)"""
+        startup = 0.0
+        if not self.is_alive():
+            started = time.perf_counter()
+            await self.start()
+            startup = time.perf_counter() - started
+
+        try:
+            self.conn.send(argv)
+            returncode, stdout, stderr, seconds = await self._receive(timeout)
+        except asyncio.TimeoutError:
+            print(f"[Ghostscript Pool] Worker {self.index} timed out after {timeout}s, killing it")
+            await self.stop()
+            raise ProcessTimeout(f"gs timed out after {timeout} seconds")
+        except (EOFError, OSError):
+            await self.stop()
+            return 1, b'', f"Ghostscript worker {self.index} crashed".encode('utf-8'), 0.0, startup
+        except BaseException:
+            # Cancelled mid-job: the worker is still busy, so it can't be reused
+            await self.stop()
+            raise
+
+        self.jobs += 1
+        if self.jobs >= MAX_JOBS_PER_WORKER:
+            print(f"[Ghostscript Pool] Recycling worker {self.index} after {self.jobs} jobs")
+            await self.stop()
+        return returncode, stdout, stderr, seconds, startup
+
+
+class _PoolMetrics:
+    def __init__(self):
+        self.jobs = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.total_startup = 0.0
+        self.total_run = 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            "backend": active_backend(),
+            "workers": POOL_SIZE,
+            "jobs": self.jobs,
+            "failed": self.failed,
+            "avg_wait_seconds": round(self.total_wait / self.jobs, 3) if self.jobs else 0.0,
+            "avg_startup_seconds": round(self.total_startup / self.jobs, 3) if self.jobs else 0.0,
+            "avg_run_seconds": round(self.total_run / self.jobs, 3) if self.jobs else 0.0,
+        }
+
+
+class GhostscriptPool:
+    """Hands jobs to idle workers, one job per worker at a time"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.idle = None
+        self.metrics = _PoolMetrics()
+
+    def _get_idle(self) -> asyncio.Queue:
+        # Created lazily so it binds to the running event loop
+        if self.idle is None:
+            self.idle = asyncio.Queue()
+            for index in range(self.size):
+                self.idle.put_nowait(GhostscriptWorker(index))
+        return self.idle
+
+    async def run(self, argv: list, timeout: float) -> GhostscriptResult:
+        idle = self._get_idle()
+        queued_at = time.perf_counter()
+        worker = await idle.get()
+        wait = time.perf_counter() - queued_at
+        try:
+            returncode, stdout, stderr, seconds, startup = await worker.run(argv, timeout)
+        finally:
+            idle.put_nowait(worker)
+
+        self.metrics.jobs += 1
+        self.metrics.failed += returncode != 0
+        self.metrics.total_wait += wait
+        self.metrics.total_startup += startup
+        self.metrics.total_run += seconds
+        timings = {'wait': wait, 'startup': startup, 'run': seconds, 'total': time.perf_counter() - queued_at}
+        return GhostscriptResult(returncode, stdout, stderr, timings)
+
+    async def shutdown(self):
+        if self.idle is None:
+            return
+        while not self.idle.empty():
+            await self.idle.get_nowait().stop()
+        self.idle = None
+
+
+_pool = GhostscriptPool(max(1, POOL_SIZE))
+
+
+def active_backend() -> str:
+    """'libgs' when jobs run in the worker pool, otherwise 'cli'"""
+    if BACKEND == 'libgs' and LIBGS_PATH and not _libgs_failed:
+        return 'libgs'
+    return 'cli'
+
+
+def ghostscript_slots() -> int:
+    """How many Ghostscript jobs can run at once with the active backend"""
+    return max(1, POOL_SIZE) if active_backend() == 'libgs' else process_limit('gs')
+
+
+async def run_gs(cmd: list, timeout: float, text: bool = False) -> GhostscriptResult:
+    """
+    Run a Ghostscript command line (['gs', ...args]) on the active backend.
+    Raises ProcessTimeout on timeout and FileNotFoundError if neither libgs
+    nor the gs binary is available.
+    """
+    global _libgs_failed
+
+    if active_backend() == 'libgs':
+        try:
+            result = await _pool.run(cmd, timeout)
+        except LibgsUnavailable as e:
+            # Use the binary from now on
+            print(f"[Ghostscript Pool] {e}; falling back to the gs binary")
+            _libgs_failed = True
+        except RuntimeError as e:
+            # Worker didn't come up; run this job with the binary
+            print(f"[Ghostscript Pool] {e}; running this job with the gs binary")
+        else:
+            if text:
+                result.stdout = result.stdout.decode('utf-8', errors='replace')
+                result.stderr = result.stderr.decode('utf-8', errors='replace')
+            _log_timings(result)
+            return result
+
+    started = time.perf_counter()
+    process_result = await run_process(cmd, timeout=timeout, text=text)
+    seconds = time.perf_counter() - started
+    result = GhostscriptResult(process_result.returncode, process_result.stdout, process_result.stderr,
+                               {'wait': 0.0, 'startup': 0.0, 'run': seconds, 'total': seconds})
+    _log_timings(result)
+    return result
+
+
+def _log_timings(result: GhostscriptResult):
+    timings = result.timings
+    print(f"[Ghostscript Pool] {active_backend()} job finished in {timings['total']:.3f}s "
+          f"(wait {timings['wait']:.3f}s, startup {timings['startup']:.3f}s, run {timings['run']:.3f}s, "
+          f"exit code {result.returncode})")
+
+
+def get_metrics() -> dict:
+    """Job counts and average timings of the libgs pool"""
+    return _pool.metrics.snapshot()
+
+
+async def shutdown():
+    """Stop all Ghostscript workers"""
+    await _pool.shutdown()
@@ -0,0 +1,287 @@
+"""
+Image PDF Pages
+Prepares images for img2pdf, one image per page, in an importable module
+so the preparation can run in the process pool.
+
+- RGB/grayscale JPEGs and PNGs without transparency are passed to img2pdf
+  untouched (JPEG data is embedded byte for byte)
+- Anything else is flattened onto white and encoded as a JPEG file next to
+  the upload, with its EXIF orientation applied to the pixels
+
+With a PageLayout, images are placed on paper-sized pages (fit or fill,
+with margins) and downsampled to the target DPI for the area they actually
+cover; JPEGs are decoded at reduced scale (draft mode) when possible.
+
+prepare_image() is module-level (picklable) so it can run in the process
+pool; write_image_pdf() hands the prepared pages to img2pdf in the shared
+executor's threads.
+
+Memory is not bounded: img2pdf reads every image and builds the whole
+document in memory before writing it, so peak memory grows with the total
+size of the embedded images. Only the decoding of images that have to be
+re-encoded is limited to what is in flight in the process pool.
+"""
+
+import math
+
+import img2pdf
+from PIL import Image, UnidentifiedImageError
+
+from shared.executor import run_blocking
+
+
+TOOL_NAME = 'image-pdf'
+
+# Used when an image has no (sensible) resolution metadata, same as img2pdf
+DEFAULT_DPI = 96
+
+# Quality for images that have to be re-encoded; downsampled images use a
+# lower one since their size is the point of downsampling
+JPEG_QUALITY = 95
+RESAMPLED_JPEG_QUALITY = 85
+
+# Image modes img2pdf embeds without re-encoding, per format
+PASSTHROUGH_MODES = {
+    'JPEG': ('RGB', 'L'),
+    'PNG': ('RGB', 'L'),
+}
+
+# Paper sizes in points (portrait)
+PAGE_SIZES = {
+    'a4': (595.28, 841.89),
+    'letter': (612.0, 792.0),
+}
+
+FIT_MODES = ('fit', 'fill')
+
+# Only resample when the image has noticeably more pixels than needed
+RESAMPLE_THRESHOLD = 1.1
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+# EXIF orientation -> clockwise page rotation, which img2pdf applies itself
+# to the files it is given (it rejects the mirrored orientations)
+EXIF_ROTATION = {1: 0, 3: 180, 6: 90, 8: 270}
+
+# EXIF orientation -> transposition that turns the pixels upright
+EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+class ImagePage:
+    """An image file for img2pdf (the upload passed through or a re-encoded JPEG) and its page geometry"""
+
+    def __init__(self, image, page_size: tuple, image_size: tuple, rotate: int = 0):
+        self.image = image            # Path of the upload (passthrough) or of the re-encoded JPEG
+        self.page_size = page_size    # (width, height) of the upright page in points
+        self.image_size = image_size  # (width, height) of the upright image in points, centered on the page
+        self.rotate = rotate          # Clockwise rotation img2pdf applies from the file's EXIF orientation
+
+    def layout(self) -> tuple:
+        """img2pdf layout (page width, page height, image width, image height), before its rotation"""
+        if self.rotate in (90, 270):
+            return (self.page_size[1], self.page_size[0], self.image_size[1], self.image_size[0])
+        return (*self.page_size, *self.image_size)
+
+
+class PageLayout:
+    """
+    Page setup for image pages.
+    page_size: 'a4'/'letter' (or None for the image's own size), fit: 'fit'
+    (whole image visible) or 'fill' (page covered, edges cropped), margin in
+    points, dpi: target resolution (None keeps every pixel)
+    """
+
+    def __init__(self, page_size: str = None, fit: str = 'fit', margin: float = 0.0, dpi: float = None):
+        if page_size is not None and page_size not in PAGE_SIZES:
+            raise ValueError(f"Invalid page size. Supported: {', '.join(PAGE_SIZES)}")
+        if fit not in FIT_MODES:
+            raise ValueError(f"Invalid fit mode. Supported: {', '.join(FIT_MODES)}")
+        if page_size is not None and 2 * margin >= min(PAGE_SIZES[page_size]):
+            raise ValueError("Margin is too large for the page size")
+        self.page_size = page_size
+        self.fit = fit
+        self.margin = margin
+        self.dpi = dpi
+
+    def place(self, width: float, height: float) -> tuple:
+        """
+        Page size, content box and image placement (all in points) for an
+        upright image whose natural size is width x height points
+        """
+        margin = self.margin
+        if self.page_size is None:
+            box = (margin, margin, width, height)
+            return (width + 2 * margin, height + 2 * margin), box, box
+
+        page_width, page_height = PAGE_SIZES[self.page_size]
+        # Turn the paper to match the image
+        if (width > height) != (page_width > page_height):
+            page_width, page_height = page_height, page_width
+
+        box_width, box_height = page_width - 2 * margin, page_height - 2 * margin
+        scale = (min if self.fit == 'fit' else max)(box_width / width, box_height / height)
+        placed_width, placed_height = width * scale, height * scale
+        placement = (margin + (box_width - placed_width) / 2, margin + (box_height - placed_height) / 2,
+                     placed_width, placed_height)
+        return (page_width, page_height), (margin, margin, box_width, box_height), placement
+
+
+def _image_dpi(img) -> tuple:
+    dpi = img.info.get('dpi')
+    try:
+        x, y = float(dpi[0]), float(dpi[1])
+        if x >= 1 and y >= 1:
+            return (x, y)
+    except (TypeError, ValueError, IndexError):
+        pass
+    return (DEFAULT_DPI, DEFAULT_DPI)
+
+
+def _exif_orientation(img) -> int:
+    try:
+        return img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    except Exception:
+        return 1
+
+
+def _upright(img, orientation: int):
+    """The image with its EXIF orientation applied to the pixels"""
+    method = EXIF_TRANSPOSE.get(orientation)
+    return img.transpose(method) if method is not None else img
+
+
+def flatten_image(img):
+    """RGB (or grayscale) copy of an image, with transparency flattened onto white"""
+    # Convert RGBA to RGB (for PNG with transparency)
+    if img.mode in ('RGBA', 'LA', 'P'):
+        # Create white background
+        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        rgb_img.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+        return rgb_img
+    if img.mode not in ('RGB', 'L'):
+        return img.convert('RGB')
+    return img
+
+
+def encode_jpeg(img, converted_path: str, quality: int = JPEG_QUALITY) -> str:
+    """Flatten and encode an image as a JPEG file at converted_path (returned)"""
+    img = flatten_image(img)
+    img.save(converted_path, format='JPEG', quality=quality)
+    return converted_path
+
+
+def _visible_area(box: tuple, placement: tuple) -> tuple:
+    """Part of the placed image inside the content box"""
+    x0, y0 = max(box[0], placement[0]), max(box[1], placement[1])
+    x1 = min(box[0] + box[2], placement[0] + placement[2])
+    y1 = min(box[1] + box[3], placement[1] + placement[3])
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def _resample(img, orientation: int, visible: tuple, placement: tuple, size: tuple = None):
+    """
+    Turn an image upright, crop it to the visible part of its placement and
+    resize it to size pixels (None: just crop), decoding JPEGs at reduced
+    scale first where possible
+    """
+    # Crop box as fractions of the upright image (PDF y runs upwards, image rows downwards)
+    left = max(0.0, (visible[0] - placement[0]) / placement[2])
+    right = min(1.0, (visible[0] + visible[2] - placement[0]) / placement[2])
+    top = max(0.0, 1 - (visible[1] + visible[3] - placement[1]) / placement[3])
+    bottom = min(1.0, 1 - (visible[1] - placement[1]) / placement[3])
+
+    if size is not None and img.format == 'JPEG':
+        # The decoder can scale by 1/2, 1/4 or 1/8 and never goes below the requested size
+        needed = (math.ceil(size[0] / (right - left)), math.ceil(size[1] / (bottom - top)))
+        img.draft(img.mode, needed[::-1] if orientation in (5, 6, 7, 8) else needed)
+    img = _upright(img, orientation)
+    crop = (left * img.width, top * img.height, right * img.width, bottom * img.height)
+    if size is None:
+        return img.crop(tuple(round(value) for value in crop))
+    return img.resize(size, Image.LANCZOS, box=crop, reducing_gap=3.0)
+
+
+def prepare_image(path: str, converted_path: str, layout: PageLayout = None) -> ImagePage:
+    """
+    Inspect an image file and describe its page: passthrough for compatible
+    JPEG/PNG files, otherwise normalized to an upright RGB JPEG written to
+    converted_path (the caller's file to clean up either way).
+    With a layout the page geometry follows it and oversized images are
+    downsampled to the layout's DPI.
+    """
+    try:
+        img = Image.open(path)
+    except UnidentifiedImageError:
+        # Don't leak the temporary path in the message
+        raise ValueError("cannot identify image file")
+
+    with img:
+        dpi = _image_dpi(img)
+        orientation = _exif_orientation(img)
+        # img2pdf rotates the files it is given, but can't mirror them
+        passthrough = (img.mode in PASSTHROUGH_MODES.get(img.format, ()) and 'transparency' not in img.info
+                       and orientation in EXIF_ROTATION)
+        rotate = EXIF_ROTATION[orientation] if passthrough else 0
+
+        # Geometry of the upright image
+        width, height = img.width, img.height
+        if orientation in (5, 6, 7, 8):
+            width, height, dpi = height, width, dpi[::-1]
+        natural_size = (width * 72.0 / dpi[0], height * 72.0 / dpi[1])
+
+        if layout is None:
+            if passthrough:
+                return ImagePage(path, natural_size, natural_size, rotate)
+            return ImagePage(encode_jpeg(_upright(img, orientation), converted_path), natural_size, natural_size)
+
+        page_size, box, placement = layout.place(*natural_size)
+        # With 'fill' the image overflows the content box and is cropped to it
+        visible = _visible_area(box, placement) if layout.fit == 'fill' else placement
+
+        if layout.dpi:
+            size = (max(1, round(visible[2] * layout.dpi / 72)), max(1, round(visible[3] * layout.dpi / 72)))
+            if width * visible[2] / placement[2] > size[0] * RESAMPLE_THRESHOLD:
+                # Only the visible part is kept
+                resampled = _resample(img, orientation, visible, placement, size)
+                return ImagePage(encode_jpeg(resampled, converted_path, RESAMPLED_JPEG_QUALITY), page_size, visible[2:])
+
+        if layout.margin and (visible[2] < placement[2] - 0.01 or visible[3] < placement[3] - 0.01):
+            # img2pdf can't clip an image to the margins, so it is cropped to the visible part instead
+            cropped = _resample(img, orientation, visible, placement)
+            return ImagePage(encode_jpeg(cropped, converted_path), page_size, visible[2:])
+
+        if passthrough:
+            return ImagePage(path, page_size, placement[2:], rotate)
+        return ImagePage(encode_jpeg(_upright(img, orientation), converted_path), page_size, placement[2:])
+
+
+async def write_image_pdf(pages, output_path: str):
+    """
+    Write an async iterable of ImagePage objects to a PDF file with img2pdf,
+    one page each. Only the file paths and page geometry are collected while
+    the pages are prepared; img2pdf then reads the images and builds the
+    document in memory (see the module docstring).
+    """
+    pages = [page async for page in pages]
+    layouts = iter([page.layout() for page in pages])
+
+    def layout_fun(width_px, height_px, dpi):
+        # img2pdf lays out the images one at a time, in order
+        return next(layouts)
+
+    def write():
+        with open(output_path, 'wb') as output:
+            img2pdf.convert([page.image for page in pages], layout_fun=layout_fun,
+                            first_frame_only=True, outputstream=output)
+
+    await run_blocking(TOOL_NAME, write, kind='thread')
@@ -0,0 +1,370 @@
+"""
+Background Jobs
+Lets long-running tools answer immediately with a job id instead of
+holding the HTTP request open until the work is done.
+
+Protocol (same /api/v1/tools/{id}/execute endpoint):
+- Submit: send the usual form data plus `mode=async` -> 202 with job_id
+- Status: `?job_id=<id>` (or `&action=status`) -> JSON status and progress
+- Events: `?job_id=<id>&action=events` -> Server-Sent Events with status updates
+- Download: `?job_id=<id>&action=download` -> the result file once status is "done"
+
+Jobs run on a local worker pool (asyncio tasks, bounded per process); the
+heavy work itself still goes through the shared executor / process runner.
+
+Job state and results live in files under the jobs directory, keyed by job
+id (<id>.json and <id>.result), so any worker process of the server can
+answer status, events and download requests for a job another one runs.
+Downloads hold a shared lock on the result file, and expired results are
+only deleted once nothing is serving them.
+
+Configuration (environment variables):
+- TOOLS_JOB_WORKERS: Max jobs running at once per worker process (default: 2)
+- TOOLS_JOB_TTL_SECONDS: How long finished jobs and results are kept (default: 3600)
+- TOOLS_JOB_TIMEOUT_SECONDS: Process timeout used for background jobs (default: 3600)
+- TOOLS_JOBS_DIR: Jobs directory, shared by all worker processes
+  (default: <system temp dir>/tool-studio-jobs)
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import traceback
+import uuid
+
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+
+from shared.executor import run_blocking
+
+
+TOOL_NAME = 'jobs'
+
+JOB_WORKERS = int(os.environ.get('TOOLS_JOB_WORKERS', 2))
+JOB_TTL = float(os.environ.get('TOOLS_JOB_TTL_SECONDS', 3600))
+JOB_TIMEOUT = float(os.environ.get('TOOLS_JOB_TIMEOUT_SECONDS', 3600))
+JOBS_DIR = os.environ.get('TOOLS_JOBS_DIR', os.path.join(tempfile.gettempdir(), 'tool-studio-jobs'))
+
+# Seconds between SSE keep-alive comments
+HEARTBEAT_INTERVAL = 15
+
+# Seconds between reads of a job's state file while streaming its events
+EVENT_POLL_INTERVAL = 0.5
+
+# Seconds between sweeps of the jobs directory for expired jobs
+PURGE_INTERVAL = 60
+
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+# Tasks of the jobs running in this process (the event loop keeps only weak references)
+_tasks = {}
+_semaphore = None
+_last_purge = 0.0
+
+
+class ToolError(Exception):
+    """A user-facing tool failure with the HTTP status code to report"""
+
+    def __init__(self, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class Job:
+    """State of one background job, as stored in its state file"""
+
+    FIELDS = ('tool', 'status', 'progress', 'message', 'error', 'filename', 'media_type',
+              'created_at', 'finished_at')
+
+    def __init__(self, tool: str, job_id: str = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.tool = tool
+        self.status = 'queued'
+        self.progress = None
+        self.message = None
+        self.error = None
+        self.filename = None
+        self.media_type = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def result_path(self) -> str:
+        return _result_path(self.id)
+
+    @classmethod
+    def load(cls, job_id: str):
+        """The job with this id from the jobs directory, or None if there is none"""
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        try:
+            with open(_state_path(job_id)) as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return None
+        job = cls(state['tool'], job_id)
+        for name in cls.FIELDS:
+            setattr(job, name, state.get(name))
+        return job
+
+    def save(self):
+        """Write the state file (replaced atomically, so readers never see half of it)"""
+        state = {name: getattr(self, name) for name in self.FIELDS}
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=JOBS_DIR, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as state_file:
+                json.dump(state, state_file)
+            os.replace(tmp_path, _state_path(self.id))
+        except OSError:
+            _remove_file(tmp_path)
+            raise
+
+    def update(self, **fields):
+        """Change job fields and save them (event streams pick them up from the file)"""
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.save()
+
+    def set_progress(self, progress: float, message: str = None):
+        """Report progress (0-100) from inside the work function"""
+        progress = round(max(0.0, min(100.0, progress)), 1)
+        if progress != self.progress or message != self.message:
+            self.update(progress=progress, message=message)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('done', 'failed')
+
+    @property
+    def expired(self) -> bool:
+        # Unfinished jobs that outlived any timeout lost the process running them
+        if self.finished:
+            return time.time() - self.finished_at > JOB_TTL
+        return time.time() - self.created_at > JOB_TIMEOUT + JOB_TTL
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "error": self.error,
+            "filename": self.filename,
+        }
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    # Created lazily so it binds to the running event loop
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(max(1, JOB_WORKERS))
+    return _semaphore
+
+
+def _state_path(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, job_id + '.json')
+
+
+def _result_path(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, job_id + '.result')
+
+
+def _remove_file(path: str):
+    if path and os.path.exists(path):
+        try:
+            os.unlink(path)
+        except Exception as e:
+            print(f"[Jobs] Error cleaning up file {path}: {e}")
+
+
+def _remove_result(path: str) -> bool:
+    """Delete a result file unless a download holds it; False if it has to wait"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return True
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        _remove_file(path)
+        return True
+    finally:
+        os.close(fd)
+
+
+def purge_expired(force: bool = False):
+    """
+    Forget expired jobs (see Job.expired) and delete their results; results
+    still being downloaded are left for a later sweep. Sweeps the jobs
+    directory at most every PURGE_INTERVAL seconds unless force is set.
+    """
+    global _last_purge
+    now = time.monotonic()
+    if not force and now - _last_purge < PURGE_INTERVAL:
+        return
+    _last_purge = now
+    try:
+        filenames = os.listdir(JOBS_DIR)
+    except OSError:
+        return
+    for filename in filenames:
+        job_id, extension = os.path.splitext(filename)
+        if extension != '.json' or job_id in _tasks:
+            continue
+        job = Job.load(job_id)
+        if job is not None and job.expired and _remove_result(job.result_path):
+            _remove_file(_state_path(job_id))
+
+
+async def _run(job: Job, work, cleanup_paths):
+    try:
+        async with _get_semaphore():
+            job.update(status='running')
+            print(f"[Jobs] {job.tool} job {job.id} started")
+            result_path, filename, media_type = await work(job)
+            # Into the jobs directory, where every worker process finds it
+            await run_blocking(TOOL_NAME, shutil.move, result_path, job.result_path, kind='thread')
+            job.update(
+                status='done',
+                progress=100.0,
+                filename=filename,
+                media_type=media_type,
+                finished_at=time.time()
+            )
+            print(f"[Jobs] {job.tool} job {job.id} done")
+    except ToolError as e:
+        job.update(status='failed', error=e.message, finished_at=time.time())
+        print(f"[Jobs] {job.tool} job {job.id} failed: {e.message}")
+    except Exception as e:
+        traceback.print_exc()
+        job.update(status='failed', error=str(e), finished_at=time.time())
+    finally:
+        _tasks.pop(job.id, None)
+        for path in cleanup_paths:
+            _remove_file(path)
+
+
+def submit_job(tool: str, work, cleanup_paths=()) -> Job:
+    """
+    Queue a background job.
+
+    work: async function taking the Job and returning (result_path, filename, media_type);
+          raise ToolError for user-facing failures
+    cleanup_paths: Files to delete when the job finishes (e.g. the upload)
+    """
+    purge_expired()
+    job = Job(tool)
+    job.save()
+    _tasks[job.id] = asyncio.create_task(_run(job, work, list(cleanup_paths)))
+    return job
+
+
+def wants_async(request, form) -> bool:
+    """True if the client asked for background processing (mode=async)"""
+    mode = form.get('mode') or request.query_params.get('mode')
+    return isinstance(mode, str) and mode.lower() == 'async'
+
+
+def job_accepted(request, job: Job) -> JSONResponse:
+    """202 response for a newly submitted job, with URLs for polling"""
+    base = f"{request.url.path}?job_id={job.id}"
+    return JSONResponse(
+        {
+            **job.to_dict(),
+            "status_url": base,
+            "events_url": f"{base}&action=events",
+            "download_url": f"{base}&action=download",
+        },
+        status_code=202
+    )
+
+
+async def _event_stream(job: Job):
+    # The job may run in another worker process: follow its state file
+    snapshot = job.to_dict()
+    yield f"data: {json.dumps(snapshot)}\n\n"
+    last_sent = time.monotonic()
+    while snapshot['status'] not in ('done', 'failed'):
+        await asyncio.sleep(EVENT_POLL_INTERVAL)
+        current = Job.load(job.id)
+        if current is None:
+            return
+        if current.to_dict() != snapshot:
+            snapshot = current.to_dict()
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= HEARTBEAT_INTERVAL:
+            yield ": keep-alive\n\n"
+            last_sent = time.monotonic()
+
+
+class _LockedFileResponse(FileResponse):
+    """FileResponse that holds a shared lock on the file (fd) until it is sent or the client goes away"""
+
+    def __init__(self, fd: int, path: str, **kwargs):
+        super().__init__(path, stat_result=os.fstat(fd), **kwargs)
+        self.fd = fd
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            os.close(self.fd)
+
+
+def _download(job: Job):
+    """Response for a finished job's result, locked against purge_expired() while it is sent"""
+    try:
+        fd = os.open(job.result_path, os.O_RDONLY)
+    except FileNotFoundError:
+        return JSONResponse({"error": "Job not found or expired"}, status_code=404)
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    if os.fstat(fd).st_nlink == 0:
+        # Purged between opening and locking
+        os.close(fd)
+        return JSONResponse({"error": "Job not found or expired"}, status_code=404)
+    return _LockedFileResponse(fd, job.result_path, filename=job.filename, media_type=job.media_type)
+
+
+async def handle_job_request(request, tool: str):
+    """
+    Answer status / events / download requests for a job.
+    Returns None if the request is not about a job (no job_id).
+    """
+    job_id = request.query_params.get('job_id')
+    if not job_id:
+        return None
+
+    purge_expired()
+    job = Job.load(job_id)
+    if job is None or job.tool != tool or job.expired:
+        return JSONResponse({"error": "Job not found or expired"}, status_code=404)
+
+    action = request.query_params.get('action', 'status')
+
+    if action == 'status':
+        return JSONResponse(job.to_dict())
+
+    if action == 'events':
+        return StreamingResponse(
+            _event_stream(job),
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    if action == 'download':
+        if job.status == 'failed':
+            return JSONResponse({"error": job.error}, status_code=410)
+        if job.status != 'done':
+            return JSONResponse({"error": "Job is not finished yet", **job.to_dict()}, status_code=409)
+        return _download(job)
+
+    return JSONResponse({"error": f"Unknown action: {action}"}, status_code=400)
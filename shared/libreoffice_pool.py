@@ -0,0 +1,308 @@
+"""
+LibreOffice Worker Pool
+Keeps a pool of long-lived headless soffice instances, each with its own
+user profile, and sends conversions to them over UNO (local socket).
+
+- Workers are health-checked before each job and recycled after N jobs
+- Each worker has a private profile, so concurrent conversions never
+  collide on the shared default profile lock; profiles are per server
+  process (named after its pid) and UNO ports are picked free by the OS,
+  so several server worker processes can each run their own pool
+- Without the `uno` Python bindings, each worker falls back to running
+  `soffice --convert-to pdf` against its own (already initialized) profile
+
+Configuration (environment variables):
+- TOOLS_LIBREOFFICE_WORKERS: Number of soffice workers (default: 2)
+- TOOLS_LIBREOFFICE_MAX_JOBS: Recycle a worker after this many jobs (default: 50)
+- TOOLS_LIBREOFFICE_PROFILE_DIR: Where worker profiles live (default: system temp dir)
+"""
+
+import asyncio
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+from shared.executor import run_blocking, configure_tool
+from shared.process_runner import run_process, kill_process_group, ProcessTimeout
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+    UNO_AVAILABLE = True
+except ImportError:
+    UNO_AVAILABLE = False
+
+
+POOL_SIZE = int(os.environ.get('TOOLS_LIBREOFFICE_WORKERS', 2))
+MAX_JOBS_PER_WORKER = int(os.environ.get('TOOLS_LIBREOFFICE_MAX_JOBS', 50))
+PROFILE_ROOT = os.environ.get(
+    'TOOLS_LIBREOFFICE_PROFILE_DIR',
+    os.path.join(tempfile.gettempdir(), 'tool-studio-libreoffice')
+)
+
+# Binary names vary by system
+LIBREOFFICE_COMMANDS = [
+    'libreoffice',
+    'soffice',
+    '/usr/bin/libreoffice',
+    '/usr/bin/soffice'
+]
+
+# PDF export filter per source document type
+PDF_FILTERS = {
+    '.doc': 'writer_pdf_Export',
+    '.docx': 'writer_pdf_Export',
+    '.ppt': 'impress_pdf_Export',
+    '.pptx': 'impress_pdf_Export',
+    '.xls': 'calc_pdf_Export',
+    '.xlsx': 'calc_pdf_Export',
+}
+
+TOOL_NAME = 'libreoffice'
+STARTUP_TIMEOUT = 30
+
+# One UNO call per worker at a time, plus room for a health check
+configure_tool(TOOL_NAME, POOL_SIZE + 1)
+
+_soffice_path = None
+
+
+class ConversionError(Exception):
+    """Raised when LibreOffice fails to convert a document"""
+
+
+def find_soffice() -> str:
+    """Locate the LibreOffice binary once; raises FileNotFoundError if missing"""
+    global _soffice_path
+    if _soffice_path is None:
+        for cmd in LIBREOFFICE_COMMANDS:
+            path = shutil.which(cmd)
+            if path:
+                _soffice_path = path
+                break
+        else:
+            raise FileNotFoundError("LibreOffice binary not found")
+    return _soffice_path
+
+
+def _free_port() -> int:
+    """A local TCP port that is free right now (picked by the OS)"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _props(**kwargs):
+    """Build a tuple of UNO PropertyValues"""
+    values = []
+    for name, value in kwargs.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        values.append(prop)
+    return tuple(values)
+
+
+class OfficeWorker:
+    """One headless soffice instance with a private user profile"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.port = None
+        # Other server processes run pools of their own
+        self.profile_dir = os.path.join(PROFILE_ROOT, f'worker-{os.getpid()}-{index}')
+        self.profile_url = 'file://' + self.profile_dir
+        self.process = None
+        self.desktop = None
+        self.jobs = 0
+
+    def _base_command(self):
+        return [
+            find_soffice(),
+            '--headless',
+            '--invisible',
+            '--nologo',
+            '--norestore',
+            '--nodefault',
+            '--nolockcheck',
+            f'-env:UserInstallation={self.profile_url}',
+        ]
+
+    async def start(self):
+        """Start soffice listening on a local socket and connect to it over UNO"""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        self.port = _free_port()
+        self.process = await asyncio.create_subprocess_exec(
+            *self._base_command(),
+            f'--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext',
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+            start_new_session=True
+        )
+        self.jobs = 0
+
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            if self.process.returncode is not None:
+                raise ConversionError(f"LibreOffice worker {self.index} exited during startup")
+            try:
+                self.desktop = await run_blocking(TOOL_NAME, self._connect, kind='thread')
+                print(f"[LibreOffice Pool] Worker {self.index} ready on port {self.port}")
+                return
+            except Exception:
+                if time.monotonic() > deadline:
+                    await self.stop()
+                    raise ConversionError(f"LibreOffice worker {self.index} did not start in time")
+                await asyncio.sleep(0.5)
+
+    def _connect(self):
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            'com.sun.star.bridge.UnoUrlResolver', local_context
+        )
+        context = resolver.resolve(
+            f'uno:socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext'
+        )
+        return context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+
+    async def stop(self):
+        """Terminate soffice (and its children)"""
+        if self.desktop is not None:
+            try:
+                await asyncio.wait_for(run_blocking(TOOL_NAME, self.desktop.terminate, kind='thread'), timeout=5)
+            except Exception:
+                pass
+            self.desktop = None
+        if self.process is not None:
+            kill_process_group(self.process)
+            await self.process.wait()
+            self.process = None
+
+    async def restart(self):
+        await self.stop()
+        await self.start()
+
+    async def is_healthy(self) -> bool:
+        """Process is alive and still answers UNO calls"""
+        if self.process is None or self.process.returncode is not None or self.desktop is None:
+            return False
+        try:
+            await asyncio.wait_for(run_blocking(TOOL_NAME, self.desktop.getComponents, kind='thread'), timeout=5)
+            return True
+        except Exception:
+            return False
+
+    def _convert(self, input_path: str, output_path: str):
+        extension = os.path.splitext(input_path)[1].lower()
+        document = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(input_path), '_blank', 0, _props(Hidden=True, ReadOnly=True)
+        )
+        if document is None:
+            raise ConversionError("LibreOffice could not open the document")
+        try:
+            document.storeToURL(
+                uno.systemPathToFileUrl(output_path),
+                _props(FilterName=PDF_FILTERS.get(extension, 'writer_pdf_Export'))
+            )
+        finally:
+            document.close(True)
+
+    async def convert(self, input_path: str, output_path: str, timeout: float):
+        """Convert one document; the worker is killed if it exceeds the timeout"""
+        if not UNO_AVAILABLE:
+            await self._convert_cli(input_path, output_path, timeout)
+            self.jobs += 1
+            return
+
+        if not await self.is_healthy():
+            print(f"[LibreOffice Pool] Worker {self.index} unhealthy, (re)starting")
+            await self.restart()
+
+        try:
+            await asyncio.wait_for(
+                run_blocking(TOOL_NAME, self._convert, input_path, output_path, kind='thread'),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            await self.stop()
+            raise ProcessTimeout(f"LibreOffice conversion timed out after {timeout} seconds")
+        except Exception as e:
+            # The instance may be in a bad state; start fresh for the next job
+            await self.stop()
+            raise ConversionError(f"LibreOffice conversion failed: {e}")
+
+        self.jobs += 1
+        if self.jobs >= MAX_JOBS_PER_WORKER:
+            print(f"[LibreOffice Pool] Recycling worker {self.index} after {self.jobs} jobs")
+            await self.stop()
+
+    async def _convert_cli(self, input_path: str, output_path: str, timeout: float):
+        """Fallback without UNO: one soffice run per job, but on this worker's own profile"""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        outdir = tempfile.mkdtemp(prefix='lo-out-')
+        try:
+            result = await run_process(
+                [*self._base_command(), '--convert-to', 'pdf', '--outdir', outdir, input_path],
+                timeout=timeout,
+                text=True
+            )
+            expected_output = os.path.join(outdir, os.path.splitext(os.path.basename(input_path))[0] + '.pdf')
+            if result.returncode != 0 or not os.path.exists(expected_output):
+                raise ConversionError(f"LibreOffice conversion failed: {result.stderr.strip()[:200]}")
+            shutil.move(expected_output, output_path)
+        finally:
+            shutil.rmtree(outdir, ignore_errors=True)
+
+
+class OfficePool:
+    """Hands conversions to idle workers, one job per worker at a time"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.idle = None
+
+    def _get_idle(self) -> asyncio.Queue:
+        # Created lazily so it binds to the running event loop
+        if self.idle is None:
+            self.idle = asyncio.Queue()
+            for index in range(self.size):
+                self.idle.put_nowait(OfficeWorker(index))
+        return self.idle
+
+    async def convert(self, input_path: str, output_path: str, timeout: float = 60):
+        """
+        Convert a document to PDF on the next idle worker.
+        Raises FileNotFoundError (no LibreOffice), ProcessTimeout or ConversionError.
+        """
+        find_soffice()
+        idle = self._get_idle()
+        worker = await idle.get()
+        try:
+            await worker.convert(input_path, output_path, timeout)
+        finally:
+            idle.put_nowait(worker)
+
+    async def shutdown(self):
+        if self.idle is None:
+            return
+        while not self.idle.empty():
+            worker = self.idle.get_nowait()
+            await worker.stop()
+            shutil.rmtree(worker.profile_dir, ignore_errors=True)
+        self.idle = None
+
+
+_pool = OfficePool(POOL_SIZE)
+
+
+async def convert_to_pdf(input_path: str, output_path: str, timeout: float = 60):
+    """Convert a document to PDF using the shared LibreOffice pool"""
+    await _pool.convert(input_path, output_path, timeout)
+
+
+async def shutdown():
+    """Stop all LibreOffice workers"""
+    await _pool.shutdown()
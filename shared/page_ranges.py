@@ -0,0 +1,180 @@
+"""
+Page Selections
+Page ranges such as "1, 3, 5-7" kept as sorted intervals instead of
+expanded page lists, so a selection of "1-100000000" costs the same as
+"1-2" and is validated in O(number of ranges).
+
+Syntax (comma-separated, pages are 1-indexed):
+- 5          a single page
+- -1         negative indices count from the end (-1 = last page)
+- 5-9, 5..9  a range; either end may be negative ("-3--1" = last three pages)
+- 5-, ..9    open-ended ranges run to the last / from the first page
+- 1-20/2     every 2nd page of a range ("3-/5" = pages 3, 8, 13, ...)
+- odd, even, all
+"""
+
+import heapq
+import re
+
+
+ITEM_PATTERN = re.compile(r'^(-?\d+)?\s*(?:(-|\.\.)\s*(-?\d+)?)?\s*(?:/\s*(\d+))?$')
+
+# Keyword -> (start, end, step); None = last page
+KEYWORDS = {
+    'all': (1, None, 1),
+    'odd': (1, None, 2),
+    'even': (2, None, 2),
+}
+
+
+class PageSelection:
+    """
+    A set of pages of a document with total_pages pages, stored as sorted
+    (start, end, step) progressions (inclusive, 1-indexed). Contiguous
+    ranges are merged; iteration yields each page once, in ascending order.
+    """
+
+    def __init__(self, ranges: list, total_pages: int):
+        self.total_pages = total_pages
+        self.ranges = _normalize(ranges)
+
+    @classmethod
+    def parse(cls, spec: str, total_pages: int) -> 'PageSelection':
+        """Parse a page range string; raises ValueError for bad syntax or pages out of range"""
+        ranges = []
+        for item in spec.split(','):
+            item = item.strip()
+            if not item:
+                continue
+            ranges.append(_parse_item(item, total_pages))
+        return cls(ranges, total_pages)
+
+    @classmethod
+    def from_pages(cls, pages, total_pages: int) -> 'PageSelection':
+        """Selection from explicit page numbers; raises ValueError for pages out of range"""
+        numbers = []
+        for page_num in pages:
+            if not isinstance(page_num, int) or isinstance(page_num, bool) or not 1 <= page_num <= total_pages:
+                raise ValueError(f"Invalid page number {page_num}. PDF has {total_pages} pages.")
+            numbers.append(page_num)
+        return cls(_runs(sorted(set(numbers))), total_pages)
+
+    def _disjoint(self) -> bool:
+        return all(previous[1] < current[0] for previous, current in zip(self.ranges, self.ranges[1:]))
+
+    def __iter__(self):
+        if self._disjoint():
+            for start, end, step in self.ranges:
+                yield from range(start, end + 1, step)
+            return
+        last = None
+        for page_num in heapq.merge(*(range(start, end + 1, step) for start, end, step in self.ranges)):
+            if page_num != last:
+                last = page_num
+                yield page_num
+
+    def __len__(self) -> int:
+        if self._disjoint():
+            return sum((end - start) // step + 1 for start, end, step in self.ranges)
+        # Overlapping stepped ranges: bounded by the document's page count
+        return sum(1 for _ in self)
+
+    def __contains__(self, page_num: int) -> bool:
+        return any(start <= page_num <= end and (page_num - start) % step == 0
+                   for start, end, step in self.ranges)
+
+    def __bool__(self) -> bool:
+        return bool(self.ranges)
+
+    def invert(self) -> 'PageSelection':
+        """The pages of the document not in this selection"""
+        if all(step == 1 for _, _, step in self.ranges):
+            gaps = []
+            next_page = 1
+            for start, end, _ in self.ranges:
+                if start > next_page:
+                    gaps.append((next_page, start - 1, 1))
+                next_page = end + 1
+            if next_page <= self.total_pages:
+                gaps.append((next_page, self.total_pages, 1))
+            return PageSelection(gaps, self.total_pages)
+
+        selected = iter(self)
+        current = next(selected, None)
+        missing = []
+        for page_num in range(1, self.total_pages + 1):
+            if page_num == current:
+                current = next(selected, None)
+            else:
+                missing.append(page_num)
+        return PageSelection(_runs(missing), self.total_pages)
+
+    def __str__(self) -> str:
+        parts = []
+        for start, end, step in self.ranges:
+            text = str(start) if start == end else f"{start}-{end}"
+            parts.append(text if step == 1 else f"{text}/{step}")
+        return ', '.join(parts)
+
+
+def _resolve(ref: str, total_pages: int) -> int:
+    page_num = int(ref)
+    if page_num < 0:
+        page_num = total_pages + 1 + page_num
+    if not 1 <= page_num <= total_pages:
+        raise ValueError(f"Page {ref} doesn't exist. PDF has only {total_pages} pages.")
+    return page_num
+
+
+def _parse_item(item: str, total_pages: int) -> tuple:
+    keyword = KEYWORDS.get(item.lower())
+    if keyword is not None:
+        start, end, step = keyword
+        return (start, total_pages if end is None else end, step)
+
+    match = ITEM_PATTERN.match(item)
+    if not match or not (match.group(1) or match.group(3)):
+        raise ValueError(f"Invalid page range '{item}'")
+    start_ref, separator, end_ref, step = match.groups()
+    step = int(step or 1)
+    if step < 1:
+        raise ValueError(f"Invalid step in page range '{item}'")
+
+    if separator is None:
+        start = end = _resolve(start_ref, total_pages)
+    else:
+        start = _resolve(start_ref, total_pages) if start_ref else 1
+        end = _resolve(end_ref, total_pages) if end_ref else total_pages
+    if start > end:
+        raise ValueError(f"Invalid page range '{item}'")
+    return (start, end, step)
+
+
+def _runs(pages: list) -> list:
+    """Sorted unique page numbers -> contiguous (start, end, 1) ranges"""
+    ranges = []
+    for page_num in pages:
+        if ranges and ranges[-1][1] == page_num - 1:
+            ranges[-1] = (ranges[-1][0], page_num, 1)
+        else:
+            ranges.append((page_num, page_num, 1))
+    return ranges
+
+
+def _normalize(ranges: list) -> list:
+    """Sort ranges, trim stepped ends to their last page and merge contiguous ones"""
+    cleaned = []
+    for start, end, step in ranges:
+        if start > end:
+            continue
+        end = start + (end - start) // step * step
+        cleaned.append((start, end, 1 if start == end else step))
+    cleaned.sort()
+
+    merged = []
+    for start, end, step in cleaned:
+        if merged and step == 1 and merged[-1][2] == 1 and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end), 1)
+        else:
+            merged.append((start, end, step))
+    return merged
@@ -0,0 +1,290 @@
+"""
+PDF Structure Analysis
+Inventories what a PDF is made of (image streams and their resolution,
+embedded fonts, stream filters, unreferenced data) from the object
+dictionaries alone, without decoding any stream, so the PDF Compressor can
+decide whether Ghostscript has anything to gain. Also a lossless repack
+that rewrites a PDF with only its referenced objects and unfiltered streams
+Flate-compressed.
+
+Functions take and write files only, so they can run in the process pool.
+"""
+
+import io
+import os
+import zlib
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, EncodedStreamObject, IndirectObject, NameObject, StreamObject
+
+from shared.pdf_pages import BACK_REFERENCE_KEYS, FILE_OVERHEAD
+
+
+# Image filters whose data is already lossy or bilevel-optimized; Ghostscript
+# only gains on these by downsampling
+COMPACT_IMAGE_FILTERS = ('/DCTDecode', '/JPXDecode', '/JBIG2Decode', '/CCITTFaxDecode')
+
+FONT_FILE_KEYS = ('/FontFile', '/FontFile2', '/FontFile3')
+
+# Bytes around each object's serialized form: "n 0 obj", "endobj", /Length and its xref entry
+INDIRECT_OVERHEAD = 48
+
+
+class PdfAnalysis:
+    """What a PDF spends its bytes on (sizes are encoded stream bytes)"""
+
+    def __init__(self, file_size: int):
+        self.file_size = file_size
+        self.pages = 0
+        self.encrypted = False
+        self.objects = 0                 # Objects the document refers to
+        self.used_bytes = 0              # Their serialized size
+        self.stream_bytes = 0
+        self.unfiltered_bytes = 0        # Streams stored without compression
+        self.images = 0
+        self.image_bytes = 0
+        self.recompressible_image_bytes = 0  # Color/gray images not stored as JPEG/JPEG 2000
+        self.max_image_dpi = 0.0         # Lower bound of the highest color/gray image resolution
+        self.max_mono_dpi = 0.0          # Same for 1-bit images
+        self.fonts = 0
+        self.font_bytes = 0
+        self.unsubset_font_bytes = 0     # Fully embedded fonts (Ghostscript subsets them)
+
+    @property
+    def unreferenced_bytes(self) -> int:
+        """Estimated bytes nothing refers to (old revisions, orphaned objects)"""
+        return max(0, self.file_size - FILE_OVERHEAD - self.used_bytes)
+
+    def __str__(self) -> str:
+        return (f"{self.pages} pages, {self.images} images ({self.image_bytes} bytes, "
+                f"max {self.max_image_dpi:.0f} dpi), {self.fonts} fonts ({self.font_bytes} bytes, "
+                f"{self.unsubset_font_bytes} not subset), {self.unfiltered_bytes} unfiltered bytes, "
+                f"~{self.unreferenced_bytes} unreferenced bytes")
+
+
+def _filters(stream) -> list:
+    filters = stream.get('/Filter')
+    if filters is None:
+        return []
+    if isinstance(filters, ArrayObject):
+        return [str(name) for name in filters]
+    return [str(filters)]
+
+
+def _image_dpi(image, page_width: float, page_height: float) -> float:
+    """
+    Lowest resolution the image can have on its page: drawn at most page-sized
+    (either way round), so at least its pixels per inch of page
+    """
+    width = int(image.get('/Width', 0))
+    height = int(image.get('/Height', 0))
+    if page_width <= 0 or page_height <= 0:
+        return 0.0
+    upright = max(width / page_width, height / page_height)
+    rotated = max(width / page_height, height / page_width)
+    return min(upright, rotated) * 72
+
+
+def analyze_pdf(input_path: str) -> PdfAnalysis:
+    """
+    Walk the objects the pages use and tally images, fonts and streams, then
+    the rest of the document to measure what nothing refers to.
+    Raises ValueError if the PDF cannot be read.
+    """
+    analysis = PdfAnalysis(os.path.getsize(input_path))
+    try:
+        reader = PdfReader(input_path)
+        analysis.encrypted = reader.is_encrypted
+        if analysis.encrypted:
+            return analysis
+        pages = reader.pages
+        analysis.pages = len(pages)
+    except Exception as e:
+        raise ValueError(f"Invalid PDF: {e}")
+
+    counted = set()
+    font_files = {}  # idnum of a font file stream -> font is a subset
+    for page in pages:
+        box = page.mediabox
+        page_width, page_height = float(box.width), float(box.height)
+        if page.indirect_reference is not None:
+            counted.add(page.indirect_reference.idnum)
+        _count_object(analysis, page)
+
+        stack = [value for key, value in page.items() if key not in BACK_REFERENCE_KEYS]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, IndirectObject):
+                if item.idnum in counted:
+                    continue
+                idnum = item.idnum
+                item = item.get_object()
+                if isinstance(item, DictionaryObject) and item.get('/Type') == '/Page':
+                    # Link targets on other pages are counted with their own page
+                    continue
+                counted.add(idnum)
+                _count_object(analysis, item, font_files.get(idnum), page_width, page_height)
+            if isinstance(item, DictionaryObject):
+                if item.get('/Type') == '/FontDescriptor':
+                    # Subset fonts are named like /ABCDEF+Helvetica
+                    subset = str(item.get('/FontName', '')).lstrip('/')[6:7] == '+'
+                    for key in FONT_FILE_KEYS:
+                        ref = item.raw_get(key) if key in item else None
+                        if isinstance(ref, IndirectObject):
+                            font_files[ref.idnum] = subset
+                stack.extend(value for key, value in item.items() if key not in BACK_REFERENCE_KEYS)
+            elif isinstance(item, ArrayObject):
+                stack.extend(item)
+
+    # Everything else the document refers to: catalog, page tree, outlines, forms, metadata...
+    trailer = reader.trailer
+    stack = [trailer.raw_get(key) for key in ('/Root', '/Info') if key in trailer]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, IndirectObject):
+            if item.idnum in counted:
+                continue
+            counted.add(item.idnum)
+            item = item.get_object()
+            if item is None:
+                continue
+            _count_object(analysis, item)
+        if isinstance(item, DictionaryObject):
+            stack.extend(item.values())
+        elif isinstance(item, ArrayObject):
+            stack.extend(item)
+    return analysis
+
+
+class _SizeSink:
+    """File-like object that only counts what is written to it"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+def _count_object(analysis: PdfAnalysis, obj, font_subset=None, page_width: float = 0, page_height: float = 0):
+    sink = _SizeSink()
+    if isinstance(obj, StreamObject):
+        # The dictionary only; the data is counted as is
+        DictionaryObject.write_to_stream(obj, sink, None)
+        sink.size += len(obj._data)
+        _count_stream(analysis, obj, font_subset, page_width, page_height)
+    else:
+        obj.write_to_stream(sink, None)
+    analysis.objects += 1
+    analysis.used_bytes += sink.size + INDIRECT_OVERHEAD
+
+
+def _count_stream(analysis: PdfAnalysis, stream, font_subset, page_width: float, page_height: float):
+    size = len(stream._data)
+    filters = _filters(stream)
+    analysis.stream_bytes += size
+    if not filters:
+        analysis.unfiltered_bytes += size
+
+    if stream.get('/Subtype') == '/Image':
+        analysis.images += 1
+        analysis.image_bytes += size
+        dpi = _image_dpi(stream, page_width, page_height)
+        if stream.get('/ImageMask') or stream.get('/BitsPerComponent') == 1:
+            analysis.max_mono_dpi = max(analysis.max_mono_dpi, dpi)
+        else:
+            analysis.max_image_dpi = max(analysis.max_image_dpi, dpi)
+            if not any(name in COMPACT_IMAGE_FILTERS for name in filters):
+                analysis.recompressible_image_bytes += size
+    elif font_subset is not None:
+        analysis.fonts += 1
+        analysis.font_bytes += size
+        if not font_subset:
+            analysis.unsubset_font_bytes += size
+
+
+def _references(obj) -> list:
+    references = []
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, IndirectObject):
+            references.append(obj)
+        elif isinstance(obj, DictionaryObject):
+            stack.extend(obj.values())
+        elif isinstance(obj, ArrayObject):
+            stack.extend(obj)
+    return references
+
+
+def _flate(stream) -> StreamObject:
+    """Copy of an unfiltered stream, Flate-compressed"""
+    encoded = EncodedStreamObject()
+    encoded.update({key: value for key, value in stream.items() if key != '/Length'})
+    encoded[NameObject('/Filter')] = NameObject('/FlateDecode')
+    encoded._data = zlib.compress(stream._data)
+    return encoded
+
+
+def repack_pdf(input_path: str, output_path: str) -> int:
+    """
+    Losslessly rewrite a PDF: only objects reachable from the catalog and
+    document info are kept (dropping old revisions and orphaned data), under
+    their original numbers, and streams stored without a filter are
+    Flate-compressed. Returns the output size.
+    """
+    reader = PdfReader(input_path)
+    trailer = reader.trailer
+
+    output = io.BytesIO()
+    output.write(reader.pdf_header.encode('latin-1') + b'\n%\xe2\xe3\xcf\xd3\n')
+    offsets = {}
+
+    seen = set()
+    stack = _references(DictionaryObject({key: trailer.raw_get(key) for key in ('/Root', '/Info') if key in trailer}))
+    while stack:
+        ref = stack.pop()
+        if ref.idnum in seen:
+            continue
+        seen.add(ref.idnum)
+        obj = ref.get_object()
+        if obj is None:
+            continue
+        stack.extend(_references(obj))
+        if isinstance(obj, StreamObject) and '/Filter' not in obj and len(obj._data) > 0:
+            obj = _flate(obj)
+
+        offsets[ref.idnum] = (output.tell(), ref.generation)
+        output.write(b'%d %d obj\n' % (ref.idnum, ref.generation))
+        obj.write_to_stream(output, None)
+        output.write(b'\nendobj\n')
+
+    # Cross-reference table with one subsection per run of consecutive object numbers
+    xref_position = output.tell()
+    lines = ['xref\n0 1\n0000000000 65535 f \n']
+    runs = []
+    for idnum in sorted(offsets):
+        if runs and idnum == runs[-1][-1] + 1:
+            runs[-1].append(idnum)
+        else:
+            runs.append([idnum])
+    for run in runs:
+        lines.append(f'{run[0]} {len(run)}\n')
+        lines.extend(f'{offsets[idnum][0]:010d} {offsets[idnum][1]:05d} n \n' for idnum in run)
+    output.write(''.join(lines).encode('latin-1'))
+
+    trailer_entries = [f'/Size {max(offsets, default=0) + 1}']
+    for key in ('/Root', '/Info'):
+        ref = trailer.raw_get(key) if key in trailer else None
+        if isinstance(ref, IndirectObject):
+            trailer_entries.append(f'{key} {ref.idnum} {ref.generation} R')
+    if '/ID' in trailer:
+        document_id = io.BytesIO()
+        trailer['/ID'].write_to_stream(document_id, None)
+        trailer_entries.append('/ID ' + document_id.getvalue().decode('latin-1'))
+    output.write(f'trailer\n<< {" ".join(trailer_entries)} >>\nstartxref\n{xref_position}\n%%EOF\n'.encode('latin-1'))
+
+    with open(output_path, 'wb') as output_file:
+        output_file.write(output.getbuffer())
+    return output.tell()
@@ -0,0 +1,260 @@
+"""
+PDF Page Helpers
+PyPDF2 work shared by the PDF tools. The functions live in an importable
+module (not a tool's main.py) so the shared executor can run them in the
+process pool, where they really run in parallel.
+
+Readers live only as long as the call (or job) that opened them, so no
+parsed PDF stays in a worker after the request. The Splitter's splits are
+written in jobs of several splits (write_splits()); each job parses the
+input once and keeps every source object it has serialized, so fonts and
+images shared by its splits are resolved and written once instead of once
+per split. The reader and copy cache of a job are dropped when it returns.
+"""
+
+import io
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, StreamObject
+
+
+# Keys that point back up the document (parent page tree, owning page) rather
+# than to resources a page needs
+BACK_REFERENCE_KEYS = ('/Parent', '/P')
+
+# Rough serialized size of a PDF file's fixed parts and of a non-stream object
+FILE_OVERHEAD = 1024
+OBJECT_OVERHEAD = 64
+
+
+class CopyCache:
+    """Serialized source objects and per-page object sets of one reader"""
+
+    def __init__(self):
+        self.objects = {}   # idnum -> (generation, serialized object)
+        self.children = {}  # idnum -> (references it holds, is a page)
+        self.closures = {}  # page index -> {idnum: generation} the page needs
+
+
+def _serialize(obj) -> bytes:
+    output = io.BytesIO()
+    obj.write_to_stream(output, None)
+    return output.getvalue()
+
+
+def _references(obj) -> list:
+    """Indirect references held directly by an object (not following them)"""
+    references = []
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, IndirectObject):
+            references.append(obj)
+        elif isinstance(obj, DictionaryObject):
+            stack.extend(value for key, value in obj.items() if key not in BACK_REFERENCE_KEYS)
+        elif isinstance(obj, ArrayObject):
+            stack.extend(obj)
+    return references
+
+
+def _page_closure(page, cache: CopyCache) -> dict:
+    """
+    {idnum: generation} of the indirect objects a page uses (not the page
+    itself). Each object's references are looked up once per document, so
+    resources shared by many pages are only walked once.
+    """
+    closure = {}
+    stack = _references(page)
+    while stack:
+        ref = stack.pop()
+        if ref.idnum in closure:
+            continue
+        if ref.idnum not in cache.children:
+            resolved = ref.get_object()
+            is_page = isinstance(resolved, DictionaryObject) and resolved.get('/Type') == '/Page'
+            cache.children[ref.idnum] = ([] if is_page else _references(resolved), is_page)
+        references, is_page = cache.children[ref.idnum]
+        if is_page:
+            # Link targets on other pages are left dangling (read as null)
+            continue
+        closure[ref.idnum] = ref.generation
+        stack.extend(references)
+    return closure
+
+
+def page_count(input_path: str) -> int:
+    """Number of pages in a PDF"""
+    return len(PdfReader(input_path).pages)
+
+
+def write_splits(input_path: str, splits: list, max_bytes: int = None) -> list:
+    """
+    Serialize several splits of a PDF (each a list or PageSelection of
+    1-indexed pages) with one reader and copy cache, released on return.
+    Returns the PDF bytes of each split, or with max_bytes each split's
+    [(page_numbers, pdf_bytes)] parts (see write_pages_within()).
+    """
+    reader = PdfReader(input_path)
+    cache = CopyCache()
+    if max_bytes:
+        return [write_pages_within(reader, cache, list(pages), max_bytes) for pages in splits]
+    return [write_pages(reader, cache, pages) for pages in splits]
+
+
+def write_pages(reader: PdfReader, cache: CopyCache, page_numbers) -> bytes:
+    """
+    Serialize the given pages (1-indexed, in this order; a list or PageSelection) as a new PDF.
+
+    Source objects keep their object numbers (the xref simply lists the ones
+    used), so their serialized form is identical in every split and comes
+    from the copy cache after the first use. Only the page objects (new
+    /Parent), the page tree and the catalog are written per split.
+    """
+
+    page_refs = []
+    needed = {}
+    for page_num in page_numbers:
+        index = page_num - 1
+        page = reader.pages[index]
+        if index not in cache.closures:
+            cache.closures[index] = _page_closure(page, cache)
+        needed.update(cache.closures[index])
+        page_refs.append((page, page.indirect_reference))
+
+    # Object numbers past the source's, so they can't clash with any reference
+    source_size = int(reader.trailer.get('/Size', 0))
+    pages_id = max([source_size - 1, *needed, *(ref.idnum for _, ref in page_refs)]) + 1
+    catalog_id = pages_id + 1
+
+    output = io.BytesIO()
+    output.write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+    offsets = {}
+
+    def write_object(idnum: int, generation: int, body: bytes):
+        offsets[idnum] = (output.tell(), generation)
+        output.write(b'%d %d obj\n' % (idnum, generation))
+        output.write(body)
+        output.write(b'\nendobj\n')
+
+    for idnum in sorted(needed):
+        if idnum not in cache.objects:
+            generation = needed[idnum]
+            obj = IndirectObject(idnum, generation, reader).get_object()
+            cache.objects[idnum] = (generation, _serialize(obj) if obj is not None else b'null')
+        write_object(idnum, *cache.objects[idnum])
+
+    kids = []
+    for page, ref in page_refs:
+        page = DictionaryObject(page)
+        page[NameObject('/Parent')] = IndirectObject(pages_id, 0, None)
+        write_object(ref.idnum, ref.generation, _serialize(page))
+        kids.append(f'{ref.idnum} {ref.generation} R')
+
+    write_object(pages_id, 0, f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {len(kids)} >>'.encode('latin-1'))
+    write_object(catalog_id, 0, f'<< /Type /Catalog /Pages {pages_id} 0 R >>'.encode('latin-1'))
+
+    # Cross-reference table with one subsection per run of consecutive object numbers
+    xref_position = output.tell()
+    lines = ['xref\n0 1\n0000000000 65535 f \n']
+    run = []
+    for idnum in sorted(offsets):
+        if run and idnum != run[-1] + 1:
+            lines.append(_xref_section(run, offsets))
+            run = []
+        run.append(idnum)
+    lines.append(_xref_section(run, offsets))
+    output.write(''.join(lines).encode('latin-1'))
+    output.write(f'trailer\n<< /Size {catalog_id + 1} /Root {catalog_id} 0 R >>\nstartxref\n{xref_position}\n%%EOF\n'.encode('latin-1'))
+    return output.getvalue()
+
+
+def _xref_section(run: list, offsets: dict) -> str:
+    entries = ''.join(f'{offsets[idnum][0]:010d} {offsets[idnum][1]:05d} n \n' for idnum in run)
+    return f'{run[0]} {len(run)}\n{entries}'
+
+
+def outline_starts(input_path: str) -> list:
+    """(title, first page) of each top-level outline entry (bookmark), in page order"""
+    reader = PdfReader(input_path)
+    starts = []
+    for item in reader.outline:
+        if isinstance(item, list):
+            # Nested entries belong to the entry before them
+            continue
+        try:
+            page_num = reader.get_destination_page_number(item) + 1
+        except Exception:
+            continue
+        if page_num >= 1:
+            starts.append((str(item.title), page_num))
+    return sorted(starts, key=lambda start: start[1])
+
+
+def _page_objects(page, sizes: dict) -> dict:
+    """{object id: estimated size} of everything a page references, the page included"""
+    found = {}
+    start = page.get_object()
+    stack = [page]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, IndirectObject):
+            if obj.idnum in found:
+                continue
+            resolved = obj.get_object()
+            if resolved is not start and isinstance(resolved, DictionaryObject) and resolved.get('/Type') == '/Page':
+                # Link targets on other pages
+                continue
+            if obj.idnum not in sizes:
+                size = OBJECT_OVERHEAD
+                if isinstance(resolved, StreamObject):
+                    size += len(resolved._data)
+                sizes[obj.idnum] = size
+            found[obj.idnum] = sizes[obj.idnum]
+            obj = resolved
+        if isinstance(obj, DictionaryObject):
+            stack.extend(value for key, value in obj.items() if key not in BACK_REFERENCE_KEYS)
+        elif isinstance(obj, ArrayObject):
+            stack.extend(obj)
+    return found
+
+
+def size_chunks(input_path: str, max_bytes: int) -> list:
+    """
+    Group the pages into consecutive (start, end) runs whose output should
+    stay under max_bytes, estimated from the content and resources each page
+    references (shared fonts/images counted once per run). A page that is
+    larger on its own gets a run of its own.
+    """
+    reader = PdfReader(input_path)
+    sizes = {}
+    chunks = []
+    start = 1
+    included = set()
+    total = FILE_OVERHEAD
+    for page_num, page in enumerate(reader.pages, 1):
+        objects = _page_objects(page.indirect_reference or page, sizes)
+        extra = sum(size for idnum, size in objects.items() if idnum not in included)
+        if page_num > start and total + extra > max_bytes:
+            chunks.append((start, page_num - 1))
+            start = page_num
+            included = set()
+            total = FILE_OVERHEAD
+            extra = sum(objects.values())
+        included.update(objects)
+        total += extra
+    chunks.append((start, len(reader.pages)))
+    return chunks
+
+
+def write_pages_within(reader: PdfReader, cache: CopyCache, page_numbers: list, max_bytes: int) -> list:
+    """
+    Serialize consecutive pages as one or more PDFs of at most max_bytes,
+    halving a run that comes out too large (a single page is kept as is).
+    Returns [(page_numbers, pdf_bytes)] in page order.
+    """
+    data = write_pages(reader, cache, page_numbers)
+    if len(data) <= max_bytes or len(page_numbers) == 1:
+        return [(page_numbers, data)]
+    middle = len(page_numbers) // 2
+    return (write_pages_within(reader, cache, page_numbers[:middle], max_bytes)
+            + write_pages_within(reader, cache, page_numbers[middle:], max_bytes))
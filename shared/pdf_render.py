@@ -0,0 +1,45 @@
+"""
+PDF Page Rendering
+Rasterizes PDF pages with pdfium (pypdfium2, optional dependency).
+
+pdfium is not thread-safe, so run these functions in the process pool
+(shared.executor.run_in_process). Each call opens the document and closes
+it before returning, so no worker keeps an upload open after its request
+(pdfium only reads the cross-reference table and the requested page).
+"""
+
+try:
+    import pypdfium2 as pdfium
+    PDFIUM_AVAILABLE = True
+except ImportError:
+    PDFIUM_AVAILABLE = False
+
+
+def page_count(input_path: str) -> int:
+    """Number of pages in a PDF (raises ValueError if it cannot be opened)"""
+    try:
+        document = pdfium.PdfDocument(input_path)
+    except pdfium.PdfiumError as e:
+        raise ValueError(f"Invalid PDF: {e}")
+    try:
+        return len(document)
+    finally:
+        document.close()
+
+
+def render_page(input_path: str, page_index: int, dpi: int = 200, grayscale: bool = False):
+    """Render one page (0-indexed) to a PIL image (raises ValueError if pdfium fails)"""
+    try:
+        document = pdfium.PdfDocument(input_path)
+        try:
+            page = document[page_index]
+            try:
+                bitmap = page.render(scale=dpi / 72, grayscale=grayscale)
+                return bitmap.to_pil()
+            finally:
+                page.close()
+        finally:
+            document.close()
+    except pdfium.PdfiumError as e:
+        # PdfiumError doesn't always survive the trip back from the worker process
+        raise ValueError(f"Could not render page {page_index + 1}: {e}")
@@ -0,0 +1,158 @@
+"""
+PDF Stitching
+Joins PDFs page for page and collapses the resources they have in common
+(fonts, images, ICC profiles, ...) so shared data is stored once. Used by
+the PDF Merger (optional dedup) and by the PDF Compressor to reassemble
+documents compressed in page chunks.
+
+stitch_pdfs() takes and writes files only, so it can run in the process pool.
+"""
+
+import hashlib
+
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NullObject, StreamObject
+
+
+# Dictionary types that are plain shared resources (no back-references), safe to dedupe
+SHAREABLE_TYPES = ('/Font', '/FontDescriptor', '/ExtGState', '/Encoding')
+
+
+class _HashSink:
+    """File-like object that only hashes what is written to it"""
+
+    def __init__(self):
+        self.hash = hashlib.sha256()
+
+    def write(self, data):
+        self.hash.update(data)
+        return len(data)
+
+
+def _object_key(obj) -> bytes:
+    sink = _HashSink()
+    obj.write_to_stream(sink, None)
+    return sink.hash.digest()
+
+
+def _is_shareable(obj) -> bool:
+    """Objects that can be shared between pages/documents without changing the PDF"""
+    if isinstance(obj, StreamObject):
+        return True
+    if isinstance(obj, DictionaryObject):
+        return obj.get('/Type') in SHAREABLE_TYPES
+    # Indirect arrays are resources such as /Widths or [/ICCBased ...] color spaces
+    return isinstance(obj, ArrayObject)
+
+
+def _replace_references(obj, writer: PdfWriter, replaced: dict) -> bool:
+    """Point references to duplicate objects at their kept copy, in place; True if any were"""
+    changed = False
+    stack = [obj]
+    while stack:
+        container = stack.pop()
+        items = container.items() if isinstance(container, DictionaryObject) else enumerate(container)
+        for key, value in list(items):
+            if isinstance(value, IndirectObject):
+                if value.pdf is writer and value.idnum in replaced:
+                    container[key] = IndirectObject(replaced[value.idnum], 0, writer)
+                    changed = True
+            elif isinstance(value, (DictionaryObject, ArrayObject)):
+                stack.append(value)
+    return changed
+
+
+def dedupe_objects(writer: PdfWriter) -> int:
+    """
+    Collapse identical resources in a writer: streams (font files, images,
+    ICC profiles, ...) are hashed and duplicates point to a single copy;
+    repeated until no more duplicates appear, since fonts whose files were
+    merged become identical themselves.
+    Each object is serialized and hashed once; later passes only re-hash the
+    objects whose references were just rewritten, the only ones that can
+    have become duplicates.
+    Returns the number of objects removed.
+    """
+    objects = writer._objects
+    digests = {}  # idnum -> digest of each kept shareable object
+    seen = {}     # digest -> idnum of the copy kept
+    pending = [index + 1 for index, obj in enumerate(objects) if obj is not None and _is_shareable(obj)]
+    removed = 0
+    while pending:
+        replaced = {}
+        for idnum in pending:
+            previous = digests.pop(idnum, None)
+            if previous is not None and seen.get(previous) == idnum:
+                del seen[previous]
+            digest = _object_key(objects[idnum - 1])
+            kept = seen.setdefault(digest, idnum)
+            if kept != idnum:
+                replaced[idnum] = kept
+            else:
+                digests[idnum] = digest
+
+        if not replaced:
+            return removed
+
+        for idnum in replaced:
+            # The xref table is written by position, so keep a placeholder rather than removing the slot
+            objects[idnum - 1] = NullObject()
+        changed = [index + 1 for index, obj in enumerate(objects)
+                   if isinstance(obj, (DictionaryObject, ArrayObject))
+                   and _replace_references(obj, writer, replaced)]
+        pending = [idnum for idnum in changed if idnum in digests]
+        removed += len(replaced)
+    return removed
+
+
+def _copy_outline(source: PdfReader, writer: PdfWriter, items: list, parent=None):
+    """Recreate an outline (bookmark tree) of source in writer, whose pages are in the same order"""
+    last = None
+    for item in items:
+        if isinstance(item, list):
+            # Children of the preceding entry
+            if last is not None:
+                _copy_outline(source, writer, item, last)
+            continue
+        try:
+            page_index = source.get_destination_page_number(item)
+        except Exception:
+            page_index = None
+        if page_index is None or not 0 <= page_index < len(writer.pages):
+            last = None
+            continue
+        last = writer.add_outline_item(item.title, page_index, parent=parent)
+
+
+def stitch_pdfs(input_paths: list, output_path: str, outline_path: str = None) -> tuple:
+    """
+    Concatenate PDFs into output_path and store their common resources once.
+
+    outline_path: Optional PDF with the same pages (e.g. the original of
+    chunks compressed separately) whose bookmarks are copied to the output;
+    the inputs' own bookmarks are dropped.
+    Returns (page count, number of duplicate objects removed).
+    """
+    writer = PdfWriter()
+    handles = [open(path, 'rb') for path in input_paths]
+    try:
+        for handle in handles:
+            writer.append(PdfReader(handle), import_outline=outline_path is None)
+
+        removed = dedupe_objects(writer)
+
+        if outline_path is not None:
+            source = PdfReader(outline_path)
+            try:
+                outline = source.outline
+            except Exception:
+                outline = []
+            if outline and len(source.pages) == len(writer.pages):
+                _copy_outline(source, writer, outline)
+
+        with open(output_path, 'wb') as output_file:
+            writer.write(output_file)
+        return len(writer.pages), removed
+    finally:
+        for handle in handles:
+            handle.close()
@@ -0,0 +1,266 @@
+"""
+Async Process Runner
+Runs external binaries (Ghostscript, FFmpeg, LibreOffice) with
+asyncio.create_subprocess_exec so they never block the event loop.
+
+- Timeouts kill the whole process group (no orphaned children or zombies)
+- Concurrent processes are capped per binary
+- stderr can be streamed line by line (e.g. for FFmpeg progress)
+- stream_process() pipes data into stdin and hands stdout over as it is produced
+
+Configuration (environment variables):
+- TOOLS_MAX_PROCESSES: Default max concurrent processes per binary (default: CPU count)
+- TOOLS_MAX_PROCESSES_<BINARY>: Per-binary override (e.g. TOOLS_MAX_PROCESSES_FFMPEG=2)
+"""
+
+import asyncio
+import os
+import re
+import signal
+
+
+DEFAULT_MAX_PROCESSES = int(os.environ.get('TOOLS_MAX_PROCESSES', os.cpu_count() or 4))
+
+# Keep at most this much stderr in memory per process
+STDERR_LIMIT = 64 * 1024
+
+_semaphores = {}
+
+
+class ProcessTimeout(Exception):
+    """Raised when a process exceeds its timeout (the process group is killed)"""
+
+
+class ProcessResult:
+    """Exit status and output of a finished process"""
+
+    def __init__(self, returncode, stdout, stderr):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+def binary_key(cmd) -> str:
+    """Concurrency key for a command: the binary name without path"""
+    return os.path.basename(cmd[0])
+
+
+def process_limit(binary: str) -> int:
+    """Max concurrent processes of a binary (TOOLS_MAX_PROCESSES_<BINARY> or the default)"""
+    env_key = 'TOOLS_MAX_PROCESSES_' + re.sub(r'[^A-Z0-9]+', '_', binary.upper()).strip('_')
+    return max(1, int(os.environ.get(env_key, DEFAULT_MAX_PROCESSES)))
+
+
+def _get_semaphore(binary: str) -> asyncio.Semaphore:
+    semaphore = _semaphores.get(binary)
+    if semaphore is None:
+        semaphore = _semaphores.setdefault(binary, asyncio.Semaphore(process_limit(binary)))
+    return semaphore
+
+
+def kill_process_group(process):
+    """Kill a process started by run_process along with all of its children"""
+    if process.returncode is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    except Exception:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+
+
+async def _read_stderr(stream, on_stderr):
+    """Collect stderr, calling on_stderr for every line (FFmpeg ends progress lines with \\r)"""
+    collected = bytearray()
+    pending = b''
+    while True:
+        chunk = await stream.read(4096)
+        if not chunk:
+            break
+        collected.extend(chunk)
+        if len(collected) > STDERR_LIMIT:
+            del collected[:len(collected) - STDERR_LIMIT]
+        if on_stderr:
+            pending += chunk
+            lines = re.split(rb'[\r\n]', pending)
+            pending = lines.pop()
+            for line in lines:
+                if line.strip():
+                    on_stderr(line.decode('utf-8', errors='replace'))
+    if on_stderr and pending.strip():
+        on_stderr(pending.decode('utf-8', errors='replace'))
+    return bytes(collected)
+
+
+async def run_process(cmd, timeout: float, text: bool = False, on_stderr=None, cwd: str = None, env: dict = None) -> ProcessResult:
+    """
+    Run a command and wait for it without blocking the event loop.
+
+    Waits for a free slot for the binary first; the timeout only covers
+    the run itself. Raises ProcessTimeout on timeout and FileNotFoundError
+    if the binary does not exist.
+    """
+    async with _get_semaphore(binary_key(cmd)):
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd,
+            env=env,
+            start_new_session=True  # Own process group, so timeouts can kill children too
+        )
+
+        output = asyncio.gather(
+            process.stdout.read(),
+            _read_stderr(process.stderr, on_stderr),
+            process.wait()
+        )
+        # Abandoned on timeout/cancel; mark its CancelledError as seen so asyncio doesn't log it
+        output.add_done_callback(lambda future: future.cancelled() or future.exception())
+        try:
+            stdout, stderr, _ = await asyncio.wait_for(output, timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"[Process Runner] {binary_key(cmd)} timed out after {timeout}s, killing process group")
+            kill_process_group(process)
+            await process.wait()
+            raise ProcessTimeout(f"{binary_key(cmd)} timed out after {timeout} seconds")
+        except BaseException:
+            # Cancelled (e.g. client disconnected) - don't leave the process running
+            kill_process_group(process)
+            await process.wait()
+            raise
+
+    if text:
+        stdout = stdout.decode('utf-8', errors='replace')
+        stderr = stderr.decode('utf-8', errors='replace')
+
+    return ProcessResult(process.returncode, stdout, stderr)
+
+
+class ProcessStream:
+    """
+    A running process whose stdout is read incrementally (see stream_process).
+    stdin can be fed from an async iterator of bytes while the output is read.
+    """
+
+    def __init__(self, cmd, timeout: float, stdin_chunks=None, on_stderr=None):
+        self.cmd = cmd
+        self.timeout = timeout
+        self.returncode = None
+        self.stderr = b''
+        self._stdin_chunks = stdin_chunks
+        self._on_stderr = on_stderr
+        self._semaphore = _get_semaphore(binary_key(cmd))
+        self._process = None
+        self._tasks = []
+        self._feed_error = None
+        self._closed = False
+
+    async def _start(self, cwd: str = None, env: dict = None):
+        await self._semaphore.acquire()
+        try:
+            self._process = await asyncio.create_subprocess_exec(
+                *self.cmd,
+                stdin=asyncio.subprocess.PIPE if self._stdin_chunks is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=cwd,
+                env=env,
+                start_new_session=True  # Own process group, so timeouts can kill children too
+            )
+        except BaseException:
+            self._semaphore.release()
+            self._closed = True
+            raise
+        self._deadline = asyncio.get_running_loop().time() + self.timeout
+        self._stderr_task = asyncio.create_task(_read_stderr(self._process.stderr, self._on_stderr))
+        self._tasks.append(self._stderr_task)
+        if self._stdin_chunks is not None:
+            self._tasks.append(asyncio.create_task(self._feed(self._stdin_chunks)))
+
+    async def _feed(self, chunks):
+        """Copy chunks to stdin; a failing source (e.g. upload too large) kills the process"""
+        stdin = self._process.stdin
+        iterator = chunks.__aiter__()
+        try:
+            async for chunk in iterator:
+                stdin.write(chunk)
+                await stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # The process stopped reading (it exited or has all it needs)
+            pass
+        except Exception as e:
+            self._feed_error = e
+            kill_process_group(self._process)
+        finally:
+            aclose = getattr(iterator, 'aclose', None)
+            if aclose:
+                await aclose()
+            try:
+                stdin.close()
+            except Exception:
+                pass
+
+    async def _before_deadline(self, awaitable):
+        remaining = self._deadline - asyncio.get_running_loop().time()
+        try:
+            return await asyncio.wait_for(awaitable, timeout=max(0.0, remaining))
+        except asyncio.TimeoutError:
+            print(f"[Process Runner] {binary_key(self.cmd)} timed out after {self.timeout}s, killing process group")
+            kill_process_group(self._process)
+            raise ProcessTimeout(f"{binary_key(self.cmd)} timed out after {self.timeout} seconds")
+
+    async def read(self, size: int = 64 * 1024) -> bytes:
+        """Next chunk of stdout, or b'' once the process has closed it"""
+        return await self._before_deadline(self._process.stdout.read(size))
+
+    async def wait(self) -> int:
+        """
+        Wait for the process to exit and return its exit code (stderr is then available).
+        Re-raises the error of a failed stdin source.
+        """
+        await self._before_deadline(self._process.wait())
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.stderr = self._stderr_task.result() if not self._stderr_task.cancelled() else b''
+        self.returncode = self._process.returncode
+        if self._feed_error is not None:
+            raise self._feed_error
+        return self.returncode
+
+    async def close(self):
+        """Kill the process if it is still running and free its slot (safe to call twice)"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            kill_process_group(self._process)
+            await self._process.wait()
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        finally:
+            self._semaphore.release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+async def stream_process(cmd, timeout: float, stdin_chunks=None, on_stderr=None, cwd: str = None, env: dict = None) -> ProcessStream:
+    """
+    Start a command whose stdout is consumed as it is produced.
+
+    stdin_chunks: Optional async iterable of bytes piped to stdin
+    Waits for a free slot for the binary first; the timeout covers the run
+    itself. Always close() the returned ProcessStream (or use it with async with).
+    """
+    process = ProcessStream(cmd, timeout, stdin_chunks, on_stderr)
+    await process._start(cwd, env)
+    return process
@@ -0,0 +1,171 @@
+"""
+Result Cache
+Disk-backed cache for deterministic tool operations, keyed by the
+SHA-256 of the input plus the normalized parameters. Entries expire
+after a TTL and the cache is kept under a size limit by evicting the
+least recently used entries. The cache directory is swept at most once
+per EVICT_INTERVAL, or sooner once a tenth of the size limit has been
+stored since the last sweep, so the limit can be overshot by that much.
+
+Configuration (environment variables):
+- TOOLS_CACHE_ENABLED: Set to 0 to disable caching (default: 1)
+- TOOLS_CACHE_DIR: Cache directory (default: <system temp dir>/tool-studio-cache)
+- TOOLS_CACHE_MAX_MB: Max total cache size (default: 2048)
+- TOOLS_CACHE_TTL_SECONDS: Max age of an entry (default: 86400)
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from shared.executor import run_blocking
+
+
+CACHE_ENABLED = os.environ.get('TOOLS_CACHE_ENABLED', '1') != '0'
+CACHE_DIR = os.environ.get('TOOLS_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'tool-studio-cache'))
+CACHE_MAX_BYTES = int(float(os.environ.get('TOOLS_CACHE_MAX_MB', 2048)) * 1024 * 1024)
+CACHE_TTL = float(os.environ.get('TOOLS_CACHE_TTL_SECONDS', 86400))
+
+TOOL_NAME = 'result-cache'
+
+# Seconds between sweeps of the cache directory, and the share of
+# CACHE_MAX_BYTES stored since the last sweep that triggers one early
+EVICT_INTERVAL = 60
+EVICT_STORED_FRACTION = 0.1
+
+_evict_lock = threading.Lock()
+_last_evict = 0.0
+_stored_since_evict = 0
+
+
+def cache_key(tool: str, content_hash: str, params: dict) -> str:
+    """Key for a result: tool + input hash + parameters (order-independent)"""
+    payload = json.dumps({"tool": tool, "input": content_hash, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _entry_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, key[:2], key)
+
+
+def _materialize(path: str, suffix: str) -> str:
+    """
+    Give the caller its own path to the cached file (hard link, or copy across devices)
+    so eviction can never remove a file that is still being served.
+    """
+    fd, target = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    os.unlink(target)
+    try:
+        os.link(path, target)
+    except OSError:
+        shutil.copyfile(path, target)
+    return target
+
+
+def lookup(tool: str, content_hash: str, params: dict, suffix: str = '') -> str:
+    """
+    Return a private copy of the cached result, or None on a miss.
+    The caller owns (and must delete) the returned path.
+    """
+    if not CACHE_ENABLED or not content_hash:
+        return None
+    path = _entry_path(cache_key(tool, content_hash, params))
+    try:
+        age = time.time() - os.path.getmtime(path)
+    except OSError:
+        return None
+    if age > CACHE_TTL:
+        _remove(path)
+        return None
+    try:
+        # Reading counts as use for LRU eviction
+        os.utime(path, (time.time(), os.path.getmtime(path)))
+        return _materialize(path, suffix)
+    except OSError:
+        return None
+
+
+def store(tool: str, content_hash: str, params: dict, result_path: str):
+    """Copy a result file into the cache, then evict old entries if a sweep is due"""
+    if not CACHE_ENABLED or not content_hash:
+        return
+    path = _entry_path(cache_key(tool, content_hash, params))
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        shutil.copyfile(result_path, tmp_path)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+    except OSError as e:
+        print(f"[Result Cache] Error storing result: {e}")
+        return
+    if _evict_due(size):
+        evict()
+
+
+def _evict_due(stored: int) -> bool:
+    """Count stored bytes; True when the cache directory should be swept"""
+    global _stored_since_evict
+    with _evict_lock:
+        _stored_since_evict += stored
+        return (time.monotonic() - _last_evict >= EVICT_INTERVAL
+                or _stored_since_evict >= CACHE_MAX_BYTES * EVICT_STORED_FRACTION)
+
+
+def _remove(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def evict():
+    """Drop expired entries, then least recently used ones until under CACHE_MAX_BYTES"""
+    global _last_evict, _stored_since_evict
+    with _evict_lock:
+        _last_evict = time.monotonic()
+        _stored_since_evict = 0
+        entries = []
+        now = time.time()
+        for root, _, filenames in os.walk(CACHE_DIR):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if now - stat.st_mtime > CACHE_TTL:
+                    _remove(path)
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        if total <= CACHE_MAX_BYTES:
+            return
+        for _, size, path in sorted(entries):
+            _remove(path)
+            total -= size
+            if total <= CACHE_MAX_BYTES:
+                break
+
+
+async def get_cached(tool: str, content_hash: str, params: dict, suffix: str = '') -> str:
+    """Async lookup() that keeps file I/O off the event loop"""
+    if not CACHE_ENABLED:
+        return None
+    return await run_blocking(TOOL_NAME, lookup, tool, content_hash, params, suffix, kind='thread')
+
+
+async def store_result(tool: str, content_hash: str, params: dict, result_path: str):
+    """Async store() that keeps file I/O off the event loop"""
+    if not CACHE_ENABLED:
+        return
+    await run_blocking(TOOL_NAME, store, tool, content_hash, params, result_path, kind='thread')
@@ -0,0 +1,81 @@
+"""
+Tests for page range parsing and selections (run with pytest)
+"""
+
+import pytest
+
+from shared.page_ranges import PageSelection
+
+
+def pages(spec: str, total_pages: int = 10) -> list:
+    return list(PageSelection.parse(spec, total_pages))
+
+
+def test_parse_pages_and_ranges():
+    assert pages('1, 3, 5-7') == [1, 3, 5, 6, 7]
+    assert pages('5..7') == [5, 6, 7]
+    assert pages('7, 1-3, 2') == [1, 2, 3, 7]
+
+
+def test_parse_negative_and_open_ended():
+    assert pages('-1') == [10]
+    assert pages('-3--1') == [8, 9, 10]
+    assert pages('8-') == [8, 9, 10]
+    assert pages('..3') == [1, 2, 3]
+
+
+def test_parse_steps_and_keywords():
+    assert pages('1-10/3') == [1, 4, 7, 10]
+    assert pages('3-/5', 20) == [3, 8, 13, 18]
+    assert pages('odd') == [1, 3, 5, 7, 9]
+    assert pages('EVEN') == [2, 4, 6, 8, 10]
+    assert pages('all') == list(range(1, 11))
+
+
+def test_parse_overlapping_steps():
+    selection = PageSelection.parse('odd, 1-10/3', 10)
+    assert list(selection) == [1, 3, 4, 5, 7, 9, 10]
+    assert len(selection) == 7
+    assert 4 in selection and 2 not in selection
+
+
+def test_parse_huge_range_is_not_expanded():
+    selection = PageSelection.parse('2-', 100000000)
+    assert len(selection) == 99999999
+    assert selection.ranges == [(2, 100000000, 1)]
+
+
+@pytest.mark.parametrize('spec', ['0', '11', '-11', '5-3', 'abc', '1-2-3', '1-10/0', '/2', '-'])
+def test_parse_errors(spec):
+    with pytest.raises(ValueError):
+        PageSelection.parse(spec, 10)
+
+
+def test_parse_empty_items():
+    assert not PageSelection.parse(' , ,', 10)
+    assert pages('1,,2,') == [1, 2]
+
+
+def test_invert():
+    assert list(PageSelection.parse('1, 3-5', 7).invert()) == [2, 6, 7]
+    assert list(PageSelection.parse('even', 7).invert()) == [1, 3, 5, 7]
+    assert not PageSelection.parse('all', 7).invert()
+    assert list(PageSelection([], 3).invert()) == [1, 2, 3]
+
+
+def test_from_pages():
+    selection = PageSelection.from_pages([5, 1, 2, 3, 5], 10)
+    assert selection.ranges == [(1, 3, 1), (5, 5, 1)]
+    assert str(selection) == '1-3, 5'
+
+
+@pytest.mark.parametrize('page_num', [0, 11, '3', True, 2.0])
+def test_from_pages_errors(page_num):
+    with pytest.raises(ValueError):
+        PageSelection.from_pages([1, page_num], 10)
+
+
+def test_str_round_trips():
+    selection = PageSelection.parse('1-9/4, 10', 10)
+    assert str(selection) == '1-9/4, 10'
+    assert list(PageSelection.parse(str(selection), 10)) == list(selection)
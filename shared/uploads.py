@@ -0,0 +1,411 @@
+"""
+Streaming Upload Ingestion
+Parses multipart request bodies as they arrive and streams file parts
+straight to temporary files in chunks, so peak memory stays flat no
+matter how large the upload is.
+
+- Size limits are enforced early (Content-Length) and while streaming
+- Each file is SHA-256 hashed as it is written
+- Text fields are returned as strings, files as SavedUpload objects
+- stream_form() hands a file over chunk by chunk instead, for tools that
+  can process it while it is still arriving
+
+Configuration (environment variables):
+- TOOLS_MAX_UPLOAD_MB_<TOOL>: Per-tool override of the max file size (e.g. TOOLS_MAX_UPLOAD_MB_VIDEO_TO_AUDIO=4096)
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+
+from starlette.responses import StreamingResponse
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+CHUNK_SIZE = 1024 * 1024
+MAX_FIELD_SIZE = 16 * 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds its size limit"""
+
+
+class SavedUpload:
+    """An uploaded file that has been streamed to a temporary file"""
+
+    def __init__(self, field: str, filename: str, content_type: str, path: str):
+        self.field = field
+        self.filename = filename
+        self.content_type = content_type
+        self.path = path
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self.sha256 = None
+
+    def cleanup(self):
+        if self.path and os.path.exists(self.path):
+            try:
+                os.unlink(self.path)
+            except Exception as e:
+                print(f"[Uploads] Error cleaning up file {self.path}: {e}")
+
+
+class StreamedForm:
+    """Form fields and saved files, with the same lookups as Starlette's FormData"""
+
+    def __init__(self):
+        self.items = []
+
+    def get(self, key: str, default=None):
+        for name, value in self.items:
+            if name == key:
+                return value
+        return default
+
+    def getlist(self, key: str) -> list:
+        return [value for name, value in self.items if name == key]
+
+    def multi_items(self) -> list:
+        return list(self.items)
+
+    @property
+    def files(self) -> list:
+        return [value for _, value in self.items if isinstance(value, SavedUpload)]
+
+    def cleanup(self):
+        """Delete every saved file"""
+        for upload in self.files:
+            upload.cleanup()
+
+
+def max_upload_size(tool: str, default_mb: int) -> int:
+    """Max file size in bytes for a tool (env TOOLS_MAX_UPLOAD_MB_<TOOL> overrides)"""
+    env_key = 'TOOLS_MAX_UPLOAD_MB_' + re.sub(r'[^A-Z0-9]+', '_', tool.upper()).strip('_')
+    return int(float(os.environ.get(env_key, default_mb)) * 1024 * 1024)
+
+
+def _mb(size: int) -> str:
+    return f"{round(size / (1024 * 1024), 2):g}"
+
+
+def _safe_suffix(filename: str) -> str:
+    """Keep the extension (FFmpeg/LibreOffice rely on it) but nothing path-like"""
+    extension = os.path.splitext(filename or '')[1]
+    return extension if re.fullmatch(r'\.[A-Za-z0-9]{1,10}', extension) else ''
+
+
+def _new_saved_upload(field: str, filename: str, content_type: str):
+    fd, path = tempfile.mkstemp(suffix=_safe_suffix(filename))
+    return SavedUpload(field, filename, content_type, path), os.fdopen(fd, 'wb')
+
+
+async def save_upload(upload, max_size: int, field: str = 'file') -> SavedUpload:
+    """Copy an already-parsed Starlette UploadFile to disk in chunks"""
+    saved, handle = _new_saved_upload(field, upload.filename, upload.content_type)
+    try:
+        with handle:
+            while True:
+                chunk = await upload.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                saved.size += len(chunk)
+                if saved.size > max_size:
+                    raise UploadTooLarge(
+                        f"File '{upload.filename}' exceeds the {_mb(max_size)} MB limit"
+                    )
+                saved._hash.update(chunk)
+                handle.write(chunk)
+    except BaseException:
+        saved.cleanup()
+        raise
+    saved.sha256 = saved._hash.hexdigest()
+    return saved
+
+
+async def _iter_parts(request, max_total_size: int = None):
+    """
+    Low-level multipart reader. Yields ('part', (name, filename, content_type)) when a
+    part's headers are complete (filename is None for plain fields), ('data', bytes)
+    for its content and ('end', None) when it finishes.
+    """
+    content_type, params = parse_options_header(request.headers.get('content-type', ''))
+    charset = params.get(b'charset', b'utf-8').decode('latin-1')
+    events = []
+    header = {'field': b'', 'value': b''}
+
+    def on_part_begin():
+        events.append(('begin', None))
+
+    def on_header_field(data, start, end):
+        header['field'] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header['value'] += data[start:end]
+
+    def on_header_end():
+        events.append(('header', (header['field'].lower(), header['value'])))
+        header['field'] = b''
+        header['value'] = b''
+
+    def on_headers_finished():
+        events.append(('headers_done', None))
+
+    def on_part_data(data, start, end):
+        events.append(('data', data[start:end]))
+
+    def on_part_end():
+        events.append(('end', None))
+
+    parser = MultipartParser(params.get(b'boundary', b''), {
+        'on_part_begin': on_part_begin,
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_headers_finished': on_headers_finished,
+        'on_part_data': on_part_data,
+        'on_part_end': on_part_end,
+    })
+
+    total = 0
+    headers = {}
+
+    async for chunk in request.stream():
+        total += len(chunk)
+        if max_total_size is not None and total > max_total_size:
+            raise UploadTooLarge(f"Upload exceeds the {_mb(max_total_size)} MB limit")
+
+        parser.write(chunk)
+
+        # Hand the events over before yielding, so the consumer can stop at any point
+        pending = events[:]
+        events.clear()
+        for event, payload in pending:
+            if event == 'begin':
+                headers = {}
+            elif event == 'header':
+                headers[payload[0]] = payload[1]
+            elif event == 'headers_done':
+                _, options = parse_options_header(headers.get(b'content-disposition', b''))
+                name = options.get(b'name', b'').decode(charset)
+                filename = options[b'filename'].decode(charset) if b'filename' in options else None
+                part_type = headers.get(b'content-type', b'').decode('latin-1') or None
+                yield 'part', (name, filename, part_type)
+            elif event == 'data':
+                yield 'data', payload
+            elif event == 'end':
+                yield 'end', None
+
+    parser.finalize()
+
+
+def _is_streamable(request, max_total_size: int = None) -> bool:
+    """Check the upload limit up front and whether the body can be parsed incrementally"""
+    if max_total_size is not None:
+        content_length = request.headers.get('content-length')
+        if content_length and content_length.isdigit() and int(content_length) > max_total_size:
+            raise UploadTooLarge(f"Upload exceeds the {_mb(max_total_size)} MB limit")
+
+    content_type, _ = parse_options_header(request.headers.get('content-type', ''))
+    # Not multipart (e.g. urlencoded) or already parsed upstream - let Starlette handle it
+    return content_type == b'multipart/form-data' and getattr(request, '_form', None) is None
+
+
+async def iter_form(request, max_file_size: int, max_total_size: int = None):
+    """
+    Stream a multipart request, yielding (name, value) pairs as each part completes.
+    value is a str for fields and a SavedUpload for files.
+
+    Raises UploadTooLarge as soon as a limit is exceeded. On error or early exit,
+    files saved so far are left for the caller to clean up.
+    """
+    if not _is_streamable(request, max_total_size):
+        form = await request.form()
+        for name, value in form.multi_items():
+            if isinstance(value, str):
+                yield name, value
+            else:
+                yield name, await save_upload(value, max_file_size, name)
+        return
+
+    _, params = parse_options_header(request.headers.get('content-type', ''))
+    charset = params.get(b'charset', b'utf-8').decode('latin-1')
+    part = None  # (name, SavedUpload, file handle) or (name, bytearray, None)
+
+    try:
+        async for event, payload in _iter_parts(request, max_total_size):
+            if event == 'part':
+                name, filename, part_type = payload
+                if filename is not None:
+                    saved, handle = _new_saved_upload(name, filename, part_type)
+                    part = (name, saved, handle)
+                else:
+                    part = (name, bytearray(), None)
+            elif event == 'data':
+                name, target, handle = part
+                if handle is None:
+                    target.extend(payload)
+                    if len(target) > MAX_FIELD_SIZE:
+                        raise UploadTooLarge(f"Form field '{name}' is too large")
+                else:
+                    target.size += len(payload)
+                    if target.size > max_file_size:
+                        raise UploadTooLarge(
+                            f"File '{target.filename}' exceeds the {_mb(max_file_size)} MB limit"
+                        )
+                    target._hash.update(payload)
+                    handle.write(payload)
+            elif event == 'end':
+                name, target, handle = part
+                part = None
+                if handle is None:
+                    yield name, target.decode(charset)
+                else:
+                    handle.close()
+                    target.sha256 = target._hash.hexdigest()
+                    yield name, target
+    finally:
+        # A file part interrupted mid-stream is not yielded, so remove it here
+        if part is not None and part[2] is not None:
+            part[2].close()
+            part[1].cleanup()
+
+
+async def read_form(request, max_file_size: int, max_total_size: int = None) -> StreamedForm:
+    """Stream the whole multipart request to disk and return the parsed form"""
+    form = StreamedForm()
+    try:
+        async for name, value in iter_form(request, max_file_size, max_total_size):
+            form.items.append((name, value))
+    except BaseException:
+        form.cleanup()
+        raise
+    return form
+
+
+class UploadStream:
+    """
+    A file part read straight from the request body, chunk by chunk (see stream_form).
+    Iterate over it (or call read()) exactly once; size and sha256 are filled in as it goes.
+    """
+
+    def __init__(self, field: str, filename: str, content_type: str, source, max_size: int):
+        self.field = field
+        self.filename = filename
+        self.content_type = content_type
+        self.size = 0
+        self.sha256 = None
+        self.done = asyncio.Event()
+        self._hash = hashlib.sha256()
+        self._source = source
+        self._max_size = max_size
+        self._iterator = self._iterate()
+
+    async def _iterate(self):
+        try:
+            async for chunk in self._source:
+                self.size += len(chunk)
+                if self.size > self._max_size:
+                    raise UploadTooLarge(
+                        f"File '{self.filename}' exceeds the {_mb(self._max_size)} MB limit"
+                    )
+                self._hash.update(chunk)
+                yield chunk
+            self.sha256 = self._hash.hexdigest()
+        finally:
+            self.done.set()
+
+    def __aiter__(self):
+        return self._iterator
+
+    async def read(self, size: int = -1) -> bytes:
+        """Next chunk of the file (any size), or b'' at the end - enough for save_upload()"""
+        try:
+            return await self._iterator.__anext__()
+        except StopAsyncIteration:
+            return b''
+
+    async def aclose(self):
+        await self._iterator.aclose()
+
+
+async def _part_data(parts):
+    """Data of the current part from _iter_parts(), up to its end"""
+    async for event, payload in parts:
+        if event == 'data':
+            yield payload
+        elif event == 'end':
+            return
+
+
+async def _upload_file_data(upload):
+    """Chunks of an already-parsed Starlette UploadFile"""
+    while True:
+        chunk = await upload.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def stream_form(request, max_file_size: int, max_total_size: int = None):
+    """
+    Read form fields up to the first file part and return (fields, UploadStream)
+    without touching the disk, so the file can be processed while it is still arriving.
+
+    Only fields sent before the file are seen (clients should send them first);
+    anything after the file is ignored. The UploadStream is None if there is no file.
+    """
+    fields = StreamedForm()
+
+    if not _is_streamable(request, max_total_size):
+        form = await request.form()
+        for name, value in form.multi_items():
+            if isinstance(value, str):
+                fields.items.append((name, value))
+            else:
+                return fields, UploadStream(name, value.filename, value.content_type, _upload_file_data(value), max_file_size)
+        return fields, None
+
+    _, params = parse_options_header(request.headers.get('content-type', ''))
+    charset = params.get(b'charset', b'utf-8').decode('latin-1')
+    parts = _iter_parts(request, max_total_size)
+    field = None
+
+    async for event, payload in parts:
+        if event == 'part':
+            name, filename, part_type = payload
+            if filename is not None:
+                return fields, UploadStream(name, filename, part_type, _part_data(parts), max_file_size)
+            field = (name, bytearray())
+        elif event == 'data':
+            field[1].extend(payload)
+            if len(field[1]) > MAX_FIELD_SIZE:
+                raise UploadTooLarge(f"Form field '{field[0]}' is too large")
+        elif event == 'end':
+            fields.items.append((field[0], field[1].decode(charset)))
+            field = None
+
+    return fields, None
+
+
+class UploadStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that may start sending while the request body is still being read
+    (e.g. FFmpeg output for an upload that is piped into FFmpeg).
+
+    Starlette watches for client disconnects by calling receive(), which would swallow
+    the rest of the upload, so that only starts once the upload has been fully read.
+    """
+
+    def __init__(self, content, upload: UploadStream, **kwargs):
+        super().__init__(content, **kwargs)
+        self.upload = upload
+
+    async def listen_for_disconnect(self, receive):
+        await self.upload.done.wait()
+        await super().listen_for_disconnect(receive)
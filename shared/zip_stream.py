@@ -0,0 +1,71 @@
+"""
+Streaming ZIP Writer
+Builds ZIP archives incrementally so they can be sent while entries are
+still being produced, without writing the archive (or its entries) to disk.
+
+Entries are STORED by default: PDFs and most media are already compressed,
+so DEFLATE costs CPU for little gain. Compression runs in the shared
+executor so it never blocks the event loop.
+"""
+
+import time
+import zipfile
+
+from shared.executor import run_blocking
+
+
+TOOL_NAME = 'zip-stream'
+
+
+class _Sink:
+    """Write-only, non-seekable target; zipfile then uses data descriptors"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class ZipStream:
+    """A ZIP archive written piece by piece; add() and close() return the new bytes"""
+
+    def __init__(self, compression: int = zipfile.ZIP_STORED):
+        self.compression = compression
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, 'w', compression=compression)
+
+    def add(self, filename: str, data: bytes) -> bytes:
+        info = zipfile.ZipInfo(filename, date_time=time.localtime()[:6])
+        info.compress_type = self.compression
+        info.external_attr = 0o644 << 16
+        self._zip.writestr(info, data)
+        return self._sink.take()
+
+    def close(self) -> bytes:
+        """Write the central directory"""
+        self._zip.close()
+        return self._sink.take()
+
+
+async def stream_zip(entries, compression: int = zipfile.ZIP_STORED):
+    """
+    Async generator of ZIP bytes for an async iterable of (filename, data) entries.
+    Each entry is sent as soon as it is available.
+    """
+    archive = ZipStream(compression)
+    async for filename, data in entries:
+        if compression == zipfile.ZIP_STORED:
+            yield archive.add(filename, data)
+        else:
+            yield await run_blocking(TOOL_NAME, archive.add, filename, data, kind='thread')
+    yield archive.close()